@@ -1,24 +1,114 @@
 # app.py
-from nicegui import ui
-import json
-from datetime import date
-from objects.task import TaskList, Task
-from objects.state import State, attributes
-from utils import load_profile
+from nicegui import ui, app, background_tasks
+from objects.state import attributes
+from objects.tenants import TenantCache
+from objects.scheduler import Scheduler
+from objects.notify import Notifier
+from objects.persist import LockedError
+from objects.forecast import forecast
+from objects.planner import plan_tasks
+from objects.templates import TemplateLibrary
+from objects.task import share_effects
+from objects.instrument import REGISTRY, timed, setup_logging, monitor_loop_lag
+from fastapi import HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from utils import load_profile, load_profile_async, check_profile, check_tasks, check_templates
+import logging
+import os
+import time
 
 # ------------------------
 # 数据定义
 # ------------------------
 
 
-PROFILE_FILE = './profile.json'
-STATE_FILE = './state.json'
-TASK_FILE = './tasks.json'
-
-profile = load_profile(PROFILE_FILE)
-state = State(filename=STATE_FILE, init=False)
-task_list = TaskList(TASK_FILE)
-
+SAVE_WINDOW = 30  # 秒，窗口内的多次保存合并为一次落盘
+DB_NAME = None  # 设为 'katachi.db' 改用 SQLite 存储（每个用户目录一个库），首次启动时从 json 文件导入；多进程/多实例部署必须用它
+NOTIFY_DIR = './.notify'  # SQLite 模式下进程间改动通知用的 Unix 套接字目录
+DECAY_STEP = 1  # 属性值至少变化这么多（进度条 1%）才推送到界面
+FORECAST_THRESHOLD = 30  # 预测提示的低值阈值
+PLAN_TARGETS = (50, 60, 70, 80)  # 建议任务面板可选的目标下限（所有属性相同，上限 100）
+PORT = int(os.environ.get('KATACHI_PORT', 8080))  # 压测（benchmarks/load.py）在其他端口启动本地实例
+LOG_LEVEL = None  # None 时读环境变量 KATACHI_LOG_LEVEL（默认 INFO），'OFF' 关闭日志，'DEBUG' 输出每次操作
+USERS_DIR = './users'  # /u/<用户名> 的数据目录；/ 仍使用当前目录下的 state.json、tasks.json
+MAX_TENANTS = 1000  # 最多常驻内存的用户数
+TENANT_IDLE_TIMEOUT = 30 * 60  # 秒，没有打开的页面且这么久未访问的用户会被落盘并移出内存
+DEFAULT_DIR = './default'  # 新用户和“重置状态与任务”用的默认配置
+TEMPLATES_FILE = './default/task_templates.json'  # “其他”标签页里可搜索的任务模板库
+TEMPLATE_RESULTS = 8  # 模板搜索最多显示几条
+
+logger = logging.getLogger('katachi.app')
+# 以下由 create_app 创建，导入本模块不会启动任何东西
+scheduler = None  # 所有用户共用一个按到期时间排序的任务队列（凌晨重置、落盘、保存、淘汰、提醒）
+notifier = None   # 其他进程改了数据时通知本进程刷新（仅 SQLite 模式）
+tenants = None
+library = None    # 任务模板库，所有用户共用
+lag_monitor = None  # 事件循环延迟探针的后台任务，关闭时取消
+
+def acquire_tenant(user_id):
+    """取出用户并登记一个客户端；用户名不合法时 404，数据目录正被另一个进程使用（JSON 文件模式）时 503"""
+    try:
+        return tenants.acquire(user_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail='Unknown user')
+    except LockedError:
+        raise HTTPException(status_code=503, detail='User data is in use by another process')
+
+# -------- 运行指标（Prometheus 文本格式，GET /metrics）--------
+TASK_COUNT = REGISTRY.gauge('katachi_tasks', 'Number of tasks across resident tenants.')
+JOURNAL_BYTES = REGISTRY.gauge('katachi_journal_bytes', 'Size of the task journals of resident tenants.')
+DIRTY_ENTRIES = REGISTRY.gauge('katachi_dirty_entries', 'Entries changed since the last flush.')
+
+def collect_app_metrics():
+    task_count = journal_bytes = dirty = 0
+    for tenant in tenants.tenants.values():
+        task_count += len(tenant.task_list)
+        if tenant.task_list.journal is not None:
+            journal_bytes += tenant.task_list.journal.size()
+        dirty += len(tenant.state.store.dirty) + len(tenant.task_list.store.dirty)
+    TASK_COUNT.set(value=task_count)
+    JOURNAL_BYTES.set(value=journal_bytes)
+    DIRTY_ENTRIES.set(value=dirty)
+
+def metrics_endpoint():
+    return REGISTRY.render()
+
+def start_lag_monitor():
+    global lag_monitor
+    lag_monitor = background_tasks.create(monitor_loop_lag(), name='monitor_loop_lag')
+
+def stop_lag_monitor():
+    if lag_monitor is not None:
+        lag_monitor.cancel()
+
+# -------- 批量导入完成事件（POST 原始 CSV / JSONL，见 objects/ingest.py）--------
+async def ingest_endpoint(request: Request, user_id: str = None, format: str = None):
+    if format is None:
+        format = 'csv' if 'csv' in request.headers.get('content-type', '') else 'jsonl'
+    if format not in ('csv', 'jsonl'):
+        raise HTTPException(status_code=400, detail='format must be csv or jsonl')
+    from objects.ingest import ingest_stream  # 用到 numpy，第一次导入时才加载
+    tenant = acquire_tenant(user_id)
+    try:
+        return await ingest_stream(tenant.state, tenant.task_list, request.stream(), format)
+    finally:
+        tenants.release(tenant)
+
+# -------- 任务完成统计（连续天数、本周/本月次数，见 objects/analytics.py）--------
+def analytics_endpoint(user_id: str = None, task: str = None):
+    tenant = acquire_tenant(user_id)
+    try:
+        if task is None:
+            return tenant.analytics.summaries()
+        if tenant.task_list.get_task(task) is None:
+            raise HTTPException(status_code=404, detail='Unknown task')
+        return tenant.analytics.summary(task)
+    finally:
+        tenants.release(tenant)
+
+def persist_in_background(coro):
+    """事件处理里不等待落盘：快照已经取好，写文件在线程池里完成"""
+    background_tasks.create(coro, name='persist')
 
 
 # ------------------------
@@ -64,312 +154,673 @@ color_schemes = {
     }
 }
 
-with ui.row().classes('w-full justify-between mt-4'):
-    ui.label('▲ 僕たちの形').classes('text-2xl font-bold text-center mt-4 mb-4')
-
-    # 配色选择器
-    color_choice = ui.select(list(color_schemes.keys()),
-            label='配色方案', value='plain',
-            on_change=lambda e : ui.colors(**color_schemes[e.value])).props('dense').classes('text-center w-30 flex-none')
-ui.colors(**color_schemes[color_choice.value])
-
-with ui.row().classes('w-full justify-center gap-8'):
-    
-    # -------- 左侧：状态面板 --------
-    with ui.column().classes('w-1/3 bg-white/60 p-4 rounded-2xl shadow-md'):
-        ui.label('💫 当前状态').classes('text-xl font-semibold mb-2 text-center')
-        progress_bars = {}
-        for key, value in state.get_state().items():
-            ui.label({
-                'health': '💪 健康',
-                'hydration': '💧 水分',
-                'sleep': '😴 睡眠',
-                'energy': '⚡ 体力',
-                'relax': '🌪️ 放松',
-                'focus': '🎯 专注力',
-                'mood': '😊 心情',
-                'social': '💬 社交能量',
-            }[key]).classes('mt-2 font-medium')
-
-            progress_bars[key] = ui.linear_progress(value / 100, show_value=False, size='10px').props('color=primary stripe rounded')
-    
-    # -------- 右侧：任务区 --------
-    def toggle_checkbox(e, task_name: str):
-            # 使用 task_name 而不是 task 对象，避免闭包捕获
-        if e.value:
-            task_list.complete_task(task_name)
-            task_list.apply_task(task_name, current_state=state, multiplier=1)
-        else:
-            task_list.uncomplete_task(task_name)
-            # 撤销影响时用 -1
-            task_list.apply_task(task_name, current_state=state, multiplier=-1)
-        task_list.save_tasks()
-        update_status_bar()
-        ui.notify(f"任务 '{task_name}' 状态已更新")
-
-    def inc_counter(task_name: str, label):
-        task_list.complete_task(task_name)            # count += 1
-        task_list.apply_task(task_name, current_state=state, multiplier=1)
-        task_list.save_tasks()
-        # 更新对应标签文本（读取最新 count）
-        entry = task_list.get_task(task_name)
-        label.set_text(f"{task_name} × {entry['count']}")
-        update_status_bar()
-
-    def dec_counter(task_name: str, label):
-        task_list.uncomplete_task(task_name)          # count -= 1 (如果 >0)
-        task_list.apply_task(task_name, current_state=state, multiplier=-1)
-        task_list.save_tasks()
-        entry = task_list.get_task(task_name)
-        label.set_text(f"{task_name} × {entry['count']}")
-        update_status_bar()
-
-    
-    with ui.column().classes('w-1/3 bg-white/60 p-4 rounded-2xl shadow-md'):
-        ui.label('📋 任务管理').classes('text-xl font-semibold mb-2 text-center')
-
-        # ---------- Tabs ----------
-        with ui.tabs().classes('w-full') as tabs:
-            tab_daily = ui.tab('日常生活')
-            tab_work = ui.tab('工作学习')
-            tab_social = ui.tab('社交娱乐')
-            tab_custom = ui.tab('其他')
-
-        # tab_panels: 默认展示 tab_daily
-        with ui.tab_panels(tabs, value=tab_daily).classes('w-full') as panels:
-            
-            def make_refresh_fn(target_panel, label):
-                
-                def refresh():
-                    target_panel.clear()
-                    with target_panel:
-                        for task_entry in task_list.list_all():
-                            if task_entry is None or task_entry.get('task').get_label() != label:
-                                continue
-                            task = task_entry['task']
-                            name = task.get_name()
-
-                            if task.get_type() == 'check':
-                                with ui.row().classes('items-center justify-between w-full'):
-                                    ui.checkbox(
-                                        name,
-                                        value=task_entry.get('completed', False),
-                                        on_change=lambda e, n=name: toggle_checkbox(e, n)
-                                    )
-                                    ui.button('×', color='secondary',
-                                            on_click=lambda _, n=name: remove_task(n)).props('rounded justify-end')
-
-                            elif task.get_type() == 'counter':
-                                with ui.row().classes('items-center justify-between w-full'):
-                                    label_widget = ui.label(f"{name} × {task_entry.get('count', 0)}")
-                                    with ui.row().classes('justify-end'):
-                                        ui.button('+', on_click=lambda _, n=name, l=label_widget: inc_counter(n, l))
-                                        ui.button('−', on_click=lambda _, n=name, l=label_widget: dec_counter(n, l))
-                                        ui.button('×', color='secondary',
-                                                on_click=lambda _, n=name: remove_task(n)).props('rounded justify-end')
-                return refresh
-            
-
-            # @TODO 固定tab高度，内部作为可滚动
-            # @TODO 任务可拖动排序
-
-            # ========== 日常任务面板 ==========
-            with ui.tab_panel(tab_daily):
-                daily_panel = ui.column().classes('w-full gap-2')
-                # @TODO 如果无任务，展示一段占位文字
-                # if refresh_task_list(daily_panel, 'daily'):
-                #     ui.label('🏠 日常生活相关任务待添加...').classes('text-center text-gray-600 mt-4')
- 
-            # ========== 工作任务面板 ==========
-            with ui.tab_panel(tab_work):
-                # ui.label('💼 工作学习相关任务待添加...').classes('text-center text-gray-600 mt-4')
-                work_panel = ui.column().classes('w-full gap-2')
-
-            # ========== 社交任务面板 ==========
-            with ui.tab_panel(tab_social):
-                # ui.label('🎉 社交娱乐相关任务待添加...').classes('text-center text-gray-600 mt-4')
-                social_panel = ui.column().classes('w-full gap-2')
-
-            # ========== 自定义任务面板 ==========
-            with ui.tab_panel(tab_custom):
-                # ui.label('✨ 这里以后可以放自定义模板或任务库').classes('text-center text-gray-600 mt-4')
-                custom_panel = ui.column().classes('w-full gap-2')
-
-        refresh_daily = make_refresh_fn(daily_panel, 'daily')
-        refresh_work = make_refresh_fn(work_panel, 'work')
-        refresh_social = make_refresh_fn(social_panel, 'social')
-        refresh_custom = make_refresh_fn(custom_panel, 'custom')
-
-        def refresh_all():
-                refresh_daily()
-                refresh_work()
-                refresh_social()
-                refresh_custom()
-
-
-        def remove_task(task_name: str):
-            task_list.apply_task(task_name, current_state=state, multiplier=-task_list.get_task(task_name).get('count', 0))
-            task_list.delete_task(task_name)
-
-            task_list.save_tasks()
-            task_list.load_tasks()
-
-            update_status_bar()
-            ui.notify(f"任务 '{task_name}' 已删除")
-            refresh_all()  # 重新刷新列表
-
-            # 添加任务输入区
-        
-        
-        refresh_all()  # 初始加载任务列表
-
-
-    # ========== 新增任务面板 ==========
-    def add_user_task(e=None):
-        name = new_task_name.value.strip()
-        ttype = new_task_type.value
-        label = new_task_label.value
-        if not name or not ttype or not label:
-            ui.notify('请输入任务名称与类型 ⚠️')
-            return
-        effect = {}
-        for attr, inp in effect_inputs.items():
-            try:
-                val = int(inp.value)
-            except ValueError:
-                val = 0
-            effect[attr] = val
-        # 创建任务
-        if task_list.create_task({'name': name, 'type': ttype, 'effect': effect, 'label': label}):
-
-            task_list.save_tasks()
-            task_list.load_tasks()
-                                                                
-            # ✅ 先 notify，再刷新
-            ui.notify(f"任务 '{name}' 已添加 ✅")
-        else:
+metric_labels = {
+    'health': '💪 健康',
+    'hydration': '💧 水分',
+    'sleep': '😴 睡眠',
+    'energy': '⚡ 体力',
+    'relax': '🌪️ 放松',
+    'focus': '🎯 专注力',
+    'mood': '😊 心情',
+    'social': '💬 社交能量',
+}
+
+
+@timed('page_build')
+def build_page(tenant):
+    """一个用户的页面，数据都来自 tenant"""
+    state = tenant.state
+    task_list = tenant.task_list
+    history = tenant.history
+    commands = tenant.commands
+
+    with ui.row().classes('w-full justify-between mt-4'):
+        ui.label('▲ 僕たちの形').classes('text-2xl font-bold text-center mt-4 mb-4')
+
+        # 配色选择器
+        color_choice = ui.select(list(color_schemes.keys()),
+                label='配色方案', value='plain',
+                on_change=lambda e : ui.colors(**color_schemes[e.value])).props('dense').classes('text-center w-30 flex-none')
+    ui.colors(**color_schemes[color_choice.value])
+
+    with ui.row().classes('w-full justify-center gap-8'):
+
+        # -------- 左侧：状态面板 --------
+        with ui.column().classes('w-1/3 bg-white/60 p-4 rounded-2xl shadow-md') as status_column:
+            ui.label('💫 当前状态').classes('text-xl font-semibold mb-2 text-center')
+            progress_bars = {}
+            forecast_labels = {}
+            for key, value in state.get_state().items():
+                ui.label(metric_labels[key]).classes('mt-2 font-medium')
+
+                progress_bars[key] = ui.linear_progress(value / 100, show_value=False, size='10px').props('color=primary stripe rounded')
+                forecast_labels[key] = ui.label().classes('text-xs text-gray-600')
+
+            # 预测：若干小时后的值，以及何时低于阈值（可加上计划现在完成的任务）
+            with ui.row().classes('w-full items-center mt-2 no-wrap'):
+                forecast_hours = ui.select({1: '1 小时后', 3: '3 小时后', 6: '6 小时后', 12: '12 小时后'}, value=3,
+                    label='预测', on_change=lambda: [update_forecast(), update_plan()]).props('dense').classes('w-28')
+                forecast_plan = ui.select([], multiple=True, label='计划完成的任务',
+                    on_change=lambda: update_forecast()).props('dense use-chips').classes('grow')
+
+            # 建议任务：让预测时间之后的属性尽量都不低于目标
+            with ui.row().classes('w-full items-center justify-between mt-4 no-wrap'):
+                ui.label('🧭 建议任务').classes('text-lg font-semibold')
+                plan_target = ui.select({low: f'目标 ≥ {low}' for low in PLAN_TARGETS}, value=60,
+                    on_change=lambda: update_plan()).props('dense').classes('w-28')
+            plan_column = ui.column().classes('w-full gap-1')
+
+        # -------- 右侧：任务区 --------
+        def toggle_checkbox(e, task_name: str):
+                # 使用 task_name 而不是 task 对象，避免闭包捕获
+            task_entry = task_list.get_task(task_name)
+            if task_entry is None or e.value == task_entry.get('completed', False):
+                return  # 原地同步勾选框时也会触发 on_change，状态一致则忽略
+            if e.value:
+                commands.execute(f"完成 '{task_name}'", [task_name],
+                                 lambda: task_list.complete_task(task_name), counts={task_name: 1})
+            else:
+                commands.execute(f"取消完成 '{task_name}'", [task_name],
+                                 lambda: task_list.uncomplete_task(task_name), counts={task_name: -1})
+            persist_in_background(task_list.save_tasks_async())
+            ui.notify(f"任务 '{task_name}' 状态已更新")
+
+        def inc_counter(task_name: str):
+            commands.execute(f"'{task_name}' +1", [task_name],
+                             lambda: task_list.complete_task(task_name), counts={task_name: 1})
+            persist_in_background(task_list.save_tasks_async())
+
+        def dec_counter(task_name: str):
+            task_entry = task_list.get_task(task_name)
+            if task_entry is None or task_entry['count'] == 0:
+                return  # 计数已经是 0，没有可以减去的效果
+            commands.execute(f"'{task_name}' -1", [task_name],
+                             lambda: task_list.uncomplete_task(task_name), counts={task_name: -1})
+            persist_in_background(task_list.save_tasks_async())
+
+        def move_up(task_name: str):
+            before = task_list.previous_task(task_name)
+            if before is None:
+                return  # 已经是第一个
+            commands.execute(f"移动 '{task_name}'", [task_name], lambda: task_list.move_task(task_name, before))
+            persist_in_background(task_list.save_tasks_async())
+
+        ROW_HEIGHT = 48     # px，每行固定高度，虚拟滚动按它计算可见窗口
+        PANEL_HEIGHT = 480  # px，标签页固定高度，内部滚动
+        ROW_BUFFER = 5      # 可见窗口上下各多渲染几行
+
+        class TaskPanel:
+            """
+            一个标签页的任务列表：
+            - 第一次切到这个标签页时才渲染（activate）
+            - 固定高度内部滚动，只渲染可见窗口内的行，上下用占位块撑开滚动高度
+            - 已渲染的行按任务名缓存，增删和计数变化只修补对应的行
+            """
+
+            def __init__(self, label):
+                self.label = label
+                self.active = False
+                self.names = []       # 该标签下全部任务名（有序）
+                self.rows = {}        # 已渲染的行：任务名 -> {'row': 行元素, 'type': 任务类型, 'widget': 勾选框或计数标签}
+                self.scroll_top = 0
+                self.window = (0, 0)  # 当前渲染的 names 下标区间 [first, last)
+                with ui.scroll_area(on_scroll=self._on_scroll).classes('w-full').style(f'height: {PANEL_HEIGHT}px'):
+                    self.top_spacer = ui.element('div').classes('w-full')
+                    self.container = ui.column().classes('w-full gap-0')
+                    self.bottom_spacer = ui.element('div').classes('w-full')
+
+            def _build_row(self, task_entry):
+                task = task_entry['task']
+                name = task.get_name()
+                with self.container:
+                    if task.get_type() == 'check':
+                        with ui.row().classes('items-center justify-between w-full no-wrap').style(f'height: {ROW_HEIGHT}px') as row:
+                            widget = ui.checkbox(
+                                name,
+                                value=task_entry.get('completed', False),
+                                on_change=lambda e, n=name: toggle_checkbox(e, n)
+                            )
+                            with ui.row().classes('justify-end no-wrap'):
+                                ui.button('↑', on_click=lambda _, n=name: move_up(n)).props('flat dense')
+                                ui.button('×', color='secondary',
+                                        on_click=lambda _, n=name: remove_task(n)).props('rounded justify-end')
+
+                    elif task.get_type() == 'counter':
+                        with ui.row().classes('items-center justify-between w-full no-wrap').style(f'height: {ROW_HEIGHT}px') as row:
+                            widget = ui.label(f"{name} × {task_entry.get('count', 0)}")
+                            with ui.row().classes('justify-end no-wrap'):
+                                ui.button('↑', on_click=lambda _, n=name: move_up(n)).props('flat dense')
+                                ui.button('+', on_click=lambda _, n=name: inc_counter(n))
+                                ui.button('−', on_click=lambda _, n=name: dec_counter(n))
+                                ui.button('×', color='secondary',
+                                        on_click=lambda _, n=name: remove_task(n)).props('rounded justify-end')
+                    else:
+                        return
+                self.rows[name] = {'row': row, 'type': task.get_type(), 'widget': widget}
+
+            def _drop_row(self, task_name):
+                row_info = self.rows.pop(task_name, None)
+                if row_info is not None:
+                    row_info['row'].delete()
+
+            def _compute_window(self):
+                visible = PANEL_HEIGHT // ROW_HEIGHT + 1
+                first = max(0, int(self.scroll_top // ROW_HEIGHT) - ROW_BUFFER)
+                last = min(len(self.names), first + visible + 2 * ROW_BUFFER)
+                return first, last
+
+            @timed('panel_render')
+            def _render_window(self):
+                """只保留可见窗口内的行，补齐缺失的行并调整占位块高度"""
+                first, last = self._compute_window()
+                self.window = (first, last)
+                wanted = self.names[first:last]
+                keep = set(wanted)
+                for name in list(self.rows):
+                    if name not in keep:
+                        self._drop_row(name)
+                for name in wanted:
+                    if name not in self.rows:
+                        task_entry = task_list.get_task(name)
+                        if task_entry is not None:
+                            self._build_row(task_entry)
+                # 顺序不一致时才移动行
+                expected = [self.rows[name]['row'] for name in wanted if name in self.rows]
+                if list(self.container.default_slot.children) != expected:
+                    for index, row in enumerate(expected):
+                        row.move(target_container=self.container, target_index=index)
+                self.top_spacer.style(f'height: {first * ROW_HEIGHT}px')
+                self.bottom_spacer.style(f'height: {(len(self.names) - last) * ROW_HEIGHT}px')
+
+            def _on_scroll(self, e):
+                self.scroll_top = e.vertical_position
+                if self._compute_window() != self.window:
+                    self._render_window()
+
+            def activate(self):
+                """第一次显示时渲染"""
+                if not self.active:
+                    self.active = True
+                    self.refresh()
+
+            def add_row(self, task_name):
+                """按 task_list 里的位置插入（撤销删除时任务回到原来的位置，不一定在末尾）"""
+                if self.active and task_name not in self.names and task_list.get_task(task_name) is not None:
+                    previous = task_list.previous_task(task_name)
+                    if previous is None:
+                        index = 0
+                    else:
+                        index = self.names.index(previous) + 1 if previous in self.names else len(self.names)
+                    self.names.insert(index, task_name)
+                    self._render_window()
+
+            def remove_row(self, task_name):
+                if self.active and task_name in self.names:
+                    self.names.remove(task_name)
+                    self._drop_row(task_name)
+                    self._render_window()
+
+            def move_row(self, task_name, before):
+                """task_list 里已经移动过，这里只调整显示顺序"""
+                if self.active and task_name in self.names:
+                    self.names.remove(task_name)
+                    self.names.insert(self.names.index(before) if before in self.names else len(self.names), task_name)
+                    self._render_window()
+
+            def update_row(self, task_name):
+                """原地更新一行的勾选状态或计数，类型变了才重建这一行；不在可见窗口内的行滚动到时再按最新值渲染"""
+                row_info = self.rows.get(task_name)
+                task_entry = task_list.get_task(task_name)
+                if row_info is None or task_entry is None:
+                    return
+                if row_info['type'] != task_entry['task'].get_type():
+                    self._drop_row(task_name)
+                    self._render_window()
+                elif row_info['type'] == 'check':
+                    row_info['widget'].set_value(task_entry.get('completed', False))
+                else:
+                    row_info['widget'].set_text(f"{task_name} × {task_entry.get('count', 0)}")
+
+            @timed('panel_refresh')
+            def refresh(self):
+                """与 task_list 对齐：已渲染的行原地更新，再按新的任务列表重新计算可见窗口；未激活的标签页不做任何事"""
+                if not self.active:
+                    return
+                self.names = task_list.names_by_label(self.label)
+                for name in list(self.rows):
+                    self.update_row(name)
+                self._render_window()
+
+        with ui.column().classes('w-1/3 bg-white/60 p-4 rounded-2xl shadow-md'):
+            ui.label('📋 任务管理').classes('text-xl font-semibold mb-2 text-center')
+
+            # ---------- Tabs ----------
+            with ui.tabs().classes('w-full') as tabs:
+                tab_daily = ui.tab('日常生活')
+                tab_work = ui.tab('工作学习')
+                tab_social = ui.tab('社交娱乐')
+                tab_custom = ui.tab('其他')
+
+            # 标签页名 -> 任务标签，切换标签页时才渲染对应面板
+            tab_labels = {'日常生活': 'daily', '工作学习': 'work', '社交娱乐': 'social', '其他': 'custom'}
+
+            def on_tab_change(e):
+                tab_name = e.value.props['name'] if isinstance(e.value, ui.tab) else e.value
+                task_panels[tab_labels[tab_name]].activate()
+
+            # tab_panels: 默认展示 tab_daily
+            with ui.tab_panels(tabs, value=tab_daily, on_change=on_tab_change).classes('w-full') as panels:
+
+
+                # @TODO 任务可拖动排序
+
+                # ========== 日常任务面板 ==========
+                with ui.tab_panel(tab_daily):
+                    daily_panel = TaskPanel('daily')
+                    # @TODO 如果无任务，展示一段占位文字
+                    # if refresh_task_list(daily_panel, 'daily'):
+                    #     ui.label('🏠 日常生活相关任务待添加...').classes('text-center text-gray-600 mt-4')
+
+                # ========== 工作任务面板 ==========
+                with ui.tab_panel(tab_work):
+                    # ui.label('💼 工作学习相关任务待添加...').classes('text-center text-gray-600 mt-4')
+                    work_panel = TaskPanel('work')
+
+                # ========== 社交任务面板 ==========
+                with ui.tab_panel(tab_social):
+                    # ui.label('🎉 社交娱乐相关任务待添加...').classes('text-center text-gray-600 mt-4')
+                    social_panel = TaskPanel('social')
+
+                # ========== 自定义任务面板 ==========
+                with ui.tab_panel(tab_custom):
+                    # 任务库：边输入边搜索模板，一键添加
+                    with ui.row().classes('w-full items-center no-wrap gap-2'):
+                        template_query = ui.input(placeholder='搜索任务库（中文 / English）',
+                            on_change=lambda: update_templates()).props('clearable outlined dense').classes('grow')
+                        template_label = ui.select({'daily': '日常生活', 'work': '工作学习', 'social': '社交娱乐', 'custom': '其他'},
+                            label='标签', on_change=lambda: update_templates()).props('dense clearable').classes('w-24')
+                        template_effect = ui.select({key: metric_labels[key] for key in attributes},
+                            label='提高', on_change=lambda: update_templates()).props('dense clearable').classes('w-24')
+                    template_results = ui.column().classes('w-full gap-0 mb-2')
+                    custom_panel = TaskPanel('custom')
+
+            task_panels = {
+                'daily': daily_panel,
+                'work': work_panel,
+                'social': social_panel,
+                'custom': custom_panel}
+
+            def refresh_all():
+                    for task_panel in task_panels.values():
+                        task_panel.refresh()
+
+
+            def remove_task(task_name: str):
+                task_entry = task_list.get_task(task_name)
+                if task_entry is None:
+                    return
+                commands.execute(f"删除 '{task_name}'", [task_name],
+                                 lambda: task_list.delete_task(task_name), counts={task_name: -task_entry['count']})
+                persist_in_background(task_list.save_tasks_async())
+                ui.notify(f"任务 '{task_name}' 已删除")
+
+                # 添加任务输入区
+
+
+            daily_panel.activate()  # 初始只渲染默认显示的标签页
+
+
+        def add_task_info(task_info):
+            """创建任务并记入撤销历史，同名任务已存在时返回 False"""
+            name = task_info['name']
+            if commands.execute(f"添加 '{name}'", [name], lambda: task_list.create_task(task_info)):
+                persist_in_background(task_list.save_tasks_async())
+                ui.notify(f"任务 '{name}' 已添加 ✅")
+                return True
             ui.notify(f"任务 '{name}' 已存在 ⭕")
+            return False
+
+        def update_templates():
+            """按输入和过滤条件重新列出模板（索引查询，几毫秒内返回）"""
+            template_results.clear()
+            if library is None:
+                return
+            results = library.search(template_query.value or '', template_label.value, template_effect.value,
+                                     limit=TEMPLATE_RESULTS)
+            with template_results:
+                if not results:
+                    ui.label('任务库里没有匹配的模板').classes('text-sm text-gray-600')
+                for template in results:
+                    effect = ' '.join(f'{metric_labels[key]}{value:+g}' for key, value in template['effect'].items() if value)
+                    with ui.row().classes('items-center justify-between w-full no-wrap'):
+                        with ui.column().classes('gap-0'):
+                            ui.label(template['name']).classes('text-sm')
+                            ui.label(effect).classes('text-xs text-gray-600')
+                        ui.button('添加', on_click=lambda _, n=template['name']: add_task_info(library.instantiate(n))) \
+                            .props('dense flat size=sm')
+
+        update_templates()
+
+        # ========== 新增任务面板 ==========
+        def add_user_task(e=None):
+            name = new_task_name.value.strip()
+            ttype = new_task_type.value
+            label = new_task_label.value
+            if not name or not ttype or not label:
+                ui.notify('请输入任务名称与类型 ⚠️')
+                return
+            effect = {}
+            for attr, inp in effect_inputs.items():
+                try:
+                    val = int(inp.value)
+                except ValueError:
+                    val = 0
+                effect[attr] = val
+            # 创建任务
+            add_task_info({'name': name, 'type': ttype, 'effect': effect, 'label': label})
+
+            #@TODO 添加新任务后切换到对应的tab
+            # tabs.set_value(label)  
+            # panels.set_value(label)
+
+            # 清空输入框
+            new_task_name.value = ''
+            new_task_type.value = None
+            new_task_label.value = None
+            for attr, inp in effect_inputs.items():
+                inp.value = 0
+        with ui.row().classes('justify-between items-end mt-4'):
+            new_task_name = ui.input(
+                label='新任务',
+                placeholder='今天需要完成什么任务？'
+            ).props('clearable outlined dense').classes('grow w-[230px] flex-none')
+
+            new_task_type = ui.select({'check': '单次任务', 'counter': '多次任务'},
+                label='任务类型',
+            ).props('outlined dense').classes('w-[150px] flex-none')
+
+            new_task_label = ui.select({'daily': '日常生活', 'work': '工作学习', 'social': '社交娱乐', 'custom': '其他'},
+                label='任务标签',
+            ).props('outlined dense').classes('w-[150px] flex-none')
+
+            effect_inputs = {}  # 保存 input 对象
+            with ui.row().classes('items-center mt-2 gap-2'):
+                for attr in attributes:
+                    # 每个 attribute 一列
+                    with ui.column().classes('w-24'):
+                        ui.label(attr).classes('text-sm text-center')
+                        inp = ui.input(value='0', placeholder='0').props('outlined dense')
+                        effect_inputs[attr] = inp  # 保存 input 对象，提交时读取
+
+
+            ui.button('添加', color='primary', on_click=add_user_task).props('rounded')
+
+
+    # -------- 历史趋势 --------
+    history_ranges = {'1小时': 3600, '1天': 86400, '1周': 7 * 86400, '1月': 30 * 86400, '1年': 365 * 86400}
+
+    def update_history_chart():
+        """直接读取预聚合好的序列，点数只取决于时间范围对应的层级，与历史长度无关"""
+        rows = history.series(history_metric.value, history_ranges[history_range.value])
+        for i, series in enumerate(history_chart.options['series']):
+            series['data'] = [[row[0] * 1000, round(row[i + 1], 2)] for row in rows]  # row: (t, min, mean, max)
+        history_chart.update()
+
+    with ui.column().classes('w-2/3 mx-auto mt-4 bg-white/60 p-4 rounded-2xl shadow-md'):
+        with ui.row().classes('w-full items-center justify-between'):
+            ui.label('📈 历史趋势').classes('text-xl font-semibold')
+            with ui.row():
+                history_metric = ui.select({key: metric_labels[key] for key in attributes}, value='health',
+                    label='属性', on_change=lambda: update_history_chart()).props('dense').classes('w-32')
+                history_range = ui.select(list(history_ranges), value='1天',
+                    label='时间范围', on_change=lambda: update_history_chart()).props('dense').classes('w-32')
+        history_chart = ui.echart({
+            'tooltip': {'trigger': 'axis'},
+            'legend': {'data': ['最低', '平均', '最高']},
+            'xAxis': {'type': 'time'},
+            'yAxis': {'type': 'value', 'min': 0, 'max': 100},
+            'series': [
+                {'name': '最低', 'type': 'line', 'showSymbol': False, 'lineStyle': {'type': 'dashed'}, 'data': []},
+                {'name': '平均', 'type': 'line', 'showSymbol': False, 'data': []},
+                {'name': '最高', 'type': 'line', 'showSymbol': False, 'lineStyle': {'type': 'dashed'}, 'data': []},
+            ],
+        }).classes('w-full h-64')
+    update_history_chart()
+
+    ui.separator().classes('my-4')
+
+    def reset_task_and_state():
+        # 今天完成的所有任务一次性撤销
+        counts = {}
+        for task_entry in task_list.list_done():  # 只看今天完成过的任务
+            task = task_entry['task']
+            if task.get_type() == 'check' and task_entry.get('completed', False):
+                counts[task.get_name()] = -1
+            elif task.get_type() == 'counter' and task_entry.get('count', 0) > 0:
+                counts[task.get_name()] = -task_entry.get('count', 0)
+        task_list.apply_tasks(counts, current_state=state)
+        task_list.reset_completion_status(manual_reset=True)
+
+    async def save_and_notify():
+            await state.save_state_async(force=True)
+            await task_list.save_tasks_async(force=True)
+            ui.notify('数据已保存 💾')
+
+    def undo():
+        description = commands.undo()
+        if description is None:
+            ui.notify('没有可以撤销的操作')
+            return
+        persist_in_background(task_list.save_tasks_async())
+        ui.notify(f'已撤销：{description} ↩️')
 
-        panel_map = {
-            'daily': daily_panel,
-            'work': work_panel,
-            'social': social_panel,
-            'custom': custom_panel}                    
-        # refresh_task_list(panel_map[label], label)
-        refresh_all()
-        #@TODO 添加新任务后切换到对应的tab
-        # tabs.set_value(label)  
-        # panels.set_value(label)
-        
-        # 清空输入框
-        new_task_name.value = ''
-        new_task_type.value = None
-        new_task_label.value = None
-        for attr, inp in effect_inputs.items():
-            inp.value = 0
-    with ui.row().classes('justify-between items-end mt-4'):
-        new_task_name = ui.input(
-            label='新任务',
-            placeholder='今天需要完成什么任务？'
-        ).props('clearable outlined dense').classes('grow w-[230px] flex-none')
-
-        new_task_type = ui.select({'check': '单次任务', 'counter': '多次任务'},
-            label='任务类型',
-        ).props('outlined dense').classes('w-[150px] flex-none')
-
-        new_task_label = ui.select({'daily': '日常生活', 'work': '工作学习', 'social': '社交娱乐', 'custom': '其他'},
-            label='任务标签',
-        ).props('outlined dense').classes('w-[150px] flex-none')
-
-        effect_inputs = {}  # 保存 input 对象
-        with ui.row().classes('items-center mt-2 gap-2'):
-            for attr in attributes:
-                # 每个 attribute 一列
-                with ui.column().classes('w-24'):
-                    ui.label(attr).classes('text-sm text-center')
-                    inp = ui.input(value='0', placeholder='0').props('outlined dense')
-                    effect_inputs[attr] = inp  # 保存 input 对象，提交时读取
-
-        
-        ui.button('添加', color='primary', on_click=add_user_task).props('rounded')
-
-
-ui.separator().classes('my-4')
-
-def reset_task_and_state():
-    for task_entry in task_list.list_all():
-        task = task_entry['task']
-        if task.get_type() == 'check' and task_entry.get('completed', False):
-            task_list.apply_task(task.get_name(), current_state=state, multiplier=-1)
-        elif task.get_type() == 'counter' and task_entry.get('count', 0) > 0:
-            task_list.apply_task(task.get_name(), current_state=state, multiplier=-task_entry.get('count', 0))
-    task_list.reset_completion_status(manual_reset=True)
-
-def save_and_notify():
-        state.save_state()
-        task_list.save_tasks()
-        ui.notify('数据已保存 💾')
-
-
-# -------- 页面底部：保存按钮 --------
-with ui.row().classes('w-full justify-center py-4 bg-white/70'):
-
-    ui.button('保存数据', color='primary', on_click=save_and_notify).props('rounded')
-
-    ui.button('手动重置日常任务', color='primary', on_click=lambda: [reset_task_and_state(), refresh_all(), update_status_bar(), ui.notify('日常任务已重置 🔄')]).props('rounded')
-    
-    ui.button('重置状态与任务', color='secondary', on_click=lambda: [reset_to_default(state, task_list), refresh_all(), update_status_bar(), ui.notify('状态与任务已重置 ⚠️')]).props('rounded')
+    def redo():
+        description = commands.redo()
+        if description is None:
+            ui.notify('没有可以重做的操作')
+            return
+        persist_in_background(task_list.save_tasks_async())
+        ui.notify(f'已重做：{description} ↪️')
 
+    async def reset_all_to_default():
+        await reset_to_default(state, task_list)
+        ui.notify('状态与任务已重置 ⚠️')
 
 
+    # -------- 页面底部：保存按钮 --------
+    with ui.row().classes('w-full justify-center py-4 bg-white/70'):
 
-# ------------------------
-# 更新指标显示函数
-# ------------------------
+        ui.button('保存数据', color='primary', on_click=save_and_notify).props('rounded')
+
+        ui.button('撤销', on_click=undo).props('rounded outline')
+
+        ui.button('重做', on_click=redo).props('rounded outline')
 
-# 存档读档
-def save_all():
-    state.save_state()
-    task_list.save_tasks()
-def load_all():
-    state.load_state()
-    task_list.load_tasks()
+        ui.button('手动重置日常任务', color='primary', on_click=lambda: [reset_task_and_state(), ui.notify('日常任务已重置 🔄')]).props('rounded')
 
-# 重置到default配置
-def reset_to_default(state, task_list):
-    profile = load_profile('./default/default_profile.json')
-    tasks = load_profile('./default/default_tasks.json')
+        ui.button('重置状态与任务', color='secondary', on_click=reset_all_to_default).props('rounded')
 
-    metrics = profile['metrics']
-    decay_rates = profile['decay_rates']
-    state.set_metrics(metrics)
-    state.set_decay_rates(decay_rates)
 
-    task_list.reset_entries(tasks)
-    
 
 
+    # ------------------------
+    # 更新指标显示函数
+    # ------------------------
 
-def update_status_bar():
-    for k, bar in progress_bars.items():
-        value = state.get_metric(k)  # 0~100
-        bar.set_value(value / 100)
+    # 存档读档
+    async def save_all():
+        await state.save_state_async(force=True)
+        await task_list.save_tasks_async(force=True)
+    async def load_all():
+        await state.load_state_async()
+        await task_list.load_tasks_async()
 
-def auto_decay_refresh():
-    state.apply_decay()
-    update_status_bar()
-    state.save_state()
+    # 重置到default配置
+    async def reset_to_default(state, task_list):
+        # 默认配置在 create_app 时已经读取并校验过，文件没有改动时不读盘
+        profile = await load_profile_async(os.path.join(DEFAULT_DIR, 'default_profile.json'), check_profile)
+        tasks = await load_profile_async(os.path.join(DEFAULT_DIR, 'default_tasks.json'), check_tasks)
 
-def auto_save():
-    state.save_state()
-    task_list.save_tasks()
+        metrics = profile['metrics']
+        decay_rates = profile['decay_rates']
+        state.set_metrics(metrics)
+        state.set_decay_rates(decay_rates)
 
-ui.timer(10, auto_decay_refresh)  # every 10 second
-ui.timer(600, auto_save)  # every 10 miutes
-ui.timer(60, task_list.reset_completion_status)
+        task_list.reset_entries(tasks)
+
+
+
+
+    def update_forecast():
+        """按衰减率和计划任务解析推算轨迹，只更新文字，不做逐帧模拟"""
+        names = list(task_list.all_tasks)
+        if forecast_plan.options != names:
+            forecast_plan.set_options(names, value=[name for name in forecast_plan.value or [] if name in names])
+        now = time.time()
+        horizon = forecast_hours.value * 3600
+        plan = [(now, name, 1) for name in forecast_plan.value or []]
+        trajectories = forecast(state, task_list, plan, until=now + 24 * 3600, now=now)
+        for key, label in forecast_labels.items():
+            trajectory = trajectories[key]
+            text = f"{forecast_hours.value} 小时后 ≈ {trajectory.value_at(now + horizon):.0f}"
+            crossing = trajectory.first_crossing(FORECAST_THRESHOLD)
+            if crossing is not None:
+                hours = (crossing - now) / 3600
+                text += ' · 已低于 ' if hours <= 0 else f" · {hours:.1f} 小时后低于 "
+                text += str(FORECAST_THRESHOLD)
+            label.set_text(text)
+
+    shown_plan = None  # 建议面板当前显示的 (任务, 次数)、未达标的属性
+
+    def update_plan():
+        """重新规划（几毫秒），结果和显示的一样时不重建面板"""
+        nonlocal shown_plan
+        plan = plan_tasks(state, task_list, {key: (plan_target.value, 100) for key in state.metrics},
+                          horizon=forecast_hours.value * 3600)
+        short = [key for key, value in plan.projected.items() if value < plan_target.value - 0.5]
+        shown = (tuple(plan.counts.items()), tuple(short))
+        if shown == shown_plan:
+            return
+        shown_plan = shown
+        plan_column.clear()
+        with plan_column:
+            if not plan:
+                ui.label('暂时不需要额外的任务 👍' if not short else '没有能改善的任务').classes('text-sm text-gray-600')
+            for task_name, count in plan.counts.items():
+                ui.label(f'{task_name}（{count} 次）' if count > 1 else task_name).classes('text-sm')
+            if plan and short:
+                ui.label('仍低于目标：' + '、'.join(metric_labels[key] for key in short)).classes('text-xs text-gray-600')
+            if plan:
+                ui.button('加入预测计划', on_click=lambda: forecast_plan.set_value(list(plan.counts))) \
+                    .props('dense flat size=sm')
+
+    shown_metrics = {}  # 界面上当前显示的属性值
+    decay_push = None   # 下一次衰减推送的一次性定时器
+
+    @timed('status_bar')
+    def update_status_bar():
+        """只推送有变化的进度条，并按衰减率算出下一次有进度条变化 DECAY_STEP 的时刻，到时再推送"""
+        nonlocal decay_push
+        for k, bar in progress_bars.items():
+            value = state.get_metric(k)  # 0~100
+            if shown_metrics.get(k) != value:
+                bar.set_value(value / 100)
+                shown_metrics[k] = value
+        update_forecast()
+        update_plan()
+        if decay_push is not None:
+            decay_push.cancel()
+            decay_push.delete()
+            decay_push = None
+        delay = state.time_until_change(shown_metrics, step=DECAY_STEP)
+        if delay is not None:
+            with status_column:  # 挂在状态面板下，不随任务行一起被删除
+                decay_push = ui.timer(max(delay, 0.1), update_status_bar, once=True)
+
+    update_status_bar()  # 之后只在进度条会变化时才推送
+
+    def show_reminder(text):
+        with status_column:
+            ui.notify(f'提醒：{text}')
+    tenant.reminder_handlers.append(show_reminder)
+    ui.context.client.on_delete(lambda: tenant.reminder_handlers.remove(show_reminder))
+
+    def on_task_event(kind, task_name, value):
+        """本页面、同一用户的其他页面或其他进程改了任务：只修补受影响的行"""
+        if kind == 'reload':
+            refresh_all()
+        elif kind == 'remove':
+            for task_panel in task_panels.values():
+                task_panel.remove_row(task_name)
+        elif kind == 'move':
+            task_panels[task_list.get_task(task_name)['task'].get_label()].move_row(task_name, value)
+        elif task_list.get_task(task_name) is not None:  # 'add' / 'task'，标签可能变了
+            label = task_list.get_task(task_name)['task'].get_label()
+            for task_panel in task_panels.values():
+                if task_panel.label == label:
+                    task_panel.add_row(task_name)
+                    task_panel.update_row(task_name)
+                else:
+                    task_panel.remove_row(task_name)
+        update_plan()  # 任务增删、单次任务完成与否都会改变可选的任务
+
+    ui.context.client.on_delete(task_list.events.subscribe(on_task_event))
+    ui.context.client.on_delete(state.events.subscribe(lambda kind, name, value: update_status_bar()))
+    ui.context.client.on_delete(lambda: tenants.release(tenant))  # 页面关闭后这个用户才可以被淘汰
+
+
+def index_page():
+    build_page(acquire_tenant(None))
+
+def user_page(user_id: str):
+    build_page(acquire_tenant(user_id))
+
+
+# ------------------------
+# 应用工厂
+# ------------------------
+def create_app(root='.', users_dir=USERS_DIR, db_name=DB_NAME, log_level=LOG_LEVEL):
+    """
+    创建调度器和用户缓存，注册页面、HTTP 路由和启动 / 关闭回调；在 ui.run 之前调用一次
+    默认配置在这里读取并校验，文件有问题时启动就失败，而不是等到第一个新用户或第一次重置
+    """
+    global scheduler, notifier, tenants, library
+    setup_logging(log_level)
+    load_profile(os.path.join(DEFAULT_DIR, 'default_profile.json'), check_profile)
+    default_tasks = load_profile(os.path.join(DEFAULT_DIR, 'default_tasks.json'), check_tasks)
+    library = TemplateLibrary(load_profile(TEMPLATES_FILE, check_templates))
+    share_effects(task['effect'] for task in (*default_tasks.values(), *library.templates))
+    logger.info("Loaded %d task templates.", len(library))
+
+    scheduler = Scheduler()
+    notifier = Notifier(NOTIFY_DIR) if db_name else None
+    tenants = TenantCache(root=root, users_dir=users_dir, capacity=MAX_TENANTS, idle_timeout=TENANT_IDLE_TIMEOUT,
+                          scheduler=scheduler, notifier=notifier, save_window=SAVE_WINDOW, db_name=db_name)
+    REGISTRY.on_collect('app', collect_app_metrics)
+
+    app.get('/metrics', response_class=PlainTextResponse)(metrics_endpoint)
+    app.post('/ingest')(ingest_endpoint)
+    app.post('/u/{user_id}/ingest')(ingest_endpoint)
+    app.get('/analytics')(analytics_endpoint)
+    app.get('/u/{user_id}/analytics')(analytics_endpoint)
+    ui.page('/')(index_page)
+    ui.page('/u/{user_id}')(user_page)
+
+    # 调度器睡到最早的到期时间再执行，不再每分钟轮询
+    app.on_startup(scheduler.start)
+    app.on_shutdown(scheduler.stop)  # 先停调度器，关闭之后不会再有任务对着已关闭的用户数据执行
+    if notifier is not None:
+        app.on_startup(notifier.start)
+        app.on_shutdown(notifier.close)
+    app.on_shutdown(tenants.close)
+    app.on_startup(start_lag_monitor)  # 事件循环延迟，见 /metrics 的 katachi_loop_lag_seconds
+    app.on_shutdown(stop_lag_monitor)
+    return tenants
 
 
 # ------------------------
 # 运行应用
 # ------------------------
-ui.run(title='Self Care App', reload=False)
+if __name__ in {'__main__', '__mp_main__'}:
+    create_app()
+    ui.run(title='Self Care App', port=PORT, reload=False)
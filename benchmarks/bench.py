@@ -0,0 +1,247 @@
+"""
+基准测试：生成不同规模的任务库和状态文件，测量 TaskList / State 的读写与任务面板渲染耗时，
+以及同样规模的任务模板库的建索引和搜索耗时
+
+    python -m benchmarks.bench --sizes 10 1000 100000 --out bench_results.json
+    python -m benchmarks.bench --compare old.json new.json
+
+结果为 JSON，包含当前 git commit，便于在不同提交之间比较
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from objects.state import State, attributes  # noqa: E402
+from objects.task import TaskList  # noqa: E402
+from objects.templates import TemplateLibrary  # noqa: E402
+from objects.instrument import setup_logging  # noqa: E402
+
+LABELS = ['daily', 'work', 'social', 'custom']
+# 合成模板名用的词，搜索时按输入的前几个字查询
+VERBS = [('喝', 'drink'), ('吃', 'eat'), ('写', 'write'), ('读', 'read'), ('整理', 'organize'), ('练习', 'practice'),
+         ('打扫', 'clean'), ('学习', 'study'), ('去', 'go to'), ('看', 'watch'), ('听', 'listen to'), ('做', 'do')]
+NOUNS = [('水', 'water'), ('水果', 'fruit'), ('日记', 'journal'), ('书', 'book'), ('桌面', 'desk'), ('钢琴', 'piano'),
+         ('房间', 'room'), ('英语', 'english'), ('公园', 'park'), ('电影', 'movie'), ('音乐', 'music'), ('瑜伽', 'yoga'),
+         ('咖啡', 'coffee'), ('邮件', 'email'), ('晚餐', 'dinner'), ('作业', 'homework')]
+QUERIES = ['喝', '水果', '整理桌', '练习钢琴', 'dr', 'read', 'clean ro', 'yoga 3', '英语', 'xyz']
+
+
+# ---------- 合成数据 ----------
+def make_tasks(n, seed=0):
+    rng = random.Random(seed)
+    tasks = {}
+    for i in range(n):
+        name = f'任务{i:06d}'
+        task_type = rng.choice(['check', 'counter'])
+        tasks[name] = {
+            'name': name,
+            'effect': {key: rng.randint(-3, 6) for key in attributes},
+            'type': task_type,
+            'label': rng.choice(LABELS),
+            'completed': task_type == 'check' and rng.random() < 0.3,
+            'count': rng.randint(0, 3) if task_type == 'counter' else 0
+        }
+    return tasks
+
+
+def make_templates(n, seed=0):
+    rng = random.Random(seed)
+    templates = {}
+    for i in range(n):
+        (verb, verb_en), (noun, noun_en) = rng.choice(VERBS), rng.choice(NOUNS)
+        name = f'{verb}{noun}{i}'
+        templates[name] = {
+            'name': name,
+            'effect': {key: rng.randint(-3, 6) for key in attributes},
+            'type': rng.choice(['check', 'counter']),
+            'label': rng.choice(LABELS),
+            'keywords': [f'{verb_en} {noun_en} {i}'],
+        }
+    return templates
+
+
+def make_state(seed=0):
+    rng = random.Random(seed)
+    return {'metrics': {key: rng.uniform(20, 90) for key in attributes}, 'last_update': time.time() - 3600}
+
+
+def write_dataset(directory, n):
+    with open(os.path.join(directory, 'tasks.json'), 'w', encoding='utf-8') as f:
+        json.dump(make_tasks(n), f, ensure_ascii=False, indent=2)
+    with open(os.path.join(directory, 'state.json'), 'w', encoding='utf-8') as f:
+        json.dump(make_state(), f, indent=2)
+
+
+# ---------- 计时 ----------
+def timeit(fn, repeat, per=1):
+    """运行 repeat 次，返回每次（除以 per 后）的秒数统计"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) / per)
+    return {'min': min(samples), 'median': statistics.median(samples), 'max': max(samples), 'repeat': repeat}
+
+
+def bench_objects(directory, n, repeat, ops=1000):
+    tasks_file = os.path.join(directory, 'tasks.json')
+    state_file = os.path.join(directory, 'state.json')
+    results = {}
+    decay_rates = {'health': -2, 'hydration': -5, 'energy': -5, 'focus': -5, 'sleep': -5, 'relax': 2}
+
+    results['load_tasks'] = timeit(lambda: TaskList(tasks_file), repeat)
+    task_list = TaskList(tasks_file)
+    state = State(state_file, decay_rates=decay_rates)
+    results['save_tasks'] = timeit(lambda: task_list.save_tasks(force=True), repeat)
+
+    names = list(task_list.all_tasks)
+    rng = random.Random(1)
+
+    def complete_and_apply():
+        for _ in range(ops):
+            name = rng.choice(names)
+            task_list.complete_task(name)
+            task_list.apply_task(name, current_state=state)
+    results['complete_and_apply'] = timeit(complete_and_apply, repeat, per=ops)
+    results['reset_completion_status'] = timeit(lambda: task_list.reset_completion_status(manual_reset=True), repeat)
+    results['apply_decay'] = timeit(state.apply_decay, repeat)
+    results['save_state'] = timeit(lambda: state.save_state(force=True), repeat)
+    results['tasks_file_bytes'] = os.path.getsize(tasks_file)
+    return results
+
+
+def bench_templates(n, repeat, ops=200):
+    """模板库：建索引，以及逐字输入时的搜索（有 / 无标签过滤）"""
+    templates = make_templates(n)
+    results = {'template_build': timeit(lambda: TemplateLibrary(templates), repeat)}
+    library = TemplateLibrary(templates)
+
+    def search(**filters):
+        for i in range(ops):
+            query = QUERIES[i % len(QUERIES)]
+            for end in range(1, len(query) + 1):  # 模拟边输入边搜索
+                library.search(query[:end], **filters)
+    per = ops * sum(len(query) for query in QUERIES) / len(QUERIES)
+    results['template_search'] = timeit(search, repeat, per=per)
+    results['template_search_label'] = timeit(lambda: search(label='work'), repeat, per=per)
+    return results
+
+
+def bench_render(directory, repeat):
+    """用 NiceGUI 的模拟用户打开页面并触发一次全部面板刷新（手动重置日常任务）"""
+    from nicegui import ui
+    from nicegui.testing.user_interaction import UserInteraction
+    from nicegui.testing.user_simulation import user_simulation
+
+    main_file = os.path.join(directory, 'app.py')
+    shutil.copy(os.path.join(ROOT, 'app.py'), main_file)
+    cwd, argv0 = os.getcwd(), sys.argv[0]
+    os.chdir(directory)
+    sys.argv[0] = main_file
+    os.environ.setdefault('PYTEST_CURRENT_TEST', 'bench')  # 模拟用户按 pytest 环境重置 NiceGUI 的全局状态
+
+    async def run():
+        open_samples, refresh_samples = [], []
+        for _ in range(repeat):
+            async with user_simulation(main_file=main_file) as user:
+                start = time.perf_counter()
+                await user.open('/')
+                open_samples.append(time.perf_counter() - start)
+                button = [b for b in user.find(ui.button).elements if b.text == '手动重置日常任务'][0]
+                start = time.perf_counter()
+                UserInteraction(user, {button}, None).click()
+                refresh_samples.append(time.perf_counter() - start)
+        return open_samples, refresh_samples
+
+    try:
+        open_samples, refresh_samples = asyncio.run(run())
+    finally:
+        os.chdir(cwd)
+        sys.argv[0] = argv0
+    return {
+        'page_open': {'min': min(open_samples), 'median': statistics.median(open_samples), 'repeat': repeat},
+        'refresh_all': {'min': min(refresh_samples), 'median': statistics.median(refresh_samples), 'repeat': repeat},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, repeat, render_max):
+    os.environ['KATACHI_LOG_LEVEL'] = 'OFF'  # 计时时不输出日志（页面渲染里 create_app 会按它重新设置）
+    setup_logging()
+    report = {'commit': git_commit(), 'python': sys.version.split()[0], 'time': time.time(), 'sizes': {}}
+    for n in sizes:
+        directory = tempfile.mkdtemp(prefix='katachi-bench-')
+        try:
+            shutil.copytree(os.path.join(ROOT, 'default'), os.path.join(directory, 'default'))
+            shutil.copy(os.path.join(ROOT, 'profile.json'), directory)
+            write_dataset(directory, n)
+            results = bench_objects(directory, n, repeat)
+            results.update(bench_templates(n, repeat))
+            if n <= render_max:
+                try:
+                    results.update(bench_render(directory, repeat))
+                except ImportError:
+                    pass  # 没有安装 nicegui 时只测对象层
+            report['sizes'][str(n)] = results
+            print(f"{n:>7} tasks: load {results['load_tasks']['median'] * 1000:.2f} ms, "
+                  f"save {results['save_tasks']['median'] * 1000:.2f} ms, "
+                  f"complete+apply {results['complete_and_apply']['median'] * 1e6:.1f} µs/op, "
+                  f"template search {results['template_search']['median'] * 1e6:.1f} µs"
+                  + (f", page open {results['page_open']['median'] * 1000:.1f} ms" if 'page_open' in results else ''))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+def compare(old_file, new_file, threshold=0.2):
+    """打印两次结果中变慢超过 threshold（比例）的项"""
+    with open(old_file, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_file, encoding='utf-8') as f:
+        new = json.load(f)
+    regressions = 0
+    for size, results in new['sizes'].items():
+        for name, stats in results.items():
+            before = old['sizes'].get(size, {}).get(name)
+            if not isinstance(stats, dict) or not isinstance(before, dict):
+                continue
+            ratio = stats['median'] / before['median'] if before['median'] else 1.0
+            mark = '  <-- slower' if ratio > 1 + threshold else ''
+            regressions += bool(mark)
+            print(f"{size:>7} {name:<26} {before['median'] * 1000:10.3f} ms -> {stats['median'] * 1000:10.3f} ms "
+                  f"({ratio:5.2f}x){mark}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='katachi 基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--render-max', type=int, default=10000, help='超过这个任务数就不测页面渲染')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+    report = run(args.sizes, args.repeat, args.render_max)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'results written to {args.out}')
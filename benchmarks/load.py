@@ -0,0 +1,487 @@
+"""
+压力测试：模拟很多个同时打开页面的浏览器，通过和真实浏览器相同的 socket.io 协议点按钮，测单个进程能撑多少客户端
+
+    python -m benchmarks.load --clients 200 --duration 60
+    python -m benchmarks.load --clients 50 --users 1 --mix inc=50,toggle=30,idle=20
+    python -m benchmarks.load --url http://localhost:8080 --pid 12345 --clients 100
+
+不给 --url 时在临时目录里启动一个本地实例（KATACHI_PORT 指定端口），结束后关闭并删除
+每个客户端先 GET 页面拿到元素和 client_id，再连 websocket，按 --mix 的比例随机操作，两次操作之间按 --think 等待
+（指数分布）；页面一直开着，属性衰减的推送照常发生
+报告（JSON）：每种操作从发出事件到收到第一条界面更新的延迟 p50/p95/p99，收发消息速率，
+服务端的事件循环延迟（/metrics）和进程 RSS
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import uuid
+
+import aiohttp
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench import git_commit  # noqa: E402
+
+DEFAULT_MIX = 'inc=35,dec=15,toggle=25,move=5,add=5,remove=5,idle=10'
+ACTIONS = ('inc', 'dec', 'toggle', 'move', 'add', 'remove', 'idle')
+REPLY_TIMEOUT = 10  # 秒，发出事件后这么久没有收到界面更新就记为超时
+ACK_INTERVAL = 3    # 秒，和浏览器一样定期确认收到的消息，服务端才会丢掉重发缓存
+SAMPLE_INTERVAL = 1  # 秒，采样服务端 /metrics 和 RSS 的间隔
+
+ELEMENTS_PATTERN = re.compile(r'parseElements\(String\.raw`(.*?)`\)', re.S)
+CLIENT_ID_PATTERN = re.compile(r"'client_id': '([0-9a-f-]+)'")
+TYPE_OPTIONS = {'check': {'value': 0, 'label': '单次任务'}, 'counter': {'value': 1, 'label': '多次任务'}}
+DAILY_LABEL = {'value': 0, 'label': '日常生活'}
+
+
+def parse_mix(text):
+    """'inc=35,toggle=25,...' -> {操作: 权重}"""
+    mix = {}
+    for part in text.split(','):
+        action, _, weight = part.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action '{action}', expected one of {', '.join(ACTIONS)}.")
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {'count': len(samples), 'p50': percentile(samples, 50), 'p95': percentile(samples, 95),
+            'p99': percentile(samples, 99), 'max': samples[-1] if samples else None}
+
+
+class Stats:
+    """所有客户端共用的计数"""
+
+    def __init__(self):
+        self.latency = {action: [] for action in ACTIONS if action != 'idle'}
+        self.sent = 0
+        self.received = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.connected = 0
+        self.connect_failures = 0
+
+
+class SimulatedClient:
+    """一个浏览器标签页：保存页面元素的副本，按服务端推送的 update 更新，从中找到任务行和按钮"""
+
+    def __init__(self, index, url, user_id, mix, think, stats, rng):
+        self.index = index
+        self.url = url
+        self.user_id = user_id
+        self.mix = mix
+        self.think = think
+        self.stats = stats
+        self.rng = rng
+        self.elements = {}
+        self.client_id = None
+        self.next_message_id = 0
+        self.reply = None  # 等待下一条界面更新的 future
+        self.added = []    # 这个客户端添加的任务，remove 只删它们
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on('*', self._on_message)
+
+    # ---------- 连接 ----------
+    async def open(self, session):
+        async with session.get(f'{self.url}/u/{self.user_id}') as response:
+            response.raise_for_status()
+            html = await response.text()
+        self.elements = json.loads(ELEMENTS_PATTERN.search(html).group(1))
+        self.client_id = CLIENT_ID_PATTERN.search(html).group(1)
+        query = urllib.parse.urlencode({'client_id': self.client_id, 'next_message_id': 0,
+                                        'implicit_handshake': 'true', 'tab_id': str(uuid.uuid4()),
+                                        'document_id': str(uuid.uuid4())})
+        await self.sio.connect(f'{self.url}?{query}', socketio_path='/_nicegui_ws/socket.io',
+                               transports=['websocket'])
+
+    async def close(self):
+        if self.sio.connected:
+            await self.sio.disconnect()
+
+    async def _on_message(self, event, data):
+        self.stats.received += 1
+        if isinstance(data, dict) and '_id' in data:
+            self.next_message_id = data['_id'] + 1
+        if event != 'update':
+            return
+        for element_id, element in data.items():
+            if element_id == '_id':
+                continue
+            if element is None:
+                self.elements.pop(element_id, None)
+            else:
+                self.elements[element_id] = element
+        if self.reply is not None and not self.reply.done():
+            self.reply.set_result(time.perf_counter())
+
+    async def _ack_loop(self):
+        while self.sio.connected:
+            await asyncio.sleep(ACK_INTERVAL)
+            await self.sio.emit('ack', {'client_id': self.client_id, 'next_message_id': self.next_message_id})
+
+    # ---------- 页面元素 ----------
+    def _children(self, element):
+        return [self.elements[str(child)] for child in element.get('children', ()) if str(child) in self.elements]
+
+    def _descendants(self, element):
+        for child in self._children(element):
+            yield child
+            yield from self._descendants(child)
+
+    def task_rows(self):
+        """
+        {任务名: {'type': 'check'/'counter', 'count': 次数, 'first': 是否排在最前, 'checkbox': 元素,
+                  'buttons': {按钮文字: 元素}}}（只含已渲染的行）
+        """
+        rows = {}
+        first_children = {element['children'][0] for element in self.elements.values() if element.get('children')}
+        for element_id, element in self.elements.items():
+            children = self._children(element)
+            if not children:
+                continue
+            first = children[0]
+            if first['tag'] == 'q-checkbox':
+                name, task_type, count = first.get('text', ''), 'check', 0
+            elif first['tag'] == 'div' and ' × ' in first.get('text', ''):
+                name, count = first['text'].rsplit(' × ', 1)
+                task_type, count = 'counter', int(count)
+            else:
+                continue
+            buttons = {child['props'].get('label'): child for child in self._descendants(element)
+                       if child['tag'] == 'q-btn'}
+            rows[name] = {'type': task_type, 'count': count, 'first': int(element_id) in first_children,
+                          'checkbox': first, 'buttons': buttons}
+        return rows
+
+    def _find(self, tag, label):
+        for element_id, element in self.elements.items():
+            if element['tag'] == tag and element.get('props', {}).get('label') == label:
+                return element_id, element
+        return None, None
+
+    def _id_of(self, element):
+        for element_id, candidate in self.elements.items():
+            if candidate is element:
+                return element_id
+        return None
+
+    # ---------- 操作 ----------
+    async def emit(self, element_id, event_type, args=()):
+        """像浏览器一样发出元素事件（参数为 JSON 字符串的列表）"""
+        element = self.elements[element_id]
+        listener = next(event for event in element['events'] if event['type'] == event_type)
+        self.stats.sent += 1
+        await self.sio.emit('event', {'id': int(element_id), 'client_id': self.client_id,
+                                      'listener_id': listener['listener_id'], 'args': list(args)})
+
+    async def timed(self, action, element_id, event_type, args=()):
+        """发出事件并等到下一条界面更新，记录延迟"""
+        self.reply = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.emit(element_id, event_type, args)
+        try:
+            end = await asyncio.wait_for(self.reply, REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            return
+        finally:
+            self.reply = None
+        self.stats.latency[action].append(end - start)
+
+    def _pick(self, rows, task_type=None, names=None, where=None):
+        candidates = [name for name, row in rows.items() if (task_type is None or row['type'] == task_type)
+                      and (names is None or name in names) and (where is None or where(row))]
+        return self.rng.choice(candidates) if candidates else None
+
+    async def act(self, action):
+        rows = self.task_rows()
+        # 只挑会改变界面的操作（计数为 0 时减、第一行上移都不会有更新），否则只能等到超时
+        if action in ('inc', 'dec'):
+            name = self._pick(rows, 'counter', where=None if action == 'inc' else lambda row: row['count'] > 0)
+            button = rows[name]['buttons'].get('+' if action == 'inc' else '−') if name else None
+            if button is not None:
+                await self.timed(action, self._id_of(button), 'click')
+        elif action == 'toggle':
+            name = self._pick(rows, 'check')
+            if name is not None:
+                checkbox = rows[name]['checkbox']
+                value = not checkbox['props'].get('model-value', False)
+                await self.timed(action, self._id_of(checkbox), 'update:modelValue', [json.dumps(value)])
+        elif action == 'move':
+            name = self._pick(rows, where=lambda row: not row['first'])
+            button = rows[name]['buttons'].get('↑') if name else None
+            if button is not None:
+                await self.timed(action, self._id_of(button), 'click')
+        elif action == 'add':
+            name = f'压测{self.index}-{len(self.added)}-{self.rng.randrange(10 ** 6)}'
+            task_type = self.rng.choice(list(TYPE_OPTIONS))
+            name_input, _ = self._find('nicegui-input', '新任务')
+            type_select, _ = self._find('nicegui-select', '任务类型')
+            label_select, _ = self._find('nicegui-select', '任务标签')
+            add_button, _ = self._find('q-btn', '添加')
+            if None in (name_input, type_select, label_select, add_button):
+                return
+            await self.emit(name_input, 'update:value', [json.dumps(name)])
+            await self.emit(type_select, 'update:modelValue', [json.dumps(TYPE_OPTIONS[task_type])])
+            await self.emit(label_select, 'update:modelValue', [json.dumps(DAILY_LABEL)])
+            await self.timed(action, add_button, 'click')
+            self.added.append(name)
+        elif action == 'remove':
+            name = self._pick(rows, names=set(self.added))
+            button = rows[name]['buttons'].get('×') if name else None
+            if button is not None:
+                self.added.remove(name)
+                await self.timed(action, self._id_of(button), 'click')
+
+    async def run(self, until):
+        actions, weights = zip(*self.mix.items())
+        ack = asyncio.create_task(self._ack_loop())
+        try:
+            while time.monotonic() < until and self.sio.connected:
+                await asyncio.sleep(min(self.rng.expovariate(1 / self.think), max(0.0, until - time.monotonic())))
+                if time.monotonic() >= until:
+                    break
+                action = self.rng.choices(actions, weights)[0]
+                if action == 'idle':
+                    continue
+                try:
+                    await self.act(action)
+                except (KeyError, StopIteration, socketio.exceptions.SocketIOError):
+                    self.stats.errors += 1  # 元素刚被别的客户端删掉等
+        finally:
+            ack.cancel()
+
+
+# ---------- 服务端 ----------
+def start_server(port):
+    """在临时目录里启动 app.py，返回 (进程, 目录)"""
+    directory = tempfile.mkdtemp(prefix='katachi-load-')
+    shutil.copytree(os.path.join(ROOT, 'default'), os.path.join(directory, 'default'))
+    shutil.copy(os.path.join(ROOT, 'profile.json'), directory)
+    env = dict(os.environ, KATACHI_PORT=str(port), KATACHI_LOG_LEVEL=os.environ.get('KATACHI_LOG_LEVEL', 'WARNING'))
+    log = open(os.path.join(directory, 'server.log'), 'wb')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'app.py')], cwd=directory, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    return process, directory
+
+
+async def wait_ready(session, url, process=None, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}.')
+        try:
+            async with session.get(f'{url}/metrics') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f'Server at {url} did not become ready within {timeout} s.')
+
+
+def read_rss(pid):
+    """进程的常驻内存（字节），读不到时为 None（非 Linux）"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def parse_metrics(text):
+    """Prometheus 文本格式 -> {'名字{标签}': 值}"""
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            key, _, value = line.rpartition(' ')
+            try:
+                values[key] = float(value)
+            except ValueError:
+                pass
+    return values
+
+
+def histogram_quantile(before, after, name, q):
+    """按两次抓取之间各桶的增量估算分位数（取所在桶的上界）"""
+    buckets = []
+    for key, value in after.items():
+        if key.startswith(f'{name}_bucket{{'):
+            le = key.split('le="', 1)[1].split('"', 1)[0]
+            buckets.append((float('inf') if le == '+Inf' else float(le), value - before.get(key, 0)))
+    buckets.sort()
+    total = buckets[-1][1] if buckets else 0
+    if total <= 0:
+        return None
+    for le, count in buckets:
+        if count >= q * total:
+            return le
+    return None
+
+
+async def sample_server(session, url, pid, samples, stop):
+    while not stop.is_set():
+        try:
+            async with session.get(f'{url}/metrics') as response:
+                metrics = parse_metrics(await response.text())
+            samples.append({'t': time.monotonic(), 'rss': read_rss(pid) if pid else None,
+                            'loop_lag_max': metrics.get('katachi_loop_lag_max_seconds')})
+        except aiohttp.ClientError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def fetch_metrics(session, url):
+    async with session.get(f'{url}/metrics') as response:
+        return parse_metrics(await response.text())
+
+
+# ---------- 运行 ----------
+async def run_load(url, clients, users, duration, ramp, think, mix, pid=None, seed=0):
+    stats = Stats()
+    rng = random.Random(seed)
+    samples = []
+    stop = asyncio.Event()
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        metrics_before = await fetch_metrics(session, url)
+        sampler = asyncio.create_task(sample_server(session, url, pid, samples, stop))
+        simulated = [SimulatedClient(i, url, f'load{i % users:04d}', mix, think, stats, random.Random(rng.random()))
+                     for i in range(clients)]
+
+        async def connect(client, delay):
+            await asyncio.sleep(delay)
+            try:
+                await client.open(session)
+                stats.connected += 1
+                return True
+            except Exception as e:  # 连接失败本身就是要测的结果
+                stats.connect_failures += 1
+                print(f'client {client.index} failed to connect: {e!r}', file=sys.stderr)
+                return False
+
+        start = time.monotonic()
+        opened = await asyncio.gather(*(connect(client, ramp * i / clients) for i, client in enumerate(simulated)))
+        active = [client for client, ok in zip(simulated, opened) if ok]
+        ramp_seconds = time.monotonic() - start
+        received_before, sent_before = stats.received, stats.sent
+        steady_start = time.monotonic()
+        await asyncio.gather(*(client.run(steady_start + duration) for client in active))
+        steady_seconds = time.monotonic() - steady_start
+        received, sent = stats.received - received_before, stats.sent - sent_before
+        stop.set()
+        await sampler
+        metrics_after = await fetch_metrics(session, url)
+        await asyncio.gather(*(client.close() for client in simulated), return_exceptions=True)
+
+    rss = [sample['rss'] for sample in samples if sample['rss'] is not None]
+    lag_max = [sample['loop_lag_max'] for sample in samples if sample['loop_lag_max'] is not None]
+    lag_count = metrics_after.get('katachi_loop_lag_seconds_count', 0) - metrics_before.get(
+        'katachi_loop_lag_seconds_count', 0)
+    lag_sum = metrics_after.get('katachi_loop_lag_seconds_sum', 0) - metrics_before.get(
+        'katachi_loop_lag_seconds_sum', 0)
+    return {
+        'commit': git_commit(),
+        'time': time.time(),
+        'config': {'url': url, 'clients': clients, 'users': users, 'duration': duration, 'ramp': ramp,
+                   'think': think, 'mix': mix, 'seed': seed},
+        'clients': {'connected': stats.connected, 'failed': stats.connect_failures,
+                    'ramp_seconds': ramp_seconds},
+        'latency': {action: summarize(samples) for action, samples in stats.latency.items() if samples},
+        'messages': {'sent': sent, 'received': received, 'sent_per_second': sent / steady_seconds,
+                     'received_per_second': received / steady_seconds},
+        'timeouts': stats.timeouts,
+        'errors': stats.errors,
+        'loop_lag': {'mean': lag_sum / lag_count if lag_count else None,
+                     'p99': histogram_quantile(metrics_before, metrics_after, 'katachi_loop_lag_seconds', 0.99),
+                     'max': max(lag_max) if lag_max else None},
+        'rss': {'peak': max(rss) if rss else None, 'final': rss[-1] if rss else None},
+    }
+
+
+def print_report(report):
+    clients = report['clients']
+    print(f"clients: {clients['connected']} connected, {clients['failed']} failed "
+          f"(ramp {clients['ramp_seconds']:.1f} s)")
+    for action, latency in report['latency'].items():
+        print(f"{action:<7} n={latency['count']:<6} p50 {latency['p50'] * 1000:8.1f} ms  "
+              f"p95 {latency['p95'] * 1000:8.1f} ms  p99 {latency['p99'] * 1000:8.1f} ms")
+    messages = report['messages']
+    print(f"messages: {messages['sent_per_second']:.1f} sent/s, {messages['received_per_second']:.1f} received/s; "
+          f"{report['timeouts']} timeouts, {report['errors']} errors")
+    lag = report['loop_lag']
+    if lag['mean'] is not None:
+        print(f"loop lag: mean {lag['mean'] * 1000:.1f} ms, p99 <= {lag['p99'] * 1000:.0f} ms, "
+              f"max {lag['max'] * 1000:.1f} ms")
+    if report['rss']['peak'] is not None:
+        print(f"rss: peak {report['rss']['peak'] / 2 ** 20:.1f} MiB, final {report['rss']['final'] / 2 ** 20:.1f} MiB")
+
+
+async def main(args):
+    mix = parse_mix(args.mix)
+    process = directory = None
+    url, pid = args.url, args.pid
+    if url is None:
+        process, directory = start_server(args.port)
+        url, pid = f'http://127.0.0.1:{args.port}', process.pid
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_ready(session, url, process)
+        report = await run_load(url, args.clients, args.users or args.clients, args.duration, args.ramp,
+                                args.think, mix, pid, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            shutil.rmtree(directory, ignore_errors=True)
+    print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'results written to {args.out}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='katachi 压力测试')
+    parser.add_argument('--clients', type=int, default=100, help='同时打开的页面数')
+    parser.add_argument('--users', type=int, default=None, help='页面分给多少个用户（默认每个页面一个用户）')
+    parser.add_argument('--duration', type=float, default=60, help='全部连上之后持续操作的秒数')
+    parser.add_argument('--ramp', type=float, default=10, help='在这么多秒内逐个连上')
+    parser.add_argument('--think', type=float, default=2.0, help='两次操作之间的平均等待秒数')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='操作比例，可用 ' + ', '.join(ACTIONS))
+    parser.add_argument('--url', default=None, help='压测已经在运行的实例，不另外启动')
+    parser.add_argument('--pid', type=int, default=None, help='配合 --url，读取这个进程的 RSS')
+    parser.add_argument('--port', type=int, default=8089, help='本地启动实例的端口')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help='把结果写到 JSON 文件')
+    asyncio.run(main(parser.parse_args()))
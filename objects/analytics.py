@@ -0,0 +1,240 @@
+"""
+任务完成情况的统计：每个任务每天完成了几次，按周 / 按月的汇总，以及连续完成的天数
+每日重置只会清零完成状态，所以在重置之前（TaskList 的 'reload' 事件里发现日期变了）把当天的次数结算进来；
+当天的次数随每次完成实时更新，汇总和连续天数在结算时增量维护，查询都是 O(1)，不需要回扫历史
+"""
+import json
+from datetime import date
+
+from objects.history import RingBuffer
+from objects.persist import atomic_write_bytes
+
+
+DAY_CAPACITY = 366 * 2  # 每个任务保留的有完成记录的天数
+# 汇总层级：名称 -> 桶数
+PERIODS = {
+    'week': 104,  # 最近 2 年
+    'month': 24,
+}
+DAY_COLUMNS = (('day', 'i'), ('count', 'I'))  # day 为 date.toordinal()
+ROLLUP_COLUMNS = (('start', 'i'), ('total', 'I'), ('active', 'H'))  # active 为有完成的天数
+
+
+def period_start(period, day):
+    """day（序数）所在的周（周一开始）或月的第一天"""
+    d = date.fromordinal(day)
+    if period == 'week':
+        return day - d.weekday()
+    return d.replace(day=1).toordinal()
+
+
+def entry_count(task_entry):
+    """条目今天的完成次数：计数任务为 count，单次任务勾选为 1"""
+    if task_entry['task'].get_type() == 'check':
+        return int(task_entry['completed'])
+    return task_entry['count']
+
+
+class TaskStats:
+    """一个任务已结算的历史：有完成的每一天、周 / 月汇总、连续天数"""
+
+    def __init__(self):
+        self.days = RingBuffer(DAY_CAPACITY, DAY_COLUMNS)
+        self.rollups = {period: RingBuffer(capacity, ROLLUP_COLUMNS) for period, capacity in PERIODS.items()}
+        self.open = {period: None for period in PERIODS}  # 未结束的桶：[起始日, 次数, 天数]
+        self.streak = 0    # 截止 last_day 的连续天数
+        self.best = 0      # 最长连续天数
+        self.last_day = 0  # 最后一个有完成的已结算日
+
+    def close_day(self, day, count):
+        if count <= 0 or day <= self.last_day:
+            return
+        self.days.append(day, count)
+        for period in PERIODS:
+            start = period_start(period, day)
+            bucket = self.open[period]
+            if bucket is not None and bucket[0] != start:
+                self.rollups[period].append(*bucket)
+                bucket = None
+            if bucket is None:
+                self.open[period] = [start, count, 1]
+            else:
+                bucket[1] += count
+                bucket[2] += 1
+        self.streak = self.streak + 1 if self.last_day == day - 1 else 1
+        self.best = max(self.best, self.streak)
+        self.last_day = day
+
+    def current_streak(self, today, today_count):
+        """到今天为止的连续天数：昨天断了就是 0，今天已完成再加 1"""
+        streak = self.streak if self.last_day == today - 1 else 0
+        return streak + 1 if today_count > 0 else streak
+
+    def total(self, period, today, today_count):
+        """本周 / 本月（含今天）的次数和有完成的天数"""
+        bucket = self.open[period]
+        if bucket is not None and bucket[0] == period_start(period, today):
+            return bucket[1] + today_count, bucket[2] + (today_count > 0)
+        return today_count, int(today_count > 0)
+
+    def series(self, since=None, until=None):
+        """[(日序数, 次数), ...]，只含有完成的天"""
+        return self.days.rows(since, until)
+
+    def rollup_series(self, period):
+        rows = self.rollups[period].rows()
+        if self.open[period] is not None:
+            rows.append(tuple(self.open[period]))
+        return rows
+
+
+class Analytics:
+    """
+    一个用户的任务统计，订阅 TaskList 的改动事件
+    filename: 存档文件（JSON 头 + 各列的原始字节，格式同 History）
+    """
+
+    def __init__(self, filename, task_list):
+        self.filename = filename
+        self.task_list = task_list
+        self.tasks = {}  # 任务名 -> TaskStats（删除的任务保留历史）
+        self.day = task_list.last_reset_time.toordinal()  # 当天（上次重置那天）
+        self.today = {}  # 任务名 -> 当天的次数（只含非 0）
+        self.dirty = False
+        self.on_dirty = None  # 可选回调：从干净变脏时调用一次
+        self.load()
+        self._roll()
+        self._sync_today()
+        task_list.events.subscribe(self._on_task_event)
+
+    def _mark_dirty(self):
+        was_clean = not self.dirty
+        self.dirty = True
+        if was_clean and self.on_dirty is not None:
+            self.on_dirty()
+
+    def stats(self, task_name):
+        task_stats = self.tasks.get(task_name)
+        if task_stats is None:
+            task_stats = self.tasks[task_name] = TaskStats()
+        return task_stats
+
+    # ---------- 增量更新 ----------
+    def _on_task_event(self, kind, task_name, value):
+        if kind == 'reload':
+            self._roll()
+            self._sync_today()
+        elif kind == 'remove':
+            if self.today.pop(task_name, None) is not None:
+                self._mark_dirty()
+        elif kind in ('task', 'add'):
+            self._set_today(task_name)
+
+    def _set_today(self, task_name):
+        task_entry = self.task_list.get_task(task_name)
+        count = entry_count(task_entry) if task_entry is not None else 0
+        if self.today.get(task_name, 0) != count:
+            if count:
+                self.today[task_name] = count
+            else:
+                self.today.pop(task_name, None)
+            self._mark_dirty()
+
+    def _sync_today(self):
+        """整体重新加载后按任务列表重新取当天的次数（只看今天完成过的任务）"""
+        today = {name: entry_count(task_entry) for name, task_entry in
+                 ((name, self.task_list.get_task(name)) for name in self.task_list.done)}
+        today = {name: count for name, count in today.items() if count}
+        if today != self.today:
+            self.today = today
+            self._mark_dirty()
+
+    def _roll(self):
+        """任务列表换了一天：把上一天的次数结算进历史"""
+        day = self.task_list.last_reset_time.toordinal()
+        if day == self.day:
+            return
+        if day > self.day:
+            for task_name, count in self.today.items():
+                self.stats(task_name).close_day(self.day, count)
+        self.today = {}
+        self.day = day
+        self._mark_dirty()
+
+    # ---------- 查询 ----------
+    def streak(self, task_name):
+        return self.stats(task_name).current_streak(self.day, self.today.get(task_name, 0))
+
+    def best_streak(self, task_name):
+        return max(self.stats(task_name).best, self.streak(task_name))
+
+    def total(self, task_name, period='week'):
+        return self.stats(task_name).total(period, self.day, self.today.get(task_name, 0))[0]
+
+    def average_per_day(self, task_name, period='month'):
+        """本周 / 本月平均每天完成几次（按已经过去的天数，含今天）"""
+        elapsed = self.day - period_start(period, self.day) + 1
+        return self.total(task_name, period) / elapsed
+
+    def summary(self, task_name):
+        return {
+            'today': self.today.get(task_name, 0),
+            'streak': self.streak(task_name),
+            'best_streak': self.best_streak(task_name),
+            'week_total': self.total(task_name, 'week'),
+            'month_total': self.total(task_name, 'month'),
+            'month_average': self.average_per_day(task_name, 'month'),
+        }
+
+    def summaries(self):
+        """当前任务列表里每个任务的 summary"""
+        return {task_name: self.summary(task_name) for task_name in self.task_list.all_tasks}
+
+    # ---------- IO ----------
+    def save(self, force=False):
+        if not self.dirty and not force:
+            return False
+        header = {'version': 1, 'day': self.day, 'today': self.today, 'tasks': {}}
+        chunks = []
+        for task_name, task_stats in self.tasks.items():
+            buffers = {'days': task_stats.days}
+            buffers.update(task_stats.rollups)
+            header['tasks'][task_name] = {
+                'buffers': {name: buffer.header() for name, buffer in buffers.items()},
+                'open': task_stats.open,
+                'streak': task_stats.streak,
+                'best': task_stats.best,
+                'last_day': task_stats.last_day,
+            }
+            chunks.extend(buffer.to_bytes() for buffer in buffers.values())
+        head = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        atomic_write_bytes(self.filename, head + b'\n' + b''.join(chunks))
+        self.dirty = False
+        return True
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return
+        newline = raw.index(b'\n')
+        header = json.loads(raw[:newline])
+        offset = newline + 1
+        for task_name, info in header['tasks'].items():
+            task_stats = self.stats(task_name)
+            buffers = {'days': task_stats.days}
+            buffers.update(task_stats.rollups)
+            for name, buffer_header in info['buffers'].items():
+                buffer = buffers[name] if name in buffers else \
+                    RingBuffer(buffer_header['capacity'], DAY_COLUMNS if name == 'days' else ROLLUP_COLUMNS)
+                offset = buffer.load_bytes(buffer_header, raw, offset)
+            task_stats.open.update({period: bucket for period, bucket in info['open'].items()
+                                    if period in task_stats.open})
+            task_stats.streak = info['streak']
+            task_stats.best = info['best']
+            task_stats.last_day = info['last_day']
+        # 存档里的那一天还没结算（关闭服务期间跨过了重置）时，由 _roll 结算
+        self.day = header['day']
+        self.today = header['today']
+        self.dirty = False
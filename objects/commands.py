@@ -0,0 +1,97 @@
+"""
+撤销 / 重做：每个操作记下它改动的任务条目在操作前后的副本，以及截断之后真正加到状态上的属性变化量
+撤销时把这几个条目恢复成操作前的副本、减去这个变化量，重做反过来；
+只碰操作涉及的条目，不需要保存再重新加载整个任务列表
+"""
+import logging
+from collections import deque
+
+from objects.instrument import timed
+
+logger = logging.getLogger('katachi.commands')
+
+UNDO_LIMIT = 100  # 最多能撤销多少步
+
+
+class Command:
+    """一次可撤销的操作"""
+
+    def __init__(self, description, before, after, requested, applied):
+        self.description = description
+        self.before = before        # 任务名 -> 操作前的条目副本（None 表示当时不存在）
+        self.after = after          # 任务名 -> 操作后的条目副本
+        self.requested = requested  # 截断之前请求的属性变化量 {属性: 值}，没有时为 None
+        self.applied = applied      # 截断之后真正加上的变化量 {属性: 值}，撤销时减去它
+
+
+class CommandHistory:
+    """
+    一个用户的操作历史，同一用户的所有页面共用
+    任务列表整体重新加载（每日重置、恢复默认、其他进程的批量改动）后，记下的副本不再可靠，历史清空
+    """
+
+    def __init__(self, task_list, state, limit=UNDO_LIMIT):
+        self.task_list = task_list
+        self.state = state
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = []
+        task_list.events.subscribe(self._on_task_event)
+
+    def _on_task_event(self, kind, task_name, value):
+        if kind == 'reload':
+            self.clear()
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    @timed('command')
+    def execute(self, description, task_names, action=None, counts=None):
+        """
+        description: 显示给用户的操作名
+        task_names: 这个操作会改动的任务
+        action: 无参函数，修改任务列表；返回 False 表示没有执行，不记入历史
+        counts: {任务名: 次数}，要加到状态上的任务效果；在 action 之前计算，删除任务时也能用
+        """
+        before = {name: self.task_list.snapshot_entry(name) for name in task_names}
+        requested = self.task_list.effect_delta(counts) if counts else None  # 一次操作只涉及几个任务，不用矩阵
+        if action is not None and action() is False:
+            return False
+        applied = self.state.apply_delta(requested) if requested is not None else None
+        after = {name: self.task_list.snapshot_entry(name) for name in task_names}
+        self.undo_stack.append(Command(description, before, after, requested, applied))
+        self.redo_stack.clear()
+        return True
+
+    @timed('undo')
+    def undo(self):
+        """撤销最近一步，返回它的操作名；没有可撤销的操作时返回 None"""
+        if not self.undo_stack:
+            return None
+        command = self.undo_stack.pop()
+        self._restore(command.before, command.applied, -1)
+        self.redo_stack.append(command)
+        logger.debug("Undid '%s'.", command.description)
+        return command.description
+
+    @timed('redo')
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        command = self.redo_stack.pop()
+        self._restore(command.after, command.applied, 1)
+        self.undo_stack.append(command)
+        logger.debug("Redid '%s'.", command.description)
+        return command.description
+
+    def _restore(self, entries, applied, sign):
+        for task_name, snapshot in entries.items():
+            self.task_list.restore_entry(task_name, snapshot)
+        if applied:
+            self.state.apply_delta({key: sign * value for key, value in applied.items()})
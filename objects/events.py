@@ -0,0 +1,38 @@
+import logging
+
+from objects.instrument import REGISTRY
+
+logger = logging.getLogger('katachi.events')
+
+EVENTS_DELIVERED = REGISTRY.counter('katachi_events_delivered_total', 'Change events delivered to subscribers.',
+                                    ('kind',))
+
+
+class EventBus:
+    """
+    进程内的细粒度改动事件：publish(kind, name, value) 同步调用每个订阅者 fn(kind, name, value)
+    同一用户打开的每个页面都订阅这个用户的 TaskList / State，按事件只修补对应的控件，而不是整体重绘；
+    本页面、其他页面和其他进程（见 Storage.poll）的改动都走这一条路
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, fn):
+        """登记订阅者，返回取消订阅的函数"""
+        self.subscribers.append(fn)
+        return lambda: self.unsubscribe(fn)
+
+    def unsubscribe(self, fn):
+        if fn in self.subscribers:
+            self.subscribers.remove(fn)
+
+    def publish(self, kind, name=None, value=None):
+        if not self.subscribers:
+            return
+        for fn in list(self.subscribers):
+            try:
+                fn(kind, name, value)
+            except Exception:
+                logger.exception("Subscriber failed on %s event for %r.", kind, name)
+        EVENTS_DELIVERED.inc(kind, amount=len(self.subscribers))
@@ -0,0 +1,121 @@
+import time
+from bisect import bisect_right
+
+from objects.state import attributes
+
+
+class Trajectory:
+    """
+    一个属性的分段线性轨迹：points 为按时间排序的 (t, value)，相邻两点之间线性变化
+    同一时刻的两个点表示任务带来的跳变，取后一个点作为该时刻之后的值
+    """
+
+    def __init__(self, points):
+        self.points = points
+        self.times = [t for t, _ in points]
+
+    def value_at(self, t):
+        i = bisect_right(self.times, t) - 1
+        if i < 0:
+            return self.points[0][1]
+        if i == len(self.points) - 1:
+            return self.points[-1][1]
+        (t1, v1), (t2, v2) = self.points[i], self.points[i + 1]
+        return v1 + (v2 - v1) * (t - t1) / (t2 - t1)
+
+    def first_crossing(self, threshold, below=True):
+        """第一次低于（below=True）或高于 threshold 的精确时刻，不会发生时返回 None"""
+        def crossed(value):
+            return value < threshold if below else value > threshold
+
+        if crossed(self.points[0][1]):
+            return self.points[0][0]
+        for (t1, v1), (t2, v2) in zip(self.points, self.points[1:]):
+            if not crossed(v2):
+                continue
+            if t2 == t1:
+                return t1
+            return t1 + (threshold - v1) / (v2 - v1) * (t2 - t1)
+        return None
+
+
+def forecast(state, task_list=None, plan=(), until=None, now=None):
+    """
+    从 now 起按衰减率和计划任务解析地推算每个属性的轨迹（含 0/100 截断的拐点）
+    plan: [(时间戳, 任务名, 次数)]，早于 now 的按 now 处理
+    until: 推算到的时间，默认 24 小时后（或最后一个计划任务之后）
+    返回 {属性: Trajectory}
+    """
+    now = time.time() if now is None else now
+    events = sorted((max(t, now), name, count) for t, name, count in plan)
+    if until is None:
+        until = max([now + 24 * 3600] + [t for t, _, _ in events])
+    events = [event for event in events if event[0] <= until]  # until 之后的任务不计入
+    values = {key: state.value_at(key, now) for key in state.metrics}
+    points = {key: [(now, value)] for key, value in values.items()}
+
+    t = now
+    for event_t, name, count in events + [(until, None, 0)]:
+        event_t = min(event_t, until)
+        if event_t > t:
+            for key, value in values.items():
+                rate = state.decay_rates.get(key, 0)
+                if rate == 0:
+                    continue
+                bound = 0 if rate < 0 else 100
+                if value != bound:
+                    t_hit = t + (bound - value) / rate * 3600
+                    if t_hit < event_t:
+                        points[key].append((t_hit, bound))  # 触到边界后保持不变
+                values[key] = max(0, min(100, value + rate * (event_t - t) / 3600))
+                points[key].append((event_t, values[key]))
+            t = event_t
+        if name is not None:
+            for key, delta in task_list.get_task(name)['task'].get_effect().items():
+                if key in values:
+                    new_value = max(0, min(100, values[key] + delta * count))
+                    if new_value != values[key]:
+                        values[key] = new_value
+                        points[key].append((t, new_value))
+    return {key: Trajectory(key_points) for key, key_points in points.items()}
+
+
+def time_to_threshold(state, key, threshold, task_list=None, plan=(), below=True, horizon=7 * 24 * 3600, now=None):
+    """属性在 horizon 秒内第一次越过 threshold 还需多少秒，不会发生时返回 None"""
+    now = time.time() if now is None else now
+    trajectory = forecast(state, task_list, plan, until=now + horizon, now=now)[key]
+    crossing = trajectory.first_crossing(threshold, below)
+    return None if crossing is None else crossing - now
+
+
+def evaluate_schedules(state, task_list, schedules, at, now=None):
+    """
+    批量评估多个候选日程在时间 at 的属性值
+    schedules: [[(时间戳, 任务名, 次数), ...], ...]
+    返回 numpy 数组 (日程数 × 属性数)，列按 attributes 的顺序
+    所有日程同时按事件步推进：每步先按衰减率线性推进再截断，再加上任务效果再截断，
+    衰减率在两次事件之间不变，所以这与逐段解析推算的结果一致
+    """
+    import numpy as np
+    now = time.time() if now is None else now
+    effects = task_list.effect_matrix()
+    rates = np.array([state.decay_rates.get(key, 0) for key in attributes], dtype=np.float64)
+    n_schedules = len(schedules)
+    n_steps = max([len(schedule) for schedule in schedules] + [0])
+
+    times = np.full((n_schedules, n_steps), float(at))
+    deltas = np.zeros((n_schedules, n_steps, len(attributes)))
+    for i, schedule in enumerate(schedules):
+        for j, (t, name, count) in enumerate(sorted(schedule)):
+            if t > at:
+                break
+            times[i, j] = max(t, now)
+            deltas[i, j] = effects.matrix[effects.index[name]] * count
+
+    values = np.tile(state.as_vector(now), (n_schedules, 1))
+    current = np.full(n_schedules, float(now))
+    for j in range(n_steps):
+        values = np.clip(values + rates * ((times[:, j] - current) / 3600)[:, None], 0, 100)
+        values = np.clip(values + deltas[:, j], 0, 100)
+        current = times[:, j]
+    return np.clip(values + rates * ((at - current) / 3600)[:, None], 0, 100)
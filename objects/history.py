@@ -0,0 +1,212 @@
+import json
+import time
+from array import array
+
+from objects.state import attributes
+from objects.persist import atomic_write_bytes
+
+
+RAW_CAPACITY = 1024  # 每个属性保留的原始点数
+# 聚合层级：名称 -> (桶宽秒数, 桶数)
+TIERS = {
+    'minute': (60, 24 * 60),      # 最近 1 天
+    'hour': (3600, 24 * 62),      # 最近 2 个月
+    'day': (86400, 366 * 2),      # 最近 2 年
+}
+RAW_COLUMNS = (('t', 'd'), ('value', 'f'))
+AGG_COLUMNS = (('t', 'd'), ('min', 'f'), ('mean', 'f'), ('max', 'f'))
+
+
+class RingBuffer:
+    """
+    定长环形缓冲区：每列一个 array，未写满前按需增长，写满后覆盖最旧的数据
+    第一列必须是单调递增的时间戳，用于二分查找时间范围
+    """
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = columns
+        self.data = [array(typecode) for _, typecode in columns]
+        self.head = 0  # 下一个写入位置（写满之后才有意义）
+
+    def __len__(self):
+        return len(self.data[0])
+
+    def append(self, *values):
+        if len(self) < self.capacity:
+            for column, value in zip(self.data, values):
+                column.append(value)
+        else:
+            for column, value in zip(self.data, values):
+                column[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+
+    def _physical(self, i):
+        return (self.head + i) % self.capacity if len(self) == self.capacity else i
+
+    def _first_at_or_after(self, t):
+        """按时间二分查找第一个 >= t 的逻辑下标"""
+        times = self.data[0]
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[self._physical(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def rows(self, since=None, until=None):
+        start = 0 if since is None else self._first_at_or_after(since)
+        stop = len(self) if until is None else self._first_at_or_after(until)
+        return [tuple(column[self._physical(i)] for column in self.data) for i in range(start, stop)]
+
+    def last(self):
+        if len(self) == 0:
+            return None
+        return tuple(column[self._physical(len(self) - 1)] for column in self.data)
+
+    # ---------- 序列化 ----------
+    def header(self):
+        return {'capacity': self.capacity, 'size': len(self), 'head': self.head}
+
+    def to_bytes(self):
+        return b''.join(column.tobytes() for column in self.data)
+
+    def load_bytes(self, header, raw, offset):
+        """按 header 从 raw[offset:] 读回各列，返回新的 offset；容量变了就按时间顺序重新追加"""
+        size = header['size']
+        columns = []
+        for _, typecode in self.columns:
+            column = array(typecode)
+            nbytes = size * column.itemsize
+            column.frombytes(raw[offset:offset + nbytes])
+            offset += nbytes
+            columns.append(column)
+        if header['capacity'] == self.capacity:
+            self.data = columns
+            self.head = header['head']
+        else:
+            old = RingBuffer(header['capacity'], self.columns)
+            old.data, old.head = columns, header['head']
+            for row in old.rows():
+                self.append(*row)
+        return offset
+
+
+class MetricHistory:
+    """一个属性的历史：原始点 + 分钟/小时/天三级 min/mean/max 聚合，每次记录 O(1)"""
+
+    def __init__(self):
+        self.raw = RingBuffer(RAW_CAPACITY, RAW_COLUMNS)
+        self.tiers = {name: RingBuffer(capacity, AGG_COLUMNS) for name, (_, capacity) in TIERS.items()}
+        self.open = {name: None for name in TIERS}  # 未结束的桶：[起始时间, min, sum, count, max]
+
+    def record(self, t, value):
+        last = self.raw.last()
+        if last is not None and t < last[0]:
+            return  # 只接受按时间顺序的点
+        self.raw.append(t, value)
+        for name, (width, _) in TIERS.items():
+            start = t - t % width
+            bucket = self.open[name]
+            if bucket is not None and bucket[0] != start:
+                self.tiers[name].append(bucket[0], bucket[1], bucket[2] / bucket[3], bucket[4])
+                bucket = None
+            if bucket is None:
+                self.open[name] = [start, value, value, 1, value]
+            else:
+                bucket[1] = min(bucket[1], value)
+                bucket[2] += value
+                bucket[3] += 1
+                bucket[4] = max(bucket[4], value)
+
+    def series(self, tier, since=None, until=None):
+        """返回 [(t, min, mean, max), ...]；tier 为 'raw' 时三者相同"""
+        if tier == 'raw':
+            return [(t, v, v, v) for t, v in self.raw.rows(since, until)]
+        rows = self.tiers[tier].rows(since, until)
+        bucket = self.open[tier]
+        if bucket is not None and (since is None or bucket[0] >= since) and (until is None or bucket[0] < until):
+            rows.append((bucket[0], bucket[1], bucket[2] / bucket[3], bucket[4]))
+        return rows
+
+
+class History:
+    """
+    属性历史记录：每个属性一组定长环形缓冲区，自动降采样到分钟/小时/天
+    filename: 存档文件（JSON 头 + 各列的原始字节）
+    """
+
+    def __init__(self, filename, keys=attributes):
+        self.filename = filename
+        self.metrics = {key: MetricHistory() for key in keys}
+        self.dirty = False
+        self.on_dirty = None  # 可选回调：从干净变脏时调用一次
+        self.load()
+
+    def record(self, values, t=None):
+        """values: {属性: 值}，t 默认为当前时间"""
+        t = time.time() if t is None else t
+        for key, value in values.items():
+            if key in self.metrics:
+                self.metrics[key].record(t, value)
+        was_clean = not self.dirty
+        self.dirty = True
+        if was_clean and self.on_dirty is not None:
+            self.on_dirty()
+
+    @staticmethod
+    def pick_tier(span):
+        """按时间跨度（秒）选层级，让图表的点数保持在几百以内"""
+        if span <= 6 * 3600:
+            return 'raw'
+        if span <= 2 * 86400:
+            return 'minute'
+        if span <= 62 * 86400:
+            return 'hour'
+        return 'day'
+
+    def series(self, key, span, tier=None, now=None):
+        """最近 span 秒的 (t, min, mean, max) 序列，tier 默认按跨度自动选择"""
+        now = time.time() if now is None else now
+        return self.metrics[key].series(tier or self.pick_tier(span), since=now - span)
+
+    # ---------- IO ----------
+    def save(self, force=False):
+        if not self.dirty and not force:
+            return False
+        header = {'version': 1, 'metrics': {}}
+        chunks = []
+        for key, history in self.metrics.items():
+            buffers = {'raw': history.raw}
+            buffers.update(history.tiers)
+            header['metrics'][key] = {
+                'buffers': {name: buffer.header() for name, buffer in buffers.items()},
+                'open': history.open,
+            }
+            chunks.extend(buffer.to_bytes() for buffer in buffers.values())
+        head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        atomic_write_bytes(self.filename, head + b'\n' + b''.join(chunks))
+        self.dirty = False
+        return True
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return
+        newline = raw.index(b'\n')
+        header = json.loads(raw[:newline])
+        offset = newline + 1
+        for key, info in header['metrics'].items():
+            history = self.metrics[key] if key in self.metrics else MetricHistory()
+            buffers = {'raw': history.raw}
+            buffers.update(history.tiers)
+            for name, buffer_header in info['buffers'].items():
+                buffer = buffers[name] if name in buffers else \
+                    RingBuffer(buffer_header['capacity'], RAW_COLUMNS if name == 'raw' else AGG_COLUMNS)
+                offset = buffer.load_bytes(buffer_header, raw, offset)
+            history.open.update({name: bucket for name, bucket in info['open'].items() if name in history.open})
+        self.dirty = False
@@ -0,0 +1,239 @@
+"""
+批量导入完成事件（手环、习惯打卡等导出的 CSV / JSONL），按批应用到 State 和 TaskList
+
+    python -m objects.ingest events.csv --user alice
+    python -m objects.ingest events.jsonl
+
+每条事件的字段：
+    time   时间戳（秒）或 ISO 时间，可省略（视为现在）
+    task   任务名，count 为次数（默认 1，负数表示撤销）
+    属性名  直接给出属性变化量，如 sleep=5；必须是 attributes 里的名字
+一批事件先把任务次数和属性变化量累加起来，再一次 apply_vector，每批只落盘一次
+今天（上次凌晨重置之后）的任务事件同时记入任务的完成状态，按完成状态实际的变化加效果：
+已勾选的单次任务再完成一次（或计数为 0 时再撤销）不重复加效果，计入报告的 ignored；更早的事件只作用于属性
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import logging
+import math
+import time
+from datetime import datetime, timedelta
+
+from objects.state import attributes, attribute_index
+from objects.task import RESET_HOUR
+from objects.scheduler import next_day_boundary
+from objects.instrument import REGISTRY, timed
+
+logger = logging.getLogger('katachi.ingest')
+
+INGEST_EVENTS = REGISTRY.counter('katachi_ingest_events_total', 'Ingested completion events, by result.', ('result',))
+
+BATCH_SIZE = 5000
+EVENT_FIELDS = {'time', 'task', 'count'}
+
+
+def finite(value):
+    """float(value)，nan / inf 抛 ValueError（写进 state.json 不是合法的 JSON，SQLite 也存不了）"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value!r}")
+    return number
+
+
+def parse_time(value):
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+    return finite(number)
+
+
+def parse_event(raw, task_list):
+    """校验一条事件，返回 (时间戳或 None, 任务名或 None, 次数, {属性: 变化量})；不合法时抛 ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError('event must be an object')
+    task_name = raw.get('task') or None
+    delta = {}
+    for key, value in raw.items():
+        if value is None or value == '' or key in EVENT_FIELDS:
+            continue
+        if key not in attribute_index:
+            raise ValueError(f"unknown field '{key}'")
+        delta[key] = finite(value)
+    if task_name is not None and task_list.get_task(task_name) is None:
+        raise ValueError(f"unknown task '{task_name}'")
+    if task_name is None and not delta:
+        raise ValueError('event has neither a task nor attribute changes')
+    count = raw.get('count')
+    if isinstance(count, float):
+        finite(count)  # int(inf) 抛的是 OverflowError
+    count = 1 if count is None or count == '' else int(count)
+    return parse_time(raw.get('time')), task_name, count, delta
+
+
+class Ingestor:
+    """
+    逐行喂入事件，攒满 batch_size 条应用一批
+    fmt: 'jsonl' 或 'csv'（第一行为表头）
+    max_errors: 报告里最多保留多少条出错信息（出错的行只计数并跳过，不中断导入）
+    """
+
+    def __init__(self, state, task_list, fmt='jsonl', batch_size=BATCH_SIZE, max_errors=20):
+        if fmt not in ('jsonl', 'csv'):
+            raise ValueError(f"Unsupported format '{fmt}'.")
+        self.state = state
+        self.task_list = task_list
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.header = None
+        self.line_no = 0
+        self.batch = []
+        task_list.sync()  # 按最新的任务列表校验任务名
+        # 今天的起点：上次凌晨重置的时刻，之后的任务事件计入完成状态
+        last_day = task_list.last_reset_time - timedelta(days=1)
+        self.today_start = next_day_boundary(last_day, RESET_HOUR, task_list.timezone)
+        self.report = {'events': 0, 'applied': 0, 'rejected': 0, 'ignored': 0, 'batches': 0, 'errors': []}
+        self.start = time.perf_counter()
+
+    def _parse_line(self, line):
+        if self.fmt == 'jsonl':
+            return json.loads(line)
+        row = next(csv.reader([line]))
+        if self.header is None:
+            self.header = [name.strip() for name in row]
+            return None
+        return dict(zip(self.header, (value.strip() for value in row)))
+
+    def feed_line(self, line):
+        """喂入一行；这一批攒满时返回 True，调用方应随后调用 flush_batch（或其异步版本）"""
+        self.line_no += 1
+        line = line.strip()
+        if not line:
+            return False
+        try:
+            raw = self._parse_line(line)
+            if raw is None:
+                return False
+            self.batch.append(parse_event(raw, self.task_list))
+        except (ValueError, TypeError) as e:  # json.JSONDecodeError 是 ValueError 的子类
+            self.report['events'] += 1
+            self.report['rejected'] += 1
+            if len(self.report['errors']) < self.max_errors:
+                self.report['errors'].append(f'line {self.line_no}: {e}')
+            return False
+        self.report['events'] += 1
+        return len(self.batch) >= self.batch_size
+
+    @timed('ingest_batch')
+    def _apply_batch(self):
+        """把当前这一批的效果一次加到状态上，今天的任务次数记入任务列表（只改内存，落盘由调用方做）"""
+        import numpy as np
+        counts, today = {}, {}
+        delta = np.zeros(len(attributes))
+        for when, task_name, count, changes in self.batch:
+            if task_name is not None:
+                if when is None or when >= self.today_start:
+                    today[task_name] = today.get(task_name, 0) + count
+                else:
+                    counts[task_name] = counts.get(task_name, 0) + count
+            for key, value in changes.items():
+                delta[attribute_index[key]] += value
+        # 今天的事件只按完成状态实际的变化加效果，否则已勾选的单次任务会重复加、取消勾选时却只减一次
+        changed = self.task_list.complete_many(today)
+        for task_name, change in changed.items():
+            counts[task_name] = counts.get(task_name, 0) + change
+        self.report['ignored'] += sum(abs(count) - abs(changed.get(task_name, 0)) for task_name, count in today.items())
+        if counts:
+            delta += self.task_list.effect_matrix().delta(counts)
+        self.state.apply_vector(delta)
+        self.report['applied'] += len(self.batch)
+        self.report['batches'] += 1
+        self.batch = []
+
+    def flush_batch(self):
+        if self.batch:
+            self._apply_batch()
+            self.state.save_state(force=True)
+            self.task_list.save_tasks(force=True)
+
+    async def flush_batch_async(self):
+        if self.batch:
+            self._apply_batch()
+            await self.state.save_state_async(force=True)
+            await self.task_list.save_tasks_async(force=True)
+
+    def finish(self):
+        report = self.report
+        report['seconds'] = time.perf_counter() - self.start
+        report['events_per_second'] = report['events'] / report['seconds'] if report['seconds'] else 0.0
+        INGEST_EVENTS.inc('applied', amount=report['applied'])
+        INGEST_EVENTS.inc('rejected', amount=report['rejected'])
+        logger.info("Ingested %d/%d events in %d batches, %.2f s (%.0f events/s).", report['applied'],
+                    report['events'], report['batches'], report['seconds'], report['events_per_second'])
+        return report
+
+
+def ingest_lines(state, task_list, lines, fmt='jsonl', batch_size=BATCH_SIZE):
+    """同步导入（命令行用），返回报告"""
+    ingestor = Ingestor(state, task_list, fmt, batch_size)
+    for line in lines:
+        if ingestor.feed_line(line):
+            ingestor.flush_batch()
+    ingestor.flush_batch()
+    return ingestor.finish()
+
+
+async def ingest_stream(state, task_list, chunks, fmt='jsonl', batch_size=BATCH_SIZE):
+    """
+    异步导入（HTTP 路由用）：chunks 是字节块的异步迭代器（如 request.stream()），边收边解析
+    每批之间让出事件循环，落盘在线程池里完成
+    """
+    ingestor = Ingestor(state, task_list, fmt, batch_size)
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            if ingestor.feed_line(line):
+                await ingestor.flush_batch_async()
+                await asyncio.sleep(0)
+    pending += decoder.decode(b'', final=True)
+    ingestor.feed_line(pending)
+    await ingestor.flush_batch_async()
+    return ingestor.finish()
+
+
+def guess_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+if __name__ == '__main__':
+    # JSON 文件模式下服务正在使用这个用户时会拿不到目录锁（LockedError）；
+    # 服务用 SQLite 存储时传同样的 --db（如 katachi.db），直接写用户的库，可以和服务同时运行，服务在下一次同步时看到改动
+    from objects.tenants import TenantCache
+
+    parser = argparse.ArgumentParser(description='批量导入完成事件')
+    parser.add_argument('file')
+    parser.add_argument('--user', default=None, help='用户名，省略时导入单用户模式的数据（--root）')
+    parser.add_argument('--root', default='.')
+    parser.add_argument('--users-dir', default='./users')
+    parser.add_argument('--db', default=None, help='SQLite 库文件名（同服务的 DB_NAME），省略时读写 JSON 文件')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None, help='默认按扩展名判断')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tenants = TenantCache(root=args.root, users_dir=args.users_dir, db_name=args.db)
+    tenant = tenants.get(args.user)
+    with open(args.file, 'r', encoding='utf-8-sig', newline='') as f:
+        result = ingest_lines(tenant.state, tenant.task_list, f, args.format or guess_format(args.file),
+                              args.batch_size)
+    tenants.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
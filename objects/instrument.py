@@ -0,0 +1,261 @@
+import asyncio
+import atexit
+import inspect
+import logging
+import logging.handlers
+import os
+import queue
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+
+
+# 延迟直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Family:
+    """同名指标按标签值分成多个子项，子项创建后缓存，热路径上只做一次字典查找"""
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self.children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, *values, amount=1):
+        self.labels(*values).value += amount
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}']
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *values, value):
+        self.labels(*values).value = value
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, *values, value):
+        self.labels(*values).observe(value)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+            bucket_labels = _format_labels(self.labelnames, values, f'le="{le}"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(child.sum)}')
+        lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class Registry:
+    """所有指标的登记处；collectors 在每次导出前调用，用来刷新按需计算的 gauge（如文件大小）"""
+
+    def __init__(self):
+        self.families = {}
+        self.collectors = {}
+
+    def _get(self, cls, name, help_text, labelnames, **kwargs):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = cls(name, help_text, labelnames, **kwargs)
+        elif not isinstance(family, cls) or family.labelnames != tuple(labelnames):
+            raise ValueError(f"Metric '{name}' already registered with a different type or labels.")
+        return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def on_collect(self, name, fn):
+        """同名的 collector 会被替换（脚本模式下页面代码每次访问都会重新执行）"""
+        self.collectors[name] = fn
+
+    def render(self):
+        """Prometheus 文本格式"""
+        for fn in list(self.collectors.values()):
+            fn()
+        lines = []
+        for name in sorted(self.families):
+            lines.extend(self.families[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+OP_SECONDS = REGISTRY.histogram('katachi_op_seconds', 'Latency of task/state operations.', ('op',))
+OP_ERRORS = REGISTRY.counter('katachi_op_errors_total', 'Operations that failed or targeted a missing task.', ('op',))
+FILE_BYTES = REGISTRY.gauge('katachi_file_bytes', 'Size of the last write of each persisted file.', ('file',))
+WRITE_SECONDS = REGISTRY.histogram('katachi_write_seconds', 'Latency of atomic file writes.', ('file',))
+LOOP_LAG = REGISTRY.histogram('katachi_loop_lag_seconds', 'How late the event loop woke a sleeping probe.')
+LOOP_LAG_MAX = REGISTRY.gauge('katachi_loop_lag_max_seconds', 'Largest event loop lag over the recent probes.')
+
+
+def timed(op):
+    """装饰器：把函数耗时记入 katachi_op_seconds{op=...}；协程函数记录到 await 结束为止"""
+    def decorator(fn):
+        child = OP_SECONDS.labels(op)
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+async def monitor_loop_lag(interval=0.5, window=60):
+    """
+    事件循环延迟探针：每 interval 秒睡一次，醒来时比预期晚了多少就是循环被阻塞的时间
+    最大值 gauge 取最近 window 次探测；作为后台任务运行，不会自己结束，关闭时由调用方取消这个任务
+    """
+    child = LOOP_LAG.labels()
+    gauge = LOOP_LAG_MAX.labels()
+    recent = deque(maxlen=window)
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        child.observe(lag)
+        recent.append(lag)
+        gauge.value = max(recent)
+
+
+# ---------- 日志 ----------
+_listener = None
+
+
+def setup_logging(level=None):
+    """
+    给 'katachi' 日志器挂上队列：调用方只把记录放进队列，由后台线程写到 stderr，不阻塞事件循环
+    level: 日志级别名（DEBUG/INFO/...）或 'OFF'；默认读环境变量 KATACHI_LOG_LEVEL，未设置时为 INFO
+    每次操作的日志是 DEBUG 级别，生产环境用 INFO 或 OFF 即可
+    """
+    global _listener
+    level = (level or os.environ.get('KATACHI_LOG_LEVEL', 'INFO')).upper()
+    logger = logging.getLogger('katachi')
+    stop_logging()
+    logger.handlers.clear()
+    logger.propagate = False
+    if level == 'OFF':
+        # 高于 CRITICAL 的级别让子日志器在 isEnabledFor 处就直接返回，连记录都不创建
+        logger.setLevel(logging.CRITICAL + 1)
+        logger.addHandler(logging.NullHandler())
+        return logger
+    logger.setLevel(level)
+
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+@atexit.register
+def stop_logging():
+    """停止后台写日志线程（会先写完队列里剩下的记录）"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
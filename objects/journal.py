@@ -0,0 +1,84 @@
+import json
+import os
+
+
+class TaskJournal:
+    """
+    任务变更日志：每次操作追加一行紧凑的 JSON 记录，而不是重写整个 tasks.json
+    snapshot_file: 快照文件（即 tasks.json）
+    log_file: 日志文件，默认为 <snapshot_file>.log
+    compact_every: 日志累计多少条记录后写一次快照并截断日志
+    """
+
+    def __init__(self, snapshot_file, log_file=None, compact_every=200):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file or snapshot_file + '.log'
+        self.compact_every = compact_every
+        self.pending = 0  # 上次快照之后追加的记录数
+        self.appended = 0  # 本进程追加过的记录总数，只增不减，用来判断快照之后是否又有新记录
+        self._fp = None
+
+    def append(self, op, **fields):
+        record = {'op': op}
+        record.update(fields)
+        if self._fp is None:
+            self._fp = open(self.log_file, 'a', encoding='utf-8')
+        self._fp.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._fp.flush()
+        self.pending += 1
+        self.appended += 1
+
+    def read(self):
+        """
+        按顺序读出日志中的记录；崩溃时写了一半的最后一行（及其后的内容）会从文件里截掉，
+        否则之后追加的记录会接在它后面，下次回放时连同后面的记录一起丢掉
+        """
+        try:
+            with open(self.log_file, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        records = []
+        valid = 0  # 最后一条完整记录之后的字节偏移
+        while valid < len(data):
+            end = data.find(b'\n', valid)
+            line = data[valid:] if end < 0 else data[valid:end]
+            if line.strip():
+                try:
+                    records.append(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+            if end < 0:  # 记录完整但没写上换行
+                self.close()
+                with open(self.log_file, 'ab') as f:
+                    f.write(b'\n')
+                valid = len(data)
+                break
+            valid = end + 1
+        if valid < len(data):
+            self.close()
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(valid)
+        self.pending = len(records)
+        return records
+
+    def needs_compaction(self):
+        return self.pending >= self.compact_every
+
+    def truncate(self):
+        """快照写完后清空日志"""
+        self.close()
+        with open(self.log_file, 'w', encoding='utf-8'):
+            pass
+        self.pending = 0
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def size(self):
+        try:
+            return os.path.getsize(self.log_file)
+        except FileNotFoundError:
+            return 0
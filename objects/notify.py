@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import socket
+
+logger = logging.getLogger('katachi.notify')
+
+
+class Notifier:
+    """
+    同一台机器上多个进程之间的改动通知（本地的发布/订阅替代品）
+    每个进程在 directory 下绑定一个 Unix 数据报套接字，publish 把主题（用户名）发给目录里其他进程的套接字，
+    收到的进程再去数据库拉取改动。通知只是提醒，数据以数据库为准：丢了的通知会在下一次操作前的 poll 里补上
+    不支持 Unix 套接字的平台上 available 为 False，调用方改用定时检查
+    """
+
+    def __init__(self, directory, on_message=None):
+        self.directory = directory
+        self.on_message = on_message  # 收到通知时调用，参数为主题
+        self.available = hasattr(socket, 'AF_UNIX')
+        self.path = None
+        self.sock = None
+
+    def start(self):
+        """绑定套接字并挂到事件循环上（在事件循环中调用，如 app.on_startup）"""
+        if not self.available or self.sock is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f'{os.getpid()}.sock')
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            if self.on_message is not None:
+                try:
+                    self.on_message(data.decode('utf-8'))
+                except Exception:
+                    logger.exception("Notify handler failed.")
+
+    def publish(self, topic):
+        if self.sock is None:
+            return
+        data = topic.encode('utf-8')
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if path == self.path or not name.endswith('.sock'):
+                continue
+            try:
+                self.sock.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(path)  # 进程已经退出，清理残留的套接字文件
+                except OSError:
+                    pass
+            except BlockingIOError:
+                pass  # 对方的接收缓冲区满了
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        except RuntimeError:
+            pass  # 事件循环已经停止
+        self.sock.close()
+        self.sock = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
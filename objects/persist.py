@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from objects.instrument import FILE_BYTES, WRITE_SECONDS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+_io_executor = None
+
+
+def io_executor():
+    """落盘用的线程池，第一次使用时创建"""
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='katachi-io')
+    return _io_executor
+
+
+def run_io(fn, *args):
+    """在线程池里执行阻塞的文件操作，返回可 await 的 future（必须在事件循环中调用）"""
+    return asyncio.get_running_loop().run_in_executor(io_executor(), fn, *args)
+
+
+def encode_json(data, indent=2):
+    return json.dumps(data, ensure_ascii=False, indent=indent).encode('utf-8')
+
+
+def read_json(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def atomic_write_json(filename, data, indent=2):
+    """先写同目录下的临时文件再 os.replace，崩溃时不会留下半截 JSON；返回写入的字节数"""
+    return atomic_write_bytes(filename, encode_json(data, indent))
+
+
+def atomic_write_bytes(filename, raw):
+    start = time.perf_counter()
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filename) + '.', suffix='.tmp', dir=dirname)
+    try:
+        try:
+            mode = os.stat(filename).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)  # mkstemp 默认 0600，保持原文件权限
+        with os.fdopen(fd, 'wb') as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    name = os.path.basename(filename)
+    WRITE_SECONDS.observe(name, value=time.perf_counter() - start)
+    FILE_BYTES.set(name, value=len(raw))
+    return len(raw)
+
+
+class LockedError(RuntimeError):
+    """数据目录正被另一个进程使用"""
+
+
+class DirectoryLock:
+    """
+    数据目录的独占建议锁（<directory>/.lock）：JSON 文件模式下同一个目录只能由一个进程读写，
+    第二个进程拿不到锁时抛 LockedError，而不是和第一个进程互相覆盖整文件写入
+    多进程部署请用 SQLite 存储；没有 fcntl 的平台上不加锁
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, '.lock')
+        self.fd = None
+
+    def acquire(self):
+        if fcntl is None or self.fd is not None:
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise LockedError(f"'{self.directory}' is in use by another process.")
+        self.fd = fd
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+class WriteBehind:
+    """
+    写回缓存：记录哪些条目被修改过，把 window 秒内的多次保存请求合并成一次落盘
+    filename: 目标文件
+    dump_fn: 无参函数，返回要写入的数据，只在真正落盘时才调用
+    window: 合并窗口（秒），0 表示每次有改动的保存请求都立即落盘
+    writer: 可选，替代整文件写入的函数，接收脏条目集合并返回写入字节数（用于存储后端）
+
+    异步落盘（flush_async 等）在事件循环里把数据编码成不可变的字节快照，再交给线程池写文件；
+    每个快照带递增的序号，写入时序号不大于已写入序号的旧快照直接丢弃，所以旧数据不会覆盖新数据
+    """
+
+    def __init__(self, filename, dump_fn, window=0, writer=None):
+        self.filename = filename
+        self.dump_fn = dump_fn
+        self.window = window
+        self.writer = writer
+        self.dirty = set()
+        self.last_flush = float('-inf')
+        self.seq = 0          # 最近一次取快照的序号
+        self.written_seq = 0  # 已写入文件的最大序号
+        self._write_lock = threading.Lock()
+        self.on_dirty = None  # 可选回调：从干净变脏时调用一次（用于按需安排落盘，而不是定时轮询）
+        # 统计
+        self.requests = 0
+        self.flushes = 0
+        self.skipped = 0
+        self.stale = 0  # 因为已有更新的快照写入而丢弃的旧快照数
+        self.bytes_written = 0
+
+    def mark_dirty(self, key=None):
+        """key 为被修改的条目名（任务名/属性名），None 表示整体变化"""
+        was_clean = not self.dirty
+        self.dirty.add(key)
+        if was_clean and self.on_dirty is not None:
+            self.on_dirty()
+
+    def clear(self):
+        self.dirty.clear()
+
+    def is_dirty(self):
+        return bool(self.dirty)
+
+    def request_flush(self):
+        """保存请求：无改动直接跳过；距上次落盘不足 window 秒时留给 flush_pending"""
+        self.requests += 1
+        if not self.dirty:
+            self.skipped += 1
+            return False
+        if time.monotonic() - self.last_flush < self.window:
+            return False
+        return self.flush()
+
+    def flush_pending(self):
+        """由定时器调用，把窗口内积压的改动落盘"""
+        if self.dirty and time.monotonic() - self.last_flush >= self.window:
+            return self.flush()
+        return False
+
+    def flush(self, force=False):
+        if not self.dirty and not force:
+            return False
+        if self.writer is not None:
+            self.bytes_written += self.writer(set(self.dirty)) or 0
+            self.flushes += 1
+            self.last_flush = time.monotonic()
+            self.dirty.clear()
+        else:
+            self.bytes_written += self._write_snapshot(*self._snapshot())
+        return True
+
+    def _snapshot(self):
+        """取一份带序号的字节快照并清空脏标记"""
+        self.seq += 1
+        raw = encode_json(self.dump_fn())
+        self.flushes += 1
+        self.last_flush = time.monotonic()
+        self.dirty.clear()
+        return self.seq, raw
+
+    def _write_snapshot(self, seq, raw):
+        with self._write_lock:
+            if seq <= self.written_seq:
+                self.stale += 1
+                return 0
+            written = atomic_write_bytes(self.filename, raw)
+            self.written_seq = seq
+            return written
+
+    # ---------- 异步 ----------
+    async def flush_async(self, force=False):
+        if not self.dirty and not force:
+            return False
+        if self.writer is not None:
+            return self.flush(force)  # 存储后端的连接不跨线程使用
+        dirty = set(self.dirty)
+        seq, raw = self._snapshot()
+        try:
+            written = await run_io(self._write_snapshot, seq, raw)
+        except BaseException:
+            for key in dirty or {None}:  # 写失败时留给下一次保存
+                self.mark_dirty(key)
+            raise
+        self.bytes_written += written
+        return True
+
+    async def request_flush_async(self):
+        self.requests += 1
+        if not self.dirty:
+            self.skipped += 1
+            return False
+        if time.monotonic() - self.last_flush < self.window:
+            return False
+        return await self.flush_async()
+
+    async def flush_pending_async(self):
+        if self.dirty and time.monotonic() - self.last_flush >= self.window:
+            return await self.flush_async()
+        return False
+
+    def stats(self):
+        return {
+            'file': self.filename,
+            'requests': self.requests,
+            'flushes': self.flushes,
+            'skipped': self.skipped,
+            'stale': self.stale,
+            'bytes_written': self.bytes_written,
+            'dirty': len(self.dirty),
+        }
@@ -0,0 +1,130 @@
+"""
+建议任务：给定各属性的目标区间和时间范围，挑出一小组任务完成次数，使 horizon 之后的属性尽量落在目标区间内
+单次任务今天没完成过的可以选 0 / 1 次，已完成的不能再选；多次任务可以选 0 ~ max_count 次
+
+假设计划的任务现在一起完成：效果一次加上后截断到 0~100（同 State.apply_vector），再按衰减率线性推进 horizon 秒再截断；
+目标是 Σ 超出目标区间的距离²，每多做一次任务额外计 task_cost，避免为了一点点改善建议很多任务
+先贪心地每次加一次收益最大的任务，再反复尝试把已选的一次换成另一个任务（或去掉），直到不再变好；
+每一步都是 (任务数 × 属性数) 的一次 numpy 运算，几百个任务也只要几毫秒
+"""
+import time
+
+from objects.state import attributes
+from objects.instrument import timed
+
+
+DEFAULT_TARGET = (60, 100)  # 没有指定目标的属性用这个区间
+MAX_TASKS = 5               # 最多建议的任务次数（总和）
+MAX_COUNT = 3               # 多次任务最多建议做几次
+TASK_COST = 1.0             # 每多做一次任务的代价（与距离² 同单位）
+
+
+class Plan:
+    """一次规划的结果"""
+
+    def __init__(self, counts, baseline, projected, score, baseline_score):
+        self.counts = counts                  # {任务名: 次数}，按任务列表顺序
+        self.baseline = baseline              # 什么都不做时 horizon 之后的属性值
+        self.projected = projected            # 完成建议任务后 horizon 之后的属性值
+        self.score = score                    # 建议任务的目标值（越小越好，不含 task_cost）
+        self.baseline_score = baseline_score  # 什么都不做时的目标值
+
+    def __bool__(self):
+        return bool(self.counts)
+
+
+def _bounds(state, targets):
+    """targets -> 与 attributes 对齐的下限 / 上限向量；不在 state.metrics 里的属性不约束"""
+    import numpy as np
+    low = np.zeros(len(attributes))
+    high = np.full(len(attributes), 100.0)
+    for i, key in enumerate(attributes):
+        if key in state.metrics:
+            low[i], high[i] = (targets or {}).get(key, DEFAULT_TARGET)
+    return low, high
+
+
+def _capacity(task_entry, max_count):
+    """这个任务最多还能建议做几次"""
+    if task_entry['task'].get_type() == 'check':
+        return 0 if task_entry['completed'] else 1
+    return max_count
+
+
+@timed('plan')
+def plan_tasks(state, task_list, targets=None, horizon=3 * 3600, max_tasks=MAX_TASKS,
+               max_count=MAX_COUNT, task_cost=TASK_COST, now=None):
+    """
+    targets: {属性: (下限, 上限)}，未给出的属性用 DEFAULT_TARGET
+    horizon: 秒，按这么久之后的属性值评估
+    返回 Plan
+    """
+    import numpy as np
+    now = time.time() if now is None else now
+    effects = task_list.effect_matrix()
+    low, high = _bounds(state, targets)
+    start = state.as_vector(now)
+    decay = np.array([state.decay_rates.get(key, 0) for key in attributes], dtype=np.float64) * (horizon / 3600)
+
+    def project(deltas):
+        return np.clip(np.clip(start + deltas, 0, 100) + decay, 0, 100)
+
+    def score(deltas):
+        values = project(deltas)
+        return (np.maximum(low - values, 0) ** 2 + np.maximum(values - high, 0) ** 2).sum(axis=-1)
+
+    capacity = np.array([_capacity(task_list.get_task(name), max_count) for name in effects.names], dtype=np.int64)
+    usable = (capacity > 0) & effects.matrix.any(axis=1)
+    rows = np.flatnonzero(usable)
+    matrix = effects.matrix[rows]
+    capacity = capacity[rows]
+    counts = np.zeros(len(rows), dtype=np.int64)
+    total = np.zeros(len(attributes))
+    current = float(score(total))
+    baseline_score = current
+
+    if len(rows):
+        # 贪心：每次加一次带来的改善最大、且超过 task_cost 的任务
+        while counts.sum() < max_tasks:
+            candidates = score(total + matrix)
+            candidates[counts >= capacity] = np.inf
+            best = int(np.argmin(candidates))
+            if current - candidates[best] <= task_cost:
+                break
+            counts[best] += 1
+            total += matrix[best]
+            current = float(candidates[best])
+
+        # 局部调整：把已选的一次换成另一个任务或直接去掉，只接受让 目标值 + 代价 变小的调整
+        for _ in range(2 * max_tasks):
+            best_gain, best_move = 1e-9, None
+            for i in np.flatnonzero(counts):
+                without = total - matrix[i]
+                removed = float(score(without))
+                if current - removed + task_cost > best_gain:
+                    best_gain, best_move = current - removed + task_cost, (i, None, removed)
+                candidates = score(without + matrix)
+                candidates[counts >= capacity] = np.inf
+                candidates[i] = np.inf  # 换成自己等于没换
+                j = int(np.argmin(candidates))
+                if current - candidates[j] > best_gain:
+                    best_gain, best_move = current - candidates[j], (i, j, float(candidates[j]))
+            if best_move is None:
+                break
+            i, j, current = best_move
+            counts[i] -= 1
+            total -= matrix[i]
+            if j is not None:
+                counts[j] += 1
+                total += matrix[j]
+
+    chosen = {effects.names[rows[i]]: int(counts[i]) for i in np.flatnonzero(counts)}
+    baseline = project(np.zeros(len(attributes)))
+    projected = project(total)
+    return Plan(
+        {name: chosen[name] for name in task_list.all_tasks if name in chosen},
+        {key: float(baseline[i]) for i, key in enumerate(attributes) if key in state.metrics},
+        {key: float(projected[i]) for i, key in enumerate(attributes) if key in state.metrics},
+        current,
+        baseline_score,
+    )
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+from datetime import datetime, time as day_time, timedelta
+
+from objects.instrument import REGISTRY
+
+logger = logging.getLogger('katachi.scheduler')
+
+JOBS_RUN = REGISTRY.counter('katachi_scheduler_jobs_total', 'Scheduler jobs run, by kind.', ('kind',))
+JOBS_PENDING = REGISTRY.gauge('katachi_scheduler_pending', 'Jobs waiting in the scheduler queue.')
+
+MAX_SLEEP = 3600  # 秒，最长睡这么久就重新看一次队列，防止系统时间被调整后睡过头
+STOP_TIMEOUT = 5  # 秒，stop 最多等正在执行的任务这么久，不让关闭卡住
+
+
+def next_day_boundary(last_day, hour=4, tz=None):
+    """last_day 之后那一天的 hour 点（tz 时区，None 为本地时区）的时间戳，夏令时切换由 tzinfo 处理"""
+    boundary = datetime.combine(last_day + timedelta(days=1), day_time(hour), tzinfo=tz)
+    return boundary.timestamp()
+
+
+class Job:
+    __slots__ = ('when', 'key', 'callback', 'repeat', 'cancelled')
+
+    def __init__(self, when, key, callback, repeat=None):
+        self.when = when          # 到期时间（time.time() 时间戳）
+        self.key = key            # 同一个 key 只保留一个待执行的任务；key 的第一项作为任务类型统计
+        self.callback = callback  # 同步或异步函数，无参数
+        self.repeat = repeat      # 可选，执行后调用它得到下一次的到期时间，返回 None 表示不再重复
+        self.cancelled = False
+
+    @property
+    def kind(self):
+        return self.key[0] if isinstance(self.key, tuple) else str(self.key)
+
+
+class Scheduler:
+    """
+    按到期时间排序的任务队列（最小堆），一个后台协程睡到最早的到期时间再执行，而不是每个会话各自轮询
+    取消和替换是惰性的：只把旧任务标记为 cancelled，出堆时丢弃
+    后台协程由 start 启动（app.on_startup），stop 取消（app.on_shutdown，要在关闭用户数据之前）
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.jobs = {}  # key -> 待执行的 Job
+        self._counter = itertools.count()  # 同一时刻的任务按加入顺序执行
+        self._wakeup = None
+        self._task = None  # start 启动的后台协程
+
+    def schedule(self, when, callback, key=None, repeat=None, keep_earlier=False):
+        """
+        when: 到期时间戳；key 相同的待执行任务会被替换
+        keep_earlier: 为 True 时若已有同 key 且到期更早（或相同）的任务，则保留原任务
+        """
+        key = key if key is not None else ('job', next(self._counter))
+        existing = self.jobs.get(key)
+        if existing is not None:
+            if keep_earlier and existing.when <= when:
+                return existing
+            existing.cancelled = True
+        job = Job(when, key, callback, repeat)
+        self.jobs[key] = job
+        heapq.heappush(self.heap, (when, next(self._counter), job))
+        if self._wakeup is not None and self.heap[0][2] is job:
+            self._wakeup.set()  # 新任务比当前等待的更早，叫醒后台协程重新计算睡眠时间
+        return job
+
+    def schedule_in(self, delay, callback, key=None, repeat=None, keep_earlier=False):
+        return self.schedule(time.time() + delay, callback, key, repeat, keep_earlier)
+
+    def cancel(self, key):
+        job = self.jobs.pop(key, None)
+        if job is not None:
+            job.cancelled = True
+        return job is not None
+
+    def cancel_where(self, predicate):
+        """取消所有 key 满足 predicate 的任务（如某个用户的全部任务）"""
+        for key in [key for key in self.jobs if predicate(key)]:
+            self.cancel(key)
+
+    def next_deadline(self):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def _pop_due(self, now):
+        due = []
+        while self.heap and (self.heap[0][2].cancelled or self.heap[0][0] <= now):
+            _, _, job = heapq.heappop(self.heap)
+            if not job.cancelled:
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+                due.append(job)
+        return due
+
+    async def _run_job(self, job):
+        try:
+            result = job.callback()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logger.exception("Job %r failed.", job.key)
+        JOBS_RUN.inc(job.kind)
+        if job.repeat is not None and job.key not in self.jobs:
+            when = job.repeat()
+            if when is not None:
+                self.schedule(when, job.callback, job.key, job.repeat)
+
+    async def run_due(self, now=None):
+        """执行所有到期的任务，返回执行的个数"""
+        due = self._pop_due(time.time() if now is None else now)
+        for job in due:
+            await self._run_job(job)
+        JOBS_PENDING.set(value=len(self.jobs))
+        return len(due)
+
+    def start(self):
+        """在事件循环里启动后台协程 run"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """取消后台协程并等它结束，之后不再执行任何任务（正在执行的任务随之取消）"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.wait([task], timeout=STOP_TIMEOUT)
+        self._wakeup = None
+
+    async def run(self):
+        """后台协程：睡到最早的到期时间（或有更早的新任务加入），执行到期任务，如此循环"""
+        self._wakeup = asyncio.Event()
+        while True:
+            deadline = self.next_deadline()
+            timeout = MAX_SLEEP if deadline is None else min(MAX_SLEEP, max(0.0, deadline - time.time()))
+            self._wakeup.clear()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            await self.run_due()
@@ -1,5 +1,13 @@
 import time
-import json
+import logging
+from objects.persist import WriteBehind, read_json, run_io
+from objects.storage import ConflictError
+from objects.events import EventBus
+from objects.instrument import timed, OP_ERRORS
+
+logger = logging.getLogger('katachi.state')
+
+MAX_RETRIES = 3  # 存储后端版本冲突时最多合并重试几次
 
 
 attributes = [
@@ -12,71 +20,315 @@ attributes = [
     'mood',
     'social'
 ]
+attribute_index = {key: i for i, key in enumerate(attributes)}  # 属性名 -> 向量下标
 
 class State:
 
     # initialization
-    def __init__(self, filename, init_metrics=dict(), decay_rates=dict(), init=False):
+    def __init__(self, filename, init_metrics=dict(), decay_rates=dict(), init=False, save_window=0, storage=None):
         """
         filename: 存档文件
         init_metrics: 初始属性字典
         decay_rates: 每小时衰减量字典，例如 {'energy': -1, 'focus': -0.5}
+        save_window: 合并保存的时间窗口（秒），窗口内的多次 save_state 只落盘一次
+        storage: 存储后端（如 SqliteStorage），设置后只写入改动过的属性；
+                 多个进程共用后端时按版本号检测冲突，冲突时把本地的增量合并到对方写入的值上再写
         """
         self.filename = filename
         self.metrics = init_metrics
         self.last_update = time.time()  # 上次更新时间
         self.decay_rates = decay_rates
+        self.storage = storage
+        # 改动事件：('metrics', None, {属性: 新的基准值}) 或 ('reload', None, None)；衰减是连续的，不发事件
+        self.events = EventBus()
+        self.store = WriteBehind(filename, self._state_data, window=save_window,
+                                 writer=self._write_storage if storage is not None else None)
+        # 存储后端模式下，上次写入之后本地做的修改：增量可以叠加到其他进程写入的值上，直接设置的值覆盖对方
+        self.version = 0
+        self._pending = {}    # 属性 -> 累计增量
+        self._overrides = {}  # 属性（或 'decay_rates'）-> 直接设置的值
+        if storage is not None:
+            storage.subscribe(self._on_remote_changes)
         if not init:
             self.load_state()
     
 
     # ---------- Getter / Setter ----------
+    # self.metrics 保存的是 last_update 时刻的基准值，当前值按线性衰减现算：
+    # value(t) = clamp(base + rate * (t - last_update) / 3600)，衰减率不变时与逐次衰减再截断的结果相同
     def get_state(self):
-        return self.metrics
+        now = time.time()
+        return {key: self.value_at(key, now) for key in self.metrics}
 
     def get_metric(self, key):
-        return self.metrics.get(key, None)
+        if key not in self.metrics:
+            return None
+        return self.value_at(key, time.time())
+
+    def value_at(self, key, t):
+        """属性在时间 t（时间戳）的值"""
+        elapsed_hours = (t - self.last_update) / 3600
+        return max(0, min(100, self.metrics[key] + self.decay_rates.get(key, 0) * elapsed_hours))
 
     def update_metric(self, key, value):
         if key in self.metrics:
-            self.metrics[key] = max(0, min(100, self.metrics[key] + value))
+            self.apply_decay()
+            if self.storage is not None:
+                self._pending[key] = self._pending.get(key, 0) + value
+            new_value = max(0, min(100, self.metrics[key] + value))
+            if new_value != self.metrics[key]:
+                self.metrics[key] = new_value
+                self.store.mark_dirty(key)
+                self.events.publish('metrics', None, {key: new_value})
 
     def set_metric(self, key, value):
+        self.apply_decay()
         self.metrics[key] = max(0, min(100, value))
+        if self.storage is not None:
+            self._pending.pop(key, None)
+            self._overrides[key] = self.metrics[key]
+        self.store.mark_dirty(key)
+        self.events.publish('metrics', None, {key: self.metrics[key]})
 
     def set_metrics(self, new_metrics):
         self.metrics = new_metrics
+        self.last_update = time.time()
+        if self.storage is not None:
+            self._pending.clear()
+            self._overrides.update(new_metrics)
+        self.store.mark_dirty()
+        self.events.publish('reload')
 
     def set_decay_rates(self, new_decay_rates):
+        self.apply_decay()  # 之前经过的时间按旧的衰减率结算
         self.decay_rates = new_decay_rates
+        if self.storage is not None:
+            self._overrides['decay_rates'] = new_decay_rates
+        self.store.mark_dirty('decay_rates')
+        self.events.publish('reload')
 
     # ---------- Decay ----------
+    @timed('apply_decay')
     def apply_decay(self):
-        """根据时间差应用衰减"""
+        """把到现在为止的衰减结算进基准值（读取时已按时间现算，只有修改属性前才需要调用）"""
         now = time.time()
-        elapsed_hours = (now - getattr(self, 'last_update', now)) / 3600  # 秒转小时
-
+        elapsed_hours = (now - self.last_update) / 3600
         for key, rate in self.decay_rates.items():
-            if key in self.metrics:
-                self.metrics[key] = max(0, min(100, self.metrics[key] + rate * elapsed_hours))
-
+            if rate and key in self.metrics:  # 不衰减的属性不用算（基准值本来就在 0~100 内）
+                new_value = max(0, min(100, self.metrics[key] + rate * elapsed_hours))
+                if new_value != self.metrics[key]:
+                    self.metrics[key] = new_value
+                    self.store.mark_dirty(key)
         self.last_update = now
 
+    # ---------- Vector ----------
+    def as_vector(self, t=None):
+        """按 attributes 顺序返回时间 t 的属性向量（numpy），缺失的属性为 0"""
+        import numpy as np
+        t = time.time() if t is None else t
+        return np.array([self.value_at(key, t) if key in self.metrics else 0.0 for key in attributes])
+
+    @timed('apply_vector')
+    def apply_vector(self, delta):
+        """
+        整体加上一个属性变化向量后截断到 0~100，相当于一次性完成一批 update_metric
+        返回截断后真正加上的变化量（向量），减去它就能精确撤销这一次修改
+        """
+        import numpy as np
+        self.apply_decay()
+        new_values = np.clip(self.as_vector(self.last_update) + delta, 0, 100)
+        if self.storage is not None:
+            for key in self.metrics:
+                if key in attribute_index:
+                    self._pending[key] = self._pending.get(key, 0) + float(delta[attribute_index[key]])
+        changed = {}
+        applied = np.zeros(len(attributes))
+        for key in self.metrics:
+            new_value = float(new_values[attribute_index[key]]) if key in attribute_index else self.metrics[key]
+            if new_value != self.metrics[key]:
+                applied[attribute_index[key]] = new_value - self.metrics[key]
+                self.metrics[key] = changed[key] = new_value
+                self.store.mark_dirty(key)
+        if changed:
+            self.events.publish('metrics', None, changed)
+        return applied
+
+    @timed('apply_delta')
+    def apply_delta(self, delta):
+        """
+        delta: {属性: 变化量}，与 apply_vector 等价的标量版本：单个任务只碰几个属性，不必经过 numpy
+        返回 {属性: 截断后真正加上的变化量}（只含有变化的属性）
+        """
+        self.apply_decay()
+        changed = {}
+        applied = {}
+        for key, value in delta.items():
+            if not value or key not in self.metrics:
+                continue
+            if self.storage is not None:
+                self._pending[key] = self._pending.get(key, 0) + value
+            new_value = max(0, min(100, self.metrics[key] + value))
+            if new_value != self.metrics[key]:
+                applied[key] = new_value - self.metrics[key]
+                self.metrics[key] = changed[key] = new_value
+                self.store.mark_dirty(key)
+        if changed:
+            self.events.publish('metrics', None, changed)
+        return applied
+
+    def time_to_value(self, key, target, now=None):
+        """从 now 起属性衰减到 target 还需多少秒；不会到达时返回 None"""
+        now = time.time() if now is None else now
+        rate = self.decay_rates.get(key, 0)
+        current = self.value_at(key, now)
+        if rate == 0 or not 0 <= target <= 100:
+            return None
+        if (target - current) * rate < 0:
+            return None
+        return (target - current) / rate * 3600
+
+    def time_until_change(self, shown, step=1, now=None):
+        """
+        shown: 界面上当前显示的值 {属性: 值}
+        返回最早有属性相对显示值变化达到 step（或触到 0/100 边界）还需多少秒；都不会再变时返回 None
+        """
+        now = time.time() if now is None else now
+        soonest = None
+        for key, rate in self.decay_rates.items():
+            if key not in self.metrics or key not in shown or rate == 0:
+                continue
+            target = shown[key] + step if rate > 0 else shown[key] - step
+            target = max(0, min(100, target))
+            if target == shown[key]:
+                continue  # 已经停在边界上
+            seconds = self.time_to_value(key, target, now)
+            if seconds is None:
+                seconds = 0  # 显示值已经落后于实际值
+            if soonest is None or seconds < soonest:
+                soonest = seconds
+        return soonest
+
     # ---------- IO ----------
-    def save_state(self):
-        data = {
+    def _state_data(self):
+        return {
             'metrics': self.metrics,
             'last_update': self.last_update
         }
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
 
+    @timed('save_state')
+    def save_state(self, force=False):
+        """没有改动时跳过；force=True 时无条件立即落盘"""
+        if force:
+            return self.store.flush(force=True)
+        return self.store.request_flush()
+
+    def flush_pending(self):
+        return self.store.flush_pending()
+
+    async def save_state_async(self, force=False):
+        """save_state 的异步版本：快照在事件循环里编码，写文件放到线程池"""
+        if force:
+            return await self.store.flush_async(force=True)
+        return await self.store.request_flush_async()
+
+    async def flush_pending_async(self):
+        return await self.store.flush_pending_async()
+
+    def _write_storage(self, dirty):
+        """存储后端模式下只写入改动过的属性行；版本冲突时先合并其他进程的写入，再整体写一次"""
+        for attempt in range(MAX_RETRIES):
+            try:
+                self.version = self.storage.bump_state_version(self.version)
+                break
+            except ConflictError:
+                OP_ERRORS.inc('conflict')
+                logger.info("State version conflict, merging (attempt %d).", attempt + 1)
+                self.storage.rollback()
+                self._merge_remote()
+                dirty = {None}
+                if attempt == MAX_RETRIES - 1:
+                    raise
+        if not dirty or None in dirty:
+            changed = self.metrics
+        else:
+            changed = {key: self.metrics[key] for key in dirty if key in self.metrics}
+        self.storage.save_metrics(changed, self.last_update)
+        if not dirty or None in dirty or 'decay_rates' in dirty:
+            self.storage.save_decay_rates(self.decay_rates)
+        self.storage.commit()
+        self._pending.clear()
+        self._overrides.clear()
+        return 0
+
+    def _merge_remote(self):
+        """以后端里的最新状态为基础，重新叠加本地还没写入的修改（直接设置的值覆盖，增量相加）"""
+        data = self.storage.load_state()
+        if data is None:
+            return
+        self.metrics = dict(data['metrics'])
+        self.last_update = data['last_update']
+        self.version = data['version']
+        if 'decay_rates' in self._overrides:
+            self.decay_rates = self._overrides['decay_rates']
+        elif data.get('decay_rates') is not None:
+            self.decay_rates = data['decay_rates']
+        now = time.time()
+        for key in self.metrics:
+            self.metrics[key] = self.value_at(key, now)
+        self.last_update = now
+        for key, value in self._overrides.items():
+            if key in self.metrics:
+                self.metrics[key] = value
+        for key, delta in self._pending.items():
+            if key in self.metrics:
+                self.metrics[key] = max(0, min(100, self.metrics[key] + delta))
+
+    def _on_remote_changes(self, changes):
+        if any(kind == 'state' for kind, _ in changes):
+            had_local = self.store.is_dirty()
+            self._merge_remote()
+            if not had_local:
+                self.store.clear()  # 本地没有未写入的修改，和后端一致
+            self.events.publish('reload')
+
+    @timed('load_state')
     def load_state(self):
+        if self.storage is not None:
+            data = self.storage.load_state()
+            if data is None:
+                self.save_state(force=True)
+                return
+            self.set_metrics(data['metrics'])
+            if data.get('decay_rates') is not None:
+                self.set_decay_rates(data['decay_rates'])
+            self.last_update = data['last_update']
+            self.version = data['version']
+            self._pending.clear()
+            self._overrides.clear()
+            self.store.clear()
+            return
+        try:
+            data = read_json(self.filename)
+        except FileNotFoundError:
+            self.save_state(force=True)
+            return
+        self._apply_data(data)
+
+    async def load_state_async(self):
+        """load_state 的异步版本：读文件和解析 JSON 放到线程池"""
+        if self.storage is not None:
+            self.load_state()
+            return
         try:
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.set_metrics(data.get('metrics', {}))
-                self.set_decay_rates(data.get('decay_rates', self.decay_rates))
-                self.last_update = data.get('last_update', time.time())
+            data = await run_io(read_json, self.filename)
         except FileNotFoundError:
-            self.save_state()
+            await self.save_state_async(force=True)
+            return
+        self._apply_data(data)
+
+    def _apply_data(self, data):
+        self.set_metrics(data.get('metrics', {}))
+        self.set_decay_rates(data.get('decay_rates', self.decay_rates))
+        self.last_update = data.get('last_update', time.time())
+        self.store.clear()
+        self.events.publish('reload')
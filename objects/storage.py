@@ -0,0 +1,406 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from objects.persist import atomic_write_json
+
+
+class ConflictError(Exception):
+    """乐观并发冲突：要改的记录在本进程读取之后已被其他进程改过"""
+
+
+class Storage:
+    """
+    存储后端接口：TaskList / State 通过它按条目读写，而不是整文件重写
+    TaskList 的每个操作都会生成一条描述结果的记录（与 journal 相同），由 apply_record 落到后端
+    多个进程共用一个后端时，apply_record 按 versions 做版本检查，冲突时抛 ConflictError；
+    poll 拉取其他进程提交的改动并交给 subscribe 登记的回调
+    """
+
+    # ---------- 任务 ----------
+    def load_tasks(self):
+        """返回 (tasks_data, day)，tasks_data 与 tasks.json 格式相同"""
+        raise NotImplementedError
+
+    def apply_record(self, record, day, versions=None):
+        """versions: {任务名: 版本}，给出时只有版本一致才写入，并原地更新为新版本"""
+        raise NotImplementedError
+
+    def replace_tasks(self, tasks_data, day):
+        raise NotImplementedError
+
+    # ---------- 状态 ----------
+    def load_state(self):
+        """返回 {'metrics', 'decay_rates', 'last_update'}，没有存档时返回 None"""
+        raise NotImplementedError
+
+    def save_metrics(self, metrics, last_update):
+        raise NotImplementedError
+
+    def save_decay_rates(self, decay_rates):
+        raise NotImplementedError
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def subscribe(self, fn):
+        pass
+
+    def poll(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class SqliteStorage(Storage):
+    """
+    SQLite 存储：任务定义、按天的完成情况、属性值分表保存，任务表按 label / type 建索引
+    path: 数据库文件
+
+    多进程（多个 worker / 实例）可以共用同一个库：
+    - 每个任务行和状态都有版本号，写入时带上读到的版本（UPDATE ... WHERE version = ?），不一致就是冲突
+    - 每次写入同时在 changes 表追加一条改动记录（带上写入进程的 origin），
+      其他进程用 PRAGMA data_version 发现有新提交后，只读出别人的改动记录
+    """
+
+    BUSY_TIMEOUT = 5  # 秒，其他进程持有写锁时最多等这么久
+    KEEP_CHANGES = 10000  # changes 表最多保留的记录数
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            name TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            label TEXT,
+            effect TEXT NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_label ON tasks(label, position);
+        CREATE INDEX IF NOT EXISTS idx_tasks_type ON tasks(type);
+        CREATE INDEX IF NOT EXISTS idx_tasks_position ON tasks(position);
+        CREATE TABLE IF NOT EXISTS completions (
+            day TEXT NOT NULL,
+            name TEXT NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, name)
+        );
+        CREATE TABLE IF NOT EXISTS metrics (
+            key TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('state_version', '0');
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=self.BUSY_TIMEOUT)
+        self._enable_wal()
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(tasks)')]
+        if columns and 'version' not in columns:  # 旧版本建的库
+            self.conn.execute('ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'  # 区分改动记录是不是自己写的
+        self.seen_seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+        self.data_version = self._data_version()
+        self.listeners = []
+        self.on_commit = None  # 可选回调：提交了改动之后调用（用来通知其他进程）
+        self._wrote = False
+        self._commits = 0
+
+    # ---------- 多进程 ----------
+    def _enable_wal(self):
+        """
+        切换到 WAL 需要独占锁，且 SQLite 不会为它调用忙等待处理，
+        两个进程同时第一次打开同一个库时会直接报 database is locked，这里自己重试
+        """
+        deadline = time.monotonic() + self.BUSY_TIMEOUT
+        while True:
+            try:
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _data_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _log_change(self, kind, name=None):
+        """kind: 'task'（单个任务）、'tasks'（整体或顺序变化）、'state'"""
+        self.conn.execute('INSERT INTO changes (origin, kind, name) VALUES (?, ?, ?)', (self.origin, kind, name))
+        self._wrote = True
+
+    def begin(self):
+        """立即拿写锁开始事务，之后的读到提交为止都不会被其他进程插入改动"""
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+
+    def subscribe(self, fn):
+        """fn(changes)：poll 发现其他进程的改动时调用，changes 为 [(kind, name), ...]"""
+        self.listeners.append(fn)
+
+    def poll(self):
+        """检查其他进程是否提交过改动（PRAGMA data_version，开销很小）；有则交给订阅者，返回改动列表"""
+        version = self._data_version()
+        if version == self.data_version:
+            return []
+        self.data_version = version
+        first = self.conn.execute('SELECT MIN(seq) FROM changes').fetchone()[0]
+        rows = self.conn.execute('SELECT seq, origin, kind, name FROM changes WHERE seq > ? ORDER BY seq',
+                                 (self.seen_seq,)).fetchall()
+        if first is not None and first > self.seen_seq + 1:
+            changes = [('tasks', None), ('state', None)]  # 中间的记录已被清理，整体重新加载
+        else:
+            changes = [(kind, name) for _, origin, kind, name in rows if origin != self.origin]
+        if rows:
+            self.seen_seq = rows[-1][0]
+        if changes:
+            for fn in self.listeners:
+                fn(changes)
+        return changes
+
+    def _check_version(self, name, versions):
+        """任务行版本号加一；给出 versions 时要求版本与之一致，否则抛 ConflictError"""
+        if versions is None:
+            self.conn.execute('UPDATE tasks SET version = version + 1 WHERE name = ?', (name,))
+            return
+        cursor = self.conn.execute('UPDATE tasks SET version = version + 1 WHERE name = ? AND version = ?',
+                                   (name, versions.get(name)))
+        if cursor.rowcount == 0:
+            raise ConflictError(name)
+        versions[name] += 1
+
+    def _get_meta(self, key, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM tasks LIMIT 1').fetchone() is None and \
+            self.conn.execute('SELECT 1 FROM metrics LIMIT 1').fetchone() is None
+
+    # ---------- 任务 ----------
+    def load_tasks(self):
+        day = self._get_meta('day')
+        rows = self.conn.execute(
+            'SELECT t.name, t.type, t.label, t.effect, c.completed, c.count FROM tasks t '
+            'LEFT JOIN completions c ON c.name = t.name AND c.day = ? ORDER BY t.position', (day,))
+        tasks_data = {}
+        for name, task_type, label, effect, completed, count in rows:
+            tasks_data[name] = {
+                'name': name,
+                'effect': json.loads(effect),
+                'type': task_type,
+                'label': label,
+                'completed': bool(completed),
+                'count': count or 0
+            }
+        return tasks_data, day
+
+    def _upsert_task(self, info):
+        self.conn.execute(
+            'INSERT INTO tasks (name, type, label, effect, position) '
+            'VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM tasks)) '
+            'ON CONFLICT(name) DO UPDATE SET type = excluded.type, label = excluded.label, effect = excluded.effect',
+            (info['name'], info['type'], info.get('label'), json.dumps(info['effect'], ensure_ascii=False)))
+
+    def _set_completion(self, day, name, completed, count):
+        self.conn.execute('INSERT OR REPLACE INTO completions (day, name, completed, count) VALUES (?, ?, ?, ?)',
+                          (day, name, int(completed), count))
+
+    def apply_record(self, record, day, versions=None):
+        op = record['op']
+        if op in ('complete', 'uncomplete'):
+            self._check_version(record['name'], versions)
+            self._set_completion(day, record['name'], record['completed'], record['count'])
+            self._log_change('task', record['name'])
+        elif op in ('create', 'upsert'):
+            name = record['task']['name']
+            if op == 'create' and versions is not None:
+                exists = self.conn.execute('SELECT 1 FROM tasks WHERE name = ?', (name,)).fetchone()
+                if exists:
+                    raise ConflictError(name)
+                versions[name] = 0
+            elif op == 'upsert':
+                self._check_version(name, versions)
+            self._upsert_task(record['task'])
+            self._set_completion(day, name, record.get('completed', False), record.get('count', 0))
+            self._log_change('task', name)
+        elif op == 'delete':
+            if versions is not None:
+                cursor = self.conn.execute('DELETE FROM tasks WHERE name = ? AND version = ?',
+                                           (record['name'], versions.get(record['name'])))
+                if cursor.rowcount == 0:
+                    raise ConflictError(record['name'])
+                versions.pop(record['name'], None)
+            else:
+                self.conn.execute('DELETE FROM tasks WHERE name = ?', (record['name'],))
+            self.conn.execute('DELETE FROM completions WHERE day = ? AND name = ?', (day, record['name']))
+            self._log_change('task', record['name'])
+        elif op == 'move':
+            self._check_version(record['name'], versions)
+            self._move_task(record['name'], record.get('before'))
+            self._log_change('tasks')
+        elif op == 'reset':
+            # 之前各天的记录保留为历史，当天（手动重置）清零；所有任务版本加一，和重置并发的完成操作会冲突重试
+            self._set_meta('day', record['date'])
+            self.conn.execute('UPDATE completions SET completed = 0, count = 0 WHERE day = ?', (record['date'],))
+            self.conn.execute('UPDATE tasks SET version = version + 1')
+            if versions is not None:
+                for name in versions:
+                    versions[name] += 1
+            self._log_change('tasks')
+
+    def _move_task(self, name, before):
+        """把 name 的 position 设为 before 的 position，原来在它之后（含）的任务后移一位；before 为 None 时移到最后"""
+        row = self.conn.execute('SELECT position FROM tasks WHERE name = ?', (before,)).fetchone() if before else None
+        if row is None:
+            self.conn.execute('UPDATE tasks SET position = (SELECT COALESCE(MAX(position), -1) + 1 FROM tasks) '
+                              'WHERE name = ?', (name,))
+            return
+        self.conn.execute('UPDATE tasks SET position = position + 1 WHERE position >= ?', (row[0],))
+        self.conn.execute('UPDATE tasks SET position = ? WHERE name = ?', (row[0], name))
+
+    def replace_tasks(self, tasks_data, day):
+        self.conn.execute('DELETE FROM tasks')
+        self.conn.execute('DELETE FROM completions WHERE day = ?', (day,))
+        self._set_meta('day', day)
+        for task_info in tasks_data.values():
+            self._upsert_task(task_info)
+            self._set_completion(day, task_info['name'], task_info.get('completed', False), task_info.get('count', 0))
+        self._log_change('tasks')
+
+    def task_versions(self):
+        return dict(self.conn.execute('SELECT name, version FROM tasks'))
+
+    def load_task(self, name):
+        """单个任务的 (task_info, version)，不存在时为 (None, None)"""
+        row = self.conn.execute(
+            'SELECT t.name, t.type, t.label, t.effect, c.completed, c.count, t.version FROM tasks t '
+            'LEFT JOIN completions c ON c.name = t.name AND c.day = ? WHERE t.name = ?',
+            (self._get_meta('day'), name)).fetchone()
+        if row is None:
+            return None, None
+        return {'name': row[0], 'type': row[1], 'label': row[2], 'effect': json.loads(row[3]),
+                'completed': bool(row[4]), 'count': row[5] or 0}, row[6]
+
+    # ---------- 状态 ----------
+    def load_state(self):
+        metrics = dict(self.conn.execute('SELECT key, value FROM metrics ORDER BY rowid'))
+        if not metrics:
+            return None
+        decay_rates = self._get_meta('decay_rates')
+        last_update = self._get_meta('last_update')
+        return {
+            'metrics': metrics,
+            'decay_rates': json.loads(decay_rates) if decay_rates else None,
+            'last_update': float(last_update) if last_update else time.time(),
+            'version': int(self._get_meta('state_version', 0))
+        }
+
+    def bump_state_version(self, expected):
+        """状态版本号加一并返回新版本；当前版本不是 expected 时抛 ConflictError"""
+        cursor = self.conn.execute(
+            "UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'state_version' "
+            "AND CAST(value AS INTEGER) = ?", (expected,))
+        if cursor.rowcount == 0:
+            raise ConflictError('state')
+        self._log_change('state')
+        return expected + 1
+
+    def save_metrics(self, metrics, last_update):
+        self.conn.executemany('INSERT INTO metrics (key, value) VALUES (?, ?) '
+                              'ON CONFLICT(key) DO UPDATE SET value = excluded.value', metrics.items())
+        self._set_meta('last_update', repr(last_update))
+
+    def save_decay_rates(self, decay_rates):
+        self._set_meta('decay_rates', json.dumps(decay_rates))
+
+    def commit(self):
+        self.conn.commit()
+        if self._wrote:
+            self._wrote = False
+            self._commits += 1
+            if self._commits % 1000 == 0:
+                self.conn.execute('DELETE FROM changes WHERE seq <= ?', (self.seen_seq - self.KEEP_CHANGES,))
+                self.conn.commit()
+            if self.on_commit is not None:
+                self.on_commit()
+
+    def rollback(self):
+        self.conn.rollback()
+        self._wrote = False
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    # ---------- JSON 导入导出 ----------
+    def import_json(self, tasks_file=None, state_file=None, day=None):
+        """从 tasks.json / state.json 导入，day 默认为快照里记录的重置日期，没有时为今天"""
+        from datetime import date
+        from objects.task import RESET_KEY
+        if tasks_file:
+            with open(tasks_file, 'r', encoding='utf-8') as f:
+                tasks_data = json.load(f)
+            snapshot_day = tasks_data.pop(RESET_KEY, None)
+            self.replace_tasks(tasks_data, day or snapshot_day or date.today().isoformat())
+        if state_file:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.conn.execute('DELETE FROM metrics')
+            self.save_metrics(data.get('metrics', {}), data.get('last_update', time.time()))
+            if 'decay_rates' in data:
+                self.save_decay_rates(data['decay_rates'])
+        self.commit()
+
+    def export_json(self, tasks_file=None, state_file=None):
+        if tasks_file:
+            from objects.task import RESET_KEY
+            tasks_data, day = self.load_tasks()
+            atomic_write_json(tasks_file, {RESET_KEY: day, **tasks_data} if day else tasks_data)
+        if state_file:
+            data = self.load_state() or {'metrics': {}, 'last_update': time.time()}
+            if data.get('decay_rates') is None:
+                data.pop('decay_rates', None)
+            atomic_write_json(state_file, data)
+
+
+if __name__ == '__main__':
+    # python -m objects.storage import katachi.db tasks.json state.json
+    # python -m objects.storage export katachi.db tasks.json state.json
+    import argparse
+    parser = argparse.ArgumentParser(description='SQLite 存储与 JSON 文件互相转换')
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('db')
+    parser.add_argument('tasks_file')
+    parser.add_argument('state_file')
+    args = parser.parse_args()
+    storage = SqliteStorage(args.db)
+    if args.action == 'import':
+        storage.import_json(args.tasks_file, args.state_file)
+    else:
+        storage.export_json(args.tasks_file, args.state_file)
+    storage.close()
@@ -1,29 +1,105 @@
-from objects.state import attributes
-from datetime import datetime, timedelta
+from objects.state import attribute_index
+from objects.journal import TaskJournal
+from objects.persist import WriteBehind, read_json, run_io
+from objects.instrument import timed, OP_ERRORS
+from objects.scheduler import next_day_boundary
+from objects.storage import ConflictError
+from objects.events import EventBus
+from datetime import datetime
+from functools import wraps
+import logging
+import sys
+
+logger = logging.getLogger('katachi.task')
+
+RESET_HOUR = 4  # 每天凌晨 4 点重置任务完成状态
+RESET_KEY = '__last_reset__'  # 快照（tasks.json）里记录上次重置日期的键，日志截断后重置日期仍在
+MAX_RETRIES = 3  # 存储后端版本冲突时最多重试几次
+
+# 操作 -> 发给订阅者的事件：'task' 条目变了，'add' 新增，'remove' 删除，'move' 顺序（value 为 before），'reload' 全部重来
+EVENT_FOR_OP = {'complete': 'task', 'uncomplete': 'task', 'upsert': 'task', 'create': 'add', 'delete': 'remove',
+                'move': 'move', 'reset': 'reload'}
+
+
+def versioned(fn):
+    """
+    存储后端模式下的多进程并发控制：操作前先拉取其他进程的改动；
+    写入时版本冲突（ConflictError）则回滚、从后端重新加载后重做这个操作
+    嵌套调用（如 update_task 里的 create_task）只在最外层处理
+    """
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self.storage is None or self._in_op:
+            return fn(self, *args, **kwargs)
+        self._in_op = True
+        try:
+            for attempt in range(MAX_RETRIES):
+                self.sync()
+                try:
+                    return fn(self, *args, **kwargs)
+                except ConflictError as e:
+                    OP_ERRORS.inc('conflict')
+                    logger.info("Version conflict on '%s' in %s, reloading (attempt %d).", e, fn.__name__, attempt + 1)
+                    self.storage.rollback()
+                    self.load_tasks()
+                    if attempt == MAX_RETRIES - 1:
+                        raise
+        finally:
+            self._in_op = False
+    return wrapper
+
 
 def check_valid_effect(effect):
-    for key in effect.keys():
-        if key not in attributes:
-            return False
-    return True
+    return all(key in attribute_index for key in effect)
+
+
+# 效果元组 -> 它自己：只收默认任务和模板库的效果（启动时登记，数量固定），它们在所有用户之间只存一份；
+# 用户自己编辑、导入的效果不进表，否则进程里见过的每种效果都会一直留在内存里
+_interned_effects = {}
+
+
+def _effect_items(effect):
+    return tuple(sorted(effect.items(), key=lambda item: attribute_index[item[0]]))
+
+
+def share_effects(effects):
+    """登记要在用户之间共享的效果（{属性: 值} 的可迭代对象），如默认任务和模板库"""
+    for effect in effects:
+        items = _effect_items(effect)
+        _interned_effects.setdefault(items, items)
+
+
+def intern_effect(effect):
+    """{属性: 值} -> 按 attributes 顺序排列的 ((属性, 值), ...)；登记过的效果返回共享的同一个元组"""
+    items = _effect_items(effect)
+    return _interned_effects.get(items, items)
+
+
+def _intern(text):
+    return sys.intern(text) if type(text) is str else text
 
 
 class Task:
-    
+    """
+    任务定义：__slots__，名称 / 类型 / 标签用驻留字符串，效果为元组（默认任务和模板的效果是共享的，见 share_effects）
+    几千个用户各自加载同一套默认任务时，这些都是共享的，每个任务只剩一个小对象
+    """
+    __slots__ = ('name', 'effect', 'type', 'label')
+
     def __init__(self, name, effect, task_type, label=None):
         if not check_valid_effect(effect):
             raise ValueError("Invalid effect keys.")
-        self.name = name
-        self.effect = effect
-        self.type = task_type
-        self.label = label
+        self.name = _intern(name)
+        self.effect = intern_effect(effect)
+        self.type = _intern(task_type)
+        self.label = _intern(label)
 
     def get_info(self):
-        return {'name': self.name, 'effect': self.effect, 'type': self.type, 'label': self.label}
+        return {'name': self.name, 'effect': self.get_effect(), 'type': self.type, 'label': self.label}
     def get_name(self):
         return self.name
     def get_effect(self):
-        return self.effect
+        return dict(self.effect)
     def get_type(self):
         return self.type
     def get_label(self):
@@ -31,47 +107,320 @@ class Task:
     def set_effect(self, new_effect):
         if not check_valid_effect(new_effect):
             raise ValueError("Invalid effect keys.")
-        self.effect = new_effect
+        self.effect = intern_effect(new_effect)
     def set_name(self, new_name):
-        self.name = new_name
+        self.name = _intern(new_name)
     def set_type(self, new_type):
-        self.type = new_type
+        self.type = _intern(new_type)
     def set_label(self, new_label):
-        self.label = new_label
+        self.label = _intern(new_label)
+
+
+class TaskEntry:
+    """
+    任务列表里的一个条目：任务定义 + 今天的完成状态，__slots__ 记录代替每个条目一个 dict
+    保留 dict 的写法（entry['count']、entry.get('completed', False)），调用方不用改
+    """
+    __slots__ = ('task', 'completed', 'count')
+
+    def __init__(self, task, completed=False, count=0):
+        self.task = task
+        self.completed = completed
+        self.count = count
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
 
     
 
+class TaskOrder:
+    """
+    任务的显示顺序：以任务名为键的双向链表，追加、删除、移动到某个任务之前都是 O(1)
+    """
+
+    def __init__(self, names=()):
+        self.links = {}  # 任务名 -> [前一个, 后一个]
+        self.head = None
+        self.tail = None
+        for name in names:
+            self.insert(name)
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, name):
+        return name in self.links
+
+    def __iter__(self):
+        name = self.head
+        while name is not None:
+            name, current = self.links[name][1], name
+            yield current
+
+    def insert(self, name, before=None):
+        """插到 before 之前；before 为 None 或不在列表里时追加到末尾"""
+        if before is None or before not in self.links:
+            prev, nxt = self.tail, None
+        else:
+            prev, nxt = self.links[before][0], before
+        self.links[name] = [prev, nxt]
+        if prev is None:
+            self.head = name
+        else:
+            self.links[prev][1] = name
+        if nxt is None:
+            self.tail = name
+        else:
+            self.links[nxt][0] = name
+
+    def remove(self, name):
+        prev, nxt = self.links.pop(name)
+        if prev is None:
+            self.head = nxt
+        else:
+            self.links[prev][1] = nxt
+        if nxt is None:
+            self.tail = prev
+        else:
+            self.links[nxt][0] = prev
+
+    def move(self, name, before=None):
+        if name != before:
+            self.remove(name)
+            self.insert(name, before)
+
+    def previous(self, name):
+        return self.links[name][0]
+
+    def next(self, name):
+        return self.links[name][1]
+
+
 class TaskList:
-    def __init__(self, filename):
+    def __init__(self, filename, journal=False, compact_every=200, save_window=0, storage=None, timezone=None):
+        """
+        filename: 任务存档文件
+        journal: 为 True 时每次操作只向 <filename>.log 追加一条记录，save_tasks 仅在日志足够长时写快照
+        compact_every: 日志累计多少条记录后写快照并截断日志
+        save_window: 合并保存的时间窗口（秒），窗口内的多次 save_tasks 只落盘一次
+        storage: 存储后端（如 SqliteStorage），设置后按条目读写后端，filename 仅作为导入导出格式
+        timezone: 按哪个时区的凌晨 4 点重置（tzinfo），None 为服务器本地时区
+        """
         self.all_tasks = dict()
+        # 二级索引，随条目增删改一起维护，按标签列出和每日重置只碰相关的任务
+        self.by_label = {}  # 标签 -> TaskOrder（该标签下任务的显示顺序）
+        self.by_type = {}   # 类型 -> 任务名集合
+        self.done = set()   # 今天已完成（completed 或 count > 0）的任务名
         self.filename = filename
-        self.last_reset_time = datetime.now().date()
+        self.timezone = timezone
+        self.last_reset_time = datetime.now(timezone).date()
+        self.storage = storage
+        self.journal = TaskJournal(filename, compact_every=compact_every) if journal and storage is None else None
+        self.store = WriteBehind(filename, self._snapshot_data, window=save_window)
+        self._effects = None  # 编译好的效果矩阵，任务增删改时作废
+        self._replaying = False
+        self.versions = {}  # 存储后端模式下每个任务读到的版本号（乐观并发控制）
+        self.events = EventBus()  # 细粒度改动事件，见 EVENT_FOR_OP
+        self._in_op = False
+        if storage is not None:
+            storage.subscribe(self._on_remote_changes)
         self.load_tasks()
 
+    # ---------- 条目与索引 ----------
+    def __len__(self):
+        return len(self.all_tasks)
+
+    def _put_entry(self, task_name, task_entry, before=None):
+        """新增或替换一个条目；标签不变时保留原来的位置"""
+        old_entry = self.all_tasks.get(task_name)
+        label = task_entry['task'].get_label()
+        if old_entry is not None:
+            old_task = old_entry['task']
+            self.by_type[old_task.get_type()].discard(task_name)
+            if old_task.get_label() != label:
+                self.by_label[old_task.get_label()].remove(task_name)
+        order = self.by_label.get(label)
+        if order is None:
+            order = self.by_label[label] = TaskOrder()
+        if task_name not in order:
+            order.insert(task_name, before)
+        self.by_type.setdefault(task_entry['task'].get_type(), set()).add(task_name)
+        self.all_tasks[task_name] = task_entry
+        self._sync_done(task_name)
+
+    def _drop_entry(self, task_name):
+        task_entry = self.all_tasks.pop(task_name)
+        task = task_entry['task']
+        self.by_label[task.get_label()].remove(task_name)
+        self.by_type[task.get_type()].discard(task_name)
+        self.done.discard(task_name)
+        return task_entry
+
+    def _clear_entries(self):
+        self.all_tasks = dict()
+        self.by_label = {}
+        self.by_type = {}
+        self.done = set()
+        self._effects = None
+
+    def _sync_done(self, task_name):
+        task_entry = self.all_tasks[task_name]
+        if task_entry['completed'] or task_entry['count'] > 0:
+            self.done.add(task_name)
+        else:
+            self.done.discard(task_name)
+
+    def _reset_done(self):
+        for task_name in self.done:
+            task_entry = self.all_tasks[task_name]
+            task_entry['completed'] = False
+            task_entry['count'] = 0
+        self.done.clear()
+
+    def _move(self, task_name, before):
+        task_entry = self.all_tasks.get(task_name)
+        if task_entry is None:
+            return False
+        order = self.by_label[task_entry['task'].get_label()]
+        if before is not None and before not in order:
+            return False
+        order.move(task_name, before)
+        return True
+
+    # ---------- Journal ----------
+    def _record(self, op, **fields):
+        name = fields.get('name') or fields.get('task', {}).get('name')
+        self.store.mark_dirty(name)
+        if op in ('create', 'upsert', 'delete'):
+            self._effects = None
+        if self._replaying:
+            return
+        if self.storage is not None:
+            record = {'op': op}
+            record.update(fields)
+            self.storage.apply_record(record, self.last_reset_time.isoformat(), self.versions)
+        elif self.journal is not None:
+            self.journal.append(op, **fields)
+        self.events.publish(EVENT_FOR_OP[op], name, fields.get('before'))
+
+    def sync(self):
+        """存储后端模式下拉取其他进程提交的改动"""
+        if self.storage is not None:
+            self.storage.poll()
+
+    def _on_remote_changes(self, changes):
+        """其他进程提交的改动：单个任务只重新读那一行，整体变化（重置、顺序、替换）重新加载全部"""
+        if any(kind == 'tasks' for kind, _ in changes):
+            self.load_tasks()
+            return
+        for kind, task_name in changes:
+            if kind != 'task':
+                continue
+            task_info, version = self.storage.load_task(task_name)
+            existed = task_name in self.all_tasks
+            if task_info is None:
+                if existed:
+                    self._drop_entry(task_name)
+                    self.events.publish('remove', task_name)
+                self.versions.pop(task_name, None)
+            else:
+                self._put_entry(task_name, TaskEntry(
+                    Task(task_info['name'], task_info['effect'], task_info['type'], task_info['label']),
+                    task_info['completed'], task_info['count']))
+                self.versions[task_name] = version
+                self.events.publish('task' if existed else 'add', task_name)
+            self._effects = None
+
+    def _record_entry(self, op, task_name):
+        """记录操作后的结果（而非增量），这样重放是幂等的"""
+        task_entry = self.all_tasks.get(task_name)
+        if task_entry is not None:
+            self._record(op, name=task_name, completed=task_entry['completed'], count=task_entry['count'])
+
+    def _replay(self, record):
+        op = record.get('op')
+        if op in ('complete', 'uncomplete'):
+            task_entry = self.all_tasks.get(record['name'])
+            if task_entry is not None:
+                task_entry['completed'] = record['completed']
+                task_entry['count'] = record['count']
+                self._sync_done(record['name'])
+        elif op in ('create', 'upsert'):
+            info = record['task']
+            self._put_entry(info['name'], TaskEntry(
+                Task(info['name'], info['effect'], info['type'], info.get('label', None)),
+                record.get('completed', False), record.get('count', 0)))
+        elif op == 'delete':
+            if record['name'] in self.all_tasks:
+                self._drop_entry(record['name'])
+        elif op == 'move':
+            self._move(record['name'], record.get('before'))
+        elif op == 'reset':
+            self._reset_done()
+            self.last_reset_time = datetime.strptime(record['date'], '%Y-%m-%d').date()
+
+    @timed('compact')
+    def compact(self):
+        """写一次完整快照并截断日志（仅 journal 模式，且日志非空时）"""
+        if self.journal is None or self.journal.pending == 0:
+            return False
+        self.store.flush(force=True)
+        self.journal.truncate()
+        return True
+
+    async def compact_async(self):
+        """compact 的异步版本：快照在线程池里写；写的过程中又追加了日志时先不截断，下次再合并（重放是幂等的）"""
+        if self.journal is None or self.journal.pending == 0:
+            return False
+        mark = self.journal.appended
+        await self.store.flush_async(force=True)
+        if self.journal.appended == mark:
+            self.journal.truncate()
+        return True
+
+    @versioned
+    @timed('reset_completion')
     def reset_completion_status(self, manual_reset=False):
         """检查是否跨过上次的凌晨4点，如果是则重置所有任务状态"""
-        now = datetime.now()
-        last_reset_point = datetime.combine(self.last_reset_time, datetime.min.time()) + timedelta(hours=4)
+        now = datetime.now(self.timezone)
 
         # 如果已经跨过新的4点
-        if now >= last_reset_point + timedelta(days=1) or manual_reset:
-            print(f"重置任务完成状态")
-            for task_entry in self.all_tasks.values():
-                if task_entry is not None:
-                    task_entry['completed'] = False
-                    task_entry['count'] = 0
+        if now.timestamp() >= self.next_reset_time() or manual_reset:
+            logger.info("重置任务完成状态")
+            self._reset_done()  # 只有今天完成过的任务需要清零
             self.last_reset_time = now.date()
+            self._record('reset', date=self.last_reset_time.isoformat())
             self.save_tasks()
         
+    def next_reset_time(self):
+        """下一次自动重置的时间戳：上次重置那天之后的凌晨 4 点（按 timezone）"""
+        return next_day_boundary(self.last_reset_time, RESET_HOUR, self.timezone)
+
     def reset_entries(self, new_tasks):
-        self.all_tasks = dict()
+        self._clear_entries()
         for key, task_dict in new_tasks.items():
             task_obj = Task(task_dict['name'], task_dict['effect'], task_dict['type'], task_dict.get('label', None))
-            self.all_tasks[task_dict['name']] = {
-                'task': task_obj,
-                'completed': task_dict['completed'],
-                'count': task_dict['count']
-            }
+            self._put_entry(task_dict['name'], TaskEntry(task_obj, task_dict['completed'], task_dict['count']))
+        self.store.mark_dirty()
+        if self.storage is not None:
+            self.storage.replace_tasks(self._tasks_data(), self.last_reset_time.isoformat())
+            self.storage.commit()
+            self.versions = self.storage.task_versions()
+            self.store.clear()
+        # 整体替换无法用增量记录表达，直接落一次快照
+        elif self.journal is not None:
+            self.store.flush(force=True)
+            self.journal.truncate()
+        self.events.publish('reload')
     
 
 
@@ -79,40 +428,201 @@ class TaskList:
 
     def list_all(self):
         return list(self.all_tasks.values())
+
+    def names_by_label(self, label):
+        """某个标签下的任务名，按显示顺序"""
+        return list(self.by_label.get(label, ()))
+
+    def list_by_label(self, label):
+        """某个标签下的任务条目，按显示顺序"""
+        return [self.all_tasks[name] for name in self.by_label.get(label, ())]
+
+    def list_by_type(self, task_type):
+        return [self.all_tasks[name] for name in self.by_type.get(task_type, ())]
+
+    def list_done(self):
+        """今天已完成（勾选或计数大于 0）的任务条目"""
+        return [self.all_tasks[name] for name in self.done]
+
+    def previous_task(self, task_name):
+        """同一标签内排在前面的任务名，已经是第一个时为 None"""
+        task_entry = self.all_tasks.get(task_name)
+        if task_entry is None:
+            return None
+        return self.by_label[task_entry['task'].get_label()].previous(task_name)
+
+    def snapshot_entry(self, task_name):
+        """条目的完整副本（含显示位置：排在它后面的任务名），撤销用；不存在时为 None"""
+        task_entry = self.all_tasks.get(task_name)
+        if task_entry is None:
+            return None
+        task = task_entry['task']
+        return {'task': task.get_info(), 'completed': task_entry['completed'], 'count': task_entry['count'],
+                'before': self.by_label[task.get_label()].next(task_name)}
+
+    @versioned
+    @timed('restore')
+    def restore_entry(self, task_name, snapshot):
+        """把条目恢复成 snapshot_entry 的结果（None 表示删除），只记这一个条目的日志"""
+        existed = task_name in self.all_tasks
+        if snapshot is None:
+            if existed:
+                self._drop_entry(task_name)
+                self._record('delete', name=task_name)
+            return
+        info = snapshot['task']
+        self._put_entry(task_name, TaskEntry(Task(info['name'], info['effect'], info['type'], info['label']),
+                                             snapshot['completed'], snapshot['count']), before=snapshot['before'])
+        self._record('upsert' if existed else 'create', task=info,
+                     completed=snapshot['completed'], count=snapshot['count'])
+        before = snapshot['before']
+        order = self.by_label[info['label']]
+        if existed and order.next(task_name) != before and (before is None or before in order):
+            self._move(task_name, before)
+        # create / upsert 记录里没有位置（重放和存储后端都会排到末尾），总要再记一条 move
+        self._record('move', name=task_name, before=order.next(task_name))
+
+    @versioned
+    @timed('move')
+    def move_task(self, task_name, before=None):
+        """在同一标签内把任务移到 before 之前（None 为移到末尾）"""
+        if not self._move(task_name, before):
+            OP_ERRORS.inc('move')
+            logger.warning("Cannot move task '%s' before '%s'.", task_name, before)
+            return False
+        self._record('move', name=task_name, before=before)
+        return True
     
-    def save_tasks(self):
-        import json
+    @timed('save_tasks')
+    def save_tasks(self, force=False):
+        """
+        journal 模式下操作已写入日志，这里只在日志过长时压缩；
+        否则交给写回缓存：没有改动时跳过，force=True 时无条件立即落盘；
+        有存储后端时改动已按条目写入，这里只提交事务
+        """
+        if self.storage is not None:
+            self.storage.commit()
+            self.store.clear()
+            return
+        if self.journal is not None:
+            if force or self.journal.needs_compaction():
+                self.compact()
+            return
+        if force:
+            self.store.flush(force=True)
+        else:
+            self.store.request_flush()
+
+    def flush_pending(self):
+        if self.journal is None and self.storage is None:
+            return self.store.flush_pending()
+        return False
+
+    async def save_tasks_async(self, force=False):
+        """save_tasks 的异步版本：JSON 快照在事件循环里编码，写文件放到线程池"""
+        if self.storage is not None:
+            self.save_tasks(force)
+            return
+        if self.journal is not None:
+            if force or self.journal.needs_compaction():
+                await self.compact_async()
+            return
+        if force:
+            await self.store.flush_async(force=True)
+        else:
+            await self.store.request_flush_async()
+
+    async def flush_pending_async(self):
+        if self.journal is None and self.storage is None:
+            return await self.store.flush_pending_async()
+        return False
+
+    def _tasks_data(self):
+        """按标签内的显示顺序输出，重新加载时顺序不变"""
         tasks_data = {}
-        for task_name, task_entry in self.all_tasks.items():
-            if task_entry is not None:
+        for order in self.by_label.values():
+            for task_name in order:
+                task_entry = self.all_tasks[task_name]
                 task_obj = task_entry.get('task')
                 tasks_data[task_name] = {
                     'name': task_obj.name,
-                    'effect': task_obj.effect,
+                    'effect': task_obj.get_effect(),
                     'type': task_obj.type,
                     'label': task_obj.label,
                     'completed': task_entry.get('completed', False),
                     'count': task_entry.get('count', 0)
                 }
-        with open('tasks.json', 'w', encoding='utf-8') as f:
-            json.dump(tasks_data, f, ensure_ascii=False, indent=2)
+        return tasks_data
+
+    def _snapshot_data(self):
+        """写到 tasks.json 的快照：任务之外还带上上次重置的日期"""
+        snapshot = {RESET_KEY: self.last_reset_time.isoformat()}
+        snapshot.update(self._tasks_data())
+        return snapshot
+
+    def _fill_entries(self, tasks_data):
+        self._clear_entries()
+        for task_name, task_info in tasks_data.items():
+            if task_name == RESET_KEY:
+                continue
+            task_obj = Task(task_info['name'], task_info['effect'], task_info['type'], task_info['label'])
+            self._put_entry(task_name, TaskEntry(task_obj, task_info.get('completed', False),
+                                                 task_info.get('count', 0)))
 
+    @timed('load_tasks')
     def load_tasks(self):
-        import json
+        self._effects = None
+        if self.storage is not None:
+            tasks_data, day = self.storage.load_tasks()
+            if day:
+                self.last_reset_time = datetime.strptime(day, '%Y-%m-%d').date()
+            else:
+                self.storage.apply_record({'op': 'reset', 'date': self.last_reset_time.isoformat()}, None)
+                self.storage.commit()
+            self._fill_entries(tasks_data)
+            self.versions = self.storage.task_versions()
+            self.store.clear()
+            self.events.publish('reload')
+            return
+        self._apply_loaded(*self._read_files())
+
+    async def load_tasks_async(self):
+        """load_tasks 的异步版本：读文件和解析 JSON 放到线程池，填充条目仍在事件循环里做"""
+        if self.storage is not None:
+            self.load_tasks()
+            return
+        tasks_data, records = await run_io(self._read_files)
+        self._effects = None
+        self._apply_loaded(tasks_data, records)
+
+    def _read_files(self):
+        """读快照和快照之后的日志尾部；快照不存在时 tasks_data 为 None"""
         try:
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                tasks_data = json.load(f)
-                for task_name, task_info in tasks_data.items():
-                    task_obj = Task(task_info['name'], task_info['effect'], task_info['type'], task_info['label'])
-                    self.all_tasks[task_name] = {
-                        'task': task_obj,
-                        'completed': task_info.get('completed', False),
-                        'count': task_info.get('count', 0)
-                    }
+            tasks_data = read_json(self.filename)
         except FileNotFoundError:
-            self.save_tasks()
+            tasks_data = None
+        records = self.journal.read() if self.journal is not None else []
+        return tasks_data, records
+
+    def _apply_loaded(self, tasks_data, records):
+        if tasks_data is None:
+            self.store.flush(force=True)
+        else:
+            if RESET_KEY in tasks_data:  # 旧快照没有这个键，按今天算
+                self.last_reset_time = datetime.strptime(tasks_data[RESET_KEY], '%Y-%m-%d').date()
+            self._fill_entries(tasks_data)
+        self._replaying = True
+        try:
+            for record in records:
+                self._replay(record)
+        finally:
+            self._replaying = False
+        self.store.clear()
+        self.events.publish('reload')
 
 
+    @versioned
+    @timed('complete')
     def complete_task(self, task_name):
         task_entry = self.get_task(task_name)
         if task_entry:
@@ -121,12 +631,17 @@ class TaskList:
                 task_entry['completed'] = True
             elif task.get_type() == 'counter':
                 task_entry['count'] += 1
-            print(f"Task '{task_name}' marked as completed.")
+            self._sync_done(task_name)
+            self._record_entry('complete', task_name)
+            logger.debug("Task '%s' marked as completed.", task_name)
             return True
         else:
-            print(f"Task '{task_name}' not found.")
+            OP_ERRORS.inc('complete')
+            logger.warning("Task '%s' not found.", task_name)
             return False
     
+    @versioned
+    @timed('uncomplete')
     def uncomplete_task(self, task_name):
         task_entry = self.get_task(task_name)
         if task_entry:
@@ -135,79 +650,157 @@ class TaskList:
                 task_entry['completed'] = False
             elif task.get_type() == 'counter' and task_entry['count'] > 0:
                 task_entry['count'] -= 1
-            print(f"Task '{task_name}' marked as uncompleted.")
+            self._sync_done(task_name)
+            self._record_entry('uncomplete', task_name)
+            logger.debug("Task '%s' marked as uncompleted.", task_name)
             return True
         else:
-            print(f"Task '{task_name}' not found.")
+            OP_ERRORS.inc('uncomplete')
+            logger.warning("Task '%s' not found.", task_name)
             return False
         
+    @versioned
+    @timed('complete_many')
+    def complete_many(self, counts):
+        """
+        批量记录完成次数 {任务名: 次数}（用于导入）：计数任务累加（不低于 0），单次任务按次数正负勾选或取消
+        每个任务只记一条日志；不存在的任务跳过，不应用效果（效果由调用方整批计算）
+        返回 {任务名: 实际变化的次数}：已勾选的单次任务再完成、计数已为 0 时再撤销都不算，调用方按它加效果
+        """
+        changed = {}
+        for task_name, count in counts.items():
+            task_entry = self.all_tasks.get(task_name)
+            if task_entry is None or count == 0:
+                continue
+            if task_entry['task'].get_type() == 'check':
+                was_completed = task_entry['completed']
+                task_entry['completed'] = count > 0
+                change = int(task_entry['completed']) - int(was_completed)
+            else:
+                old_count = task_entry['count']
+                task_entry['count'] = max(0, old_count + count)
+                change = task_entry['count'] - old_count
+            if change == 0:
+                continue
+            changed[task_name] = change
+            self._sync_done(task_name)
+            self._record_entry('complete' if change > 0 else 'uncomplete', task_name)
+        return changed
+
+    @versioned
+    @timed('toggle_type')
     def toggle_task_type(self, task_name):
         task_entry = self.get_task(task_name)
         if task_entry:
             task = task_entry['task']
+            self.by_type[task.get_type()].discard(task_name)
             if task.get_type() == 'check':
                 task.set_type('counter')
-                task_entry['count'] = 0 if not task.get('completed') else 1
+                task_entry['count'] = 0 if not task_entry.get('completed') else 1
             elif task.get_type() == 'counter':
                 task.set_type('check')
-                task_entry['completed'] = False if task.get('count', 0) == 0 else True
-            print(f"Task '{task_name}' type toggled.")
+                task_entry['completed'] = False if task_entry.get('count', 0) == 0 else True
+            self.by_type.setdefault(task.get_type(), set()).add(task_name)
+            self._sync_done(task_name)
+            self._record('upsert', task=task.get_info(), completed=task_entry['completed'], count=task_entry['count'])
+            logger.debug("Task '%s' type toggled.", task_name)
             return True
         else:
-            print(f"Task '{task_name}' not found.")
+            OP_ERRORS.inc('toggle_type')
+            logger.warning("Task '%s' not found.", task_name)
             return False
 
     # CRUD operations for tasks
+    @versioned
+    @timed('create')
     def create_task(self, task_info):
         new_task = Task(task_info['name'], task_info['effect'], task_info['type'], task_info['label'])
         if task_info['name'] in self.all_tasks:
-            print(f"Task '{task_info['name']}' already exists.")
+            OP_ERRORS.inc('create')
+            logger.warning("Task '%s' already exists.", task_info['name'])
             return False
-        self.all_tasks[task_info['name']] = {'task': new_task, "completed": False, "count": 0}
-        print(f"Task '{task_info['name']}' added.")
+        self._put_entry(task_info['name'], TaskEntry(new_task))
+        self._record('create', task=new_task.get_info())
+        logger.debug("Task '%s' added.", task_info['name'])
         return True
 
+    @versioned
+    @timed('delete')
     def delete_task(self, task_name):
         if task_name in self.all_tasks:
-            self.all_tasks[task_name] = None
-            print(f"Task '{task_name}' removed.")
+            self._drop_entry(task_name)  # 直接移除，不留空条目
+            self._record('delete', name=task_name)
+            logger.debug("Task '%s' removed.", task_name)
             return True
         else:
-            print(f"Task '{task_name}' not found.")
+            OP_ERRORS.inc('delete')
+            logger.warning("Task '%s' not found.", task_name)
             return False
 
     def get_task(self, task_name):
         return self.all_tasks.get(task_name, None)
 
+    @versioned
+    @timed('update')
     def update_task(self, task_name, new_name=None, new_effect=None, new_type=None):
         if task_name in self.all_tasks:
             if new_name:
+                task = self.all_tasks[task_name]['task']
                 new_task_info = {'name': new_name, 
-                            'effect': new_effect if new_effect else self.all_tasks[task_name]['effect'], 
-                            'type': new_type if new_type else self.all_tasks[task_name]['type']}
+                            'effect': new_effect if new_effect else task.get_effect(), 
+                            'type': new_type if new_type else task.get_type(),
+                            'label': task.get_label()}
                 self.create_task(new_task_info)
-                self.all_tasks[task_name] = None
+                self._drop_entry(task_name)
+                self._record('delete', name=task_name)
             else:
-                if new_effect: self.all_tasks[task_name].get('task').set_effect(new_effect)
-                if new_type and new_type != self.all_tasks[task_name].get('task').get('type'):
-                    self.all_tasks[task_name].get('task').set_type(new_type)
+                if new_effect:
+                    self.all_tasks[task_name].get('task').set_effect(new_effect)
+                    task_entry = self.all_tasks[task_name]
+                    self._record('upsert', task=task_entry['task'].get_info(),
+                                 completed=task_entry['completed'], count=task_entry['count'])
+                if new_type and new_type != self.all_tasks[task_name].get('task').get_type():
                     self.toggle_task_type(task_name)
-            print(f"Task '{task_name}' updated.")
+            logger.debug("Task '%s' updated.", task_name)
             return True
         else:
-            print(f"Task '{task_name}' not found.")
+            OP_ERRORS.inc('update')
+            logger.warning("Task '%s' not found.", task_name)
             return False
 
     # Apply task effects to state
+    def effect_matrix(self):
+        """(任务 × 属性) 效果矩阵，按需编译并缓存"""
+        if self._effects is None:
+            from objects.vector import EffectMatrix
+            self._effects = EffectMatrix(self.all_tasks.values())
+        return self._effects
+
+    def effect_delta(self, counts):
+        """{任务名: 次数} -> {属性: 总变化量}；只有一两个任务（如一次点击）时比 effect_matrix().delta 快，未知任务名抛 KeyError"""
+        delta = {}
+        for task_name, count in counts.items():
+            for key, value in self.all_tasks[task_name]['task'].effect:
+                delta[key] = delta.get(key, 0) + value * count
+        return delta
+
+    @timed('apply_tasks')
+    def apply_tasks(self, counts, current_state):
+        """
+        counts: {任务名: 次数}，次数为负表示撤销
+        整批任务的效果一次乘加后再截断到 0~100（而不是每个任务、每个属性各截断一次）
+        """
+        current_state.apply_vector(self.effect_matrix().delta(counts))
+
+    @timed('apply_task')
     def apply_task(self, task_name, current_state, multiplier=1):
         task_entry = self.get_task(task_name)
         if task_entry:
-            task_obj = task_entry.get('task')
-            for key, value in task_obj.effect.items():
-                current_state.update_metric(key, value * multiplier)
-            print(f"Effects of task '{task_name}' applied to state.")
+            current_state.apply_delta(self.effect_delta({task_name: multiplier}))  # 单个任务不走矩阵
+            logger.debug("Effects of task '%s' applied to state.", task_name)
             return True
         else:
-            print(f"Task '{task_name}' not found.")
+            OP_ERRORS.inc('apply_task')
+            logger.warning("Task '%s' not found.", task_name)
             return False
         
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+任务模板库：可以有几万条预定义任务，供“其他”标签页边输入边搜索、一键添加
+建库时把每条模板的名称和关键词（NFKC 规范化并转小写）拆成 1~3 个字的 n-gram，建倒排索引（n-gram -> 模板下标集合），
+另外把名称、关键词及其中的单词排成一张有序的词表，用二分查找找词首匹配；标签 / 效果过滤也是预先建好的集合
+查询不超过 3 个字时直接取这个 n-gram 的集合，更长时取各个 3-gram 集合的交集再核对子串，集合运算都在 C 里完成；
+结果只取前 limit 条：词首匹配的在前，其余按库里的顺序，不对全部结果排序，所以耗时与库的大小基本无关
+"""
+import unicodedata
+from bisect import bisect_left
+
+from objects.state import attributes
+from objects.instrument import timed
+
+
+GRAM = 3           # 倒排索引的最长 n-gram
+SEARCH_LIMIT = 20  # 默认最多返回几条
+RANK_ALL = 500     # 候选不超过这么多时直接逐条排序，不扫词表
+_EMPTY = frozenset()
+
+
+def normalize(text):
+    """全角转半角、转小写，中英文都按字符匹配"""
+    return unicodedata.normalize('NFKC', text).casefold().strip()
+
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class TemplateLibrary:
+    """
+    templates: {名称: {name, type, effect, label, keywords}}，格式同任务文件，keywords（别名、英文名）可选
+    建好之后只读，所有用户共用一份
+    """
+
+    def __init__(self, templates):
+        self.templates = list(templates.values())
+        self.index = {template['name']: i for i, template in enumerate(self.templates)}
+        self.texts = []   # 下标 -> 规范化后的搜索文本（各字段用换行分隔，n-gram 不跨字段）
+        self.grams = {}   # n-gram -> 模板下标集合
+        self.by_label = {}
+        self.by_effect = {key: set() for key in attributes}  # 属性 -> 会提高这个属性的模板
+        words = []
+        for i, template in enumerate(self.templates):
+            fields = [normalize(template['name'])] + [normalize(keyword) for keyword in template.get('keywords', ())]
+            self.texts.append('\n'.join(fields))
+            for field in fields:
+                words.extend((word, i) for word in {field, *field.split()})
+                for n in range(1, GRAM + 1):
+                    for gram in _grams(field, n):
+                        self.grams.setdefault(gram, set()).add(i)
+            self.by_label.setdefault(template['label'], set()).add(i)
+            for key, value in template['effect'].items():
+                if value > 0:
+                    self.by_effect[key].add(i)
+        words.sort()
+        self.words = [word for word, _ in words]
+        self.word_ids = [i for _, i in words]
+
+    def __len__(self):
+        return len(self.templates)
+
+    def get(self, name):
+        i = self.index.get(name)
+        return None if i is None else self.templates[i]
+
+    def _prefixed(self, i, query):
+        """模板 i 的名称、关键词或其中某个单词以 query 开头"""
+        return any(word.startswith(query) for field in self.texts[i].split('\n') for word in (field, *field.split()))
+
+    @timed('template_search')
+    def search(self, query='', label=None, effect=None, limit=SEARCH_LIMIT):
+        """
+        query: 名称或关键词的任意片段，空串表示只按过滤条件列出
+        label: 只要这个标签的模板；effect: 只要会提高这个属性的模板
+        返回模板字典的列表（库里的原件，不要修改，添加任务用 instantiate）
+        """
+        query = normalize(query)
+        sets = []
+        if label:
+            sets.append(self.by_label.get(label, _EMPTY))
+        if effect:
+            sets.append(self.by_effect.get(effect, _EMPTY))
+        if query:
+            if len(query) <= GRAM:
+                sets.append(self.grams.get(query, _EMPTY))
+            else:
+                sets.extend(self.grams.get(gram, _EMPTY) for gram in _grams(query, GRAM))
+        if not sets:
+            return self.templates[:limit]
+        sets.sort(key=len)
+        candidates = sets[0].intersection(*sets[1:]) if len(sets) > 1 else sets[0]  # 3-gram 都命中，还要核对子串
+        verify = len(query) > GRAM
+
+        if len(candidates) <= RANK_ALL:
+            if verify:
+                candidates = [i for i in candidates if query in self.texts[i]]
+            ranked = sorted(candidates, key=lambda i: (not self._prefixed(i, query), i) if query else i)[:limit]
+            return [self.templates[i] for i in ranked]
+        # 候选很多：先沿词表取词首匹配的，不够再按库里的顺序补，凑够 limit 条就停
+        ranked = []
+        seen = set()
+        if query:
+            k = bisect_left(self.words, query)
+            while k < len(self.words) and len(ranked) < limit and self.words[k].startswith(query):
+                i = self.word_ids[k]
+                if i in candidates and i not in seen:
+                    ranked.append(i)
+                    seen.add(i)
+                k += 1
+        if len(ranked) < limit:
+            # 候选占库的比例不小时从头扫很快就能凑够，否则只排序候选
+            order = range(len(self.templates)) if len(candidates) * 64 >= len(self.templates) else sorted(candidates)
+            for i in order:
+                if i in candidates and i not in seen and (not verify or query in self.texts[i]):
+                    ranked.append(i)
+                    if len(ranked) == limit:
+                        break
+        return [self.templates[i] for i in ranked]
+
+    def instantiate(self, name):
+        """模板 -> 可以交给 TaskList.create_task 的任务信息（副本）；没有这个模板时返回 None"""
+        template = self.get(name)
+        if template is None:
+            return None
+        return {'name': template['name'], 'type': template['type'],
+                'effect': dict(template['effect']), 'label': template['label']}
@@ -0,0 +1,386 @@
+import logging
+import itertools
+import os
+import re
+import sys
+import time
+import types
+from collections import OrderedDict
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from objects.state import State
+from objects.task import TaskList
+from objects.history import History
+from objects.analytics import Analytics
+from objects.commands import CommandHistory
+from objects.storage import SqliteStorage
+from objects.persist import DirectoryLock
+from objects.instrument import REGISTRY
+from utils import load_profile, check_profile, check_tasks
+
+logger = logging.getLogger('katachi.tenants')
+
+HISTORY_STEP = 1  # 属性值至少变化这么多才因为衰减再记一个历史点
+USER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')  # 用户名直接作为目录名，只允许安全字符
+
+TENANTS_RESIDENT = REGISTRY.gauge('katachi_tenants_resident', 'Tenants currently loaded in memory.')
+TENANT_BYTES = REGISTRY.gauge('katachi_tenant_bytes', 'Approximate memory of resident tenants, measured at load.')
+TENANT_EVENTS = REGISTRY.counter('katachi_tenant_events_total', 'Tenant cache hits, loads and evictions.', ('event',))
+
+
+SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType, logging.Logger)
+
+
+def load_timezone(name):
+    """profile 里的 IANA 时区名（如 'Asia/Shanghai'），未设置或无效时返回 None（服务器本地时区）"""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning("Unknown timezone '%s', using local time.", name)
+        return None
+
+
+def approx_size(obj, seen=None):
+    """粗略的深度内存占用（字节）：递归容器、实例 __dict__ 和 __slots__，每个对象只计一次"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, SKIP_TYPES):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, seen) + approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, seen) for item in obj)
+    if hasattr(obj, '__dict__'):
+        size += approx_size(vars(obj), seen)
+    for slot in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, slot):
+            size += approx_size(getattr(obj, slot), seen)
+    return size
+
+
+class Tenant:
+    """
+    一个用户的全部数据：状态、任务、历史，存放在自己的目录下
+    目录里还没有存档时，按默认配置初始化（default/default_profile.json、default/default_tasks.json）
+    JSON 文件模式下独占目录锁（另一个进程已打开同一用户时抛 LockedError）；SQLite 模式可以多进程共用
+    """
+
+    def __init__(self, user_id, directory, save_window=0, db_name=None, default_dir='./default'):
+        self.user_id = user_id
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = DirectoryLock(directory) if not db_name else None
+        if self.lock is not None:
+            self.lock.acquire()
+        state_file = os.path.join(directory, 'state.json')
+        task_file = os.path.join(directory, 'tasks.json')
+        profile_file = os.path.join(directory, 'profile.json')
+        new_tasks = not os.path.exists(task_file)
+        profile = load_profile(profile_file if os.path.exists(profile_file)
+                               else os.path.join(default_dir, 'default_profile.json'), check_profile)
+
+        self.storage = None
+        if db_name:
+            self.storage = SqliteStorage(os.path.join(directory, db_name))
+            self.storage.begin()  # 其他进程可能同时在初始化同一个库，在写锁内导入（新用户直接导入默认任务）
+            if self.storage.is_empty():
+                self.storage.import_json(os.path.join(default_dir, 'default_tasks.json') if new_tasks else task_file,
+                                         state_file if os.path.exists(state_file) else None)
+            self.storage.commit()
+            new_tasks = False
+        self.state = State(filename=state_file, init_metrics=dict(profile.get('metrics', {})),
+                           decay_rates=profile.get('decay_rates', {}), save_window=save_window, storage=self.storage)
+        self.task_list = TaskList(task_file, journal=True, save_window=save_window, storage=self.storage,
+                                  timezone=load_timezone(profile.get('timezone')))
+        if new_tasks:
+            self.task_list.reset_entries(load_profile(os.path.join(default_dir, 'default_tasks.json'), check_tasks))
+        # 关闭期间跨过的凌晨重置先补上：统计要在重置之后才读今天的完成次数，下一次重置也从正确的日期算起
+        self.task_list.reset_completion_status()
+        self.history = History(os.path.join(directory, 'history.bin'))
+        self.analytics = Analytics(os.path.join(directory, 'analytics.bin'), self.task_list)
+        self.commands = CommandHistory(self.task_list, self.state)  # 撤销 / 重做
+
+        self.clients = 0  # 正在显示这个用户页面的客户端数，大于 0 时不会被淘汰
+        self.last_access = time.monotonic()
+        self.reminder_handlers = []  # 页面登记的提醒回调，接收提醒文本
+        # 历史每个用户只记一份，与打开了几个页面（或有没有页面）无关：属性改动时记一个点，衰减由调度器按步长补点
+        self.recorded = {}       # 上次记入历史的属性值
+        self.on_history = None   # 可选回调：记了一个点之后调用（用来排下一次衰减补点）
+        self.state.events.subscribe(lambda kind, name, value: self.record_history())
+        self.memory = approx_size(self)
+
+    def record_history(self):
+        self.recorded = self.state.get_state()
+        self.history.record(self.recorded)
+        if self.on_history is not None:
+            self.on_history()
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    def flush_pending(self):
+        self.state.flush_pending()
+        self.task_list.flush_pending()
+
+    def checkpoint(self):
+        """定期保存：落盘积压的状态改动，把任务日志合并进快照，保存历史和统计"""
+        self.state.flush_pending()
+        self.task_list.compact()
+        self.history.save()
+        self.analytics.save()
+
+    async def flush_pending_async(self):
+        await self.state.flush_pending_async()
+        await self.task_list.flush_pending_async()
+
+    async def checkpoint_async(self):
+        await self.state.flush_pending_async()
+        await self.task_list.compact_async()
+        self.history.save()
+        self.analytics.save()
+
+    async def flush_dirty_async(self):
+        """调度器在数据变脏 save_window 秒后调用：直接落盘，不再看距上次落盘的间隔"""
+        await self.state.store.flush_async()
+        if self.task_list.journal is None:
+            await self.task_list.store.flush_async()
+
+    def sync(self):
+        """拉取其他进程提交的改动（只有 SQLite 模式会有）；页面通过 TaskList / State 的 events 得知具体改了什么"""
+        return self.storage is not None and self.storage.poll()
+
+    def remind(self, text):
+        for handler in list(self.reminder_handlers):
+            handler(text)
+
+    def close(self):
+        self.state.store.flush()  # 只有脏数据才会落盘
+        self.task_list.flush_pending()
+        self.task_list.compact()
+        self.history.save()
+        self.analytics.save()
+        if self.task_list.journal is not None:
+            self.task_list.journal.close()
+        if self.storage is not None:
+            self.storage.close()
+        if self.lock is not None:
+            self.lock.release()
+        for stats in (self.state.store.stats(), self.task_list.store.stats()):
+            logger.info("%s: %d flushes / %d requests, %d skipped, %d bytes written", stats['file'],
+                        stats['flushes'], stats['requests'], stats['skipped'], stats['bytes_written'])
+
+
+class TenantCache:
+    """
+    按需加载用户数据的 LRU 缓存
+    root: 单用户模式的目录（user_id 为 None 时使用，兼容原来的 ./state.json、./tasks.json）
+    users_dir: 其他用户的目录，每个用户一个子目录
+    capacity: 最多常驻多少个用户，超出时淘汰最久未访问且没有客户端在看的用户
+    idle_timeout: 没有客户端且超过这么多秒未访问的用户会被 evict_idle 淘汰
+    淘汰前先落盘，之后再访问会重新从磁盘加载
+    scheduler: 可选的 Scheduler；设置后每个用户的凌晨重置、落盘、定期保存和空闲淘汰都按到期时间排进队列，
+    不需要再用定时器轮询 flush_pending / checkpoint / reset_completion_status / evict_idle
+    checkpoint_interval: 数据变脏后多少秒做一次 checkpoint（合并日志、保存历史）
+    notifier: 可选的 Notifier（SQLite 多进程模式）：本进程提交改动后通知其他进程，收到通知时拉取改动；
+    没有可用的 notifier 时改由调度器每 sync_interval 秒检查一次
+    """
+
+    def __init__(self, root='.', users_dir='./users', capacity=1000, idle_timeout=30 * 60,
+                 scheduler=None, checkpoint_interval=600, notifier=None, sync_interval=5, **tenant_kwargs):
+        self.root = root
+        self.users_dir = users_dir
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.scheduler = scheduler
+        self.checkpoint_interval = checkpoint_interval
+        self.notifier = notifier
+        self.sync_interval = sync_interval
+        if notifier is not None:
+            notifier.on_message = self._on_notify
+        self.tenant_kwargs = tenant_kwargs
+        self._reminder_ids = itertools.count()
+        self.tenants = OrderedDict()  # user_id -> Tenant，按最近访问排序（末尾最新）
+        REGISTRY.on_collect('tenants', self._collect)
+
+    def directory_for(self, user_id):
+        if user_id is None:
+            return self.root
+        if not USER_ID_PATTERN.match(user_id):
+            raise ValueError(f"Invalid user id '{user_id}'.")
+        return os.path.join(self.users_dir, user_id)
+
+    def get(self, user_id=None):
+        """取出（必要时加载）一个用户，并标记为最近访问"""
+        tenant = self.tenants.get(user_id)
+        if tenant is None:
+            directory = self.directory_for(user_id)
+            tenant = Tenant(user_id, directory, **self.tenant_kwargs)
+            self.tenants[user_id] = tenant
+            TENANT_EVENTS.inc('load')
+            logger.info("Tenant '%s' loaded (~%d bytes).", user_id, tenant.memory)
+            if tenant.storage is not None:
+                self._connect_tenant(tenant)
+            if self.scheduler is not None:
+                self._schedule_tenant(tenant)
+            self._evict_over_capacity(keep=user_id)
+        else:
+            self.tenants.move_to_end(user_id)
+            TENANT_EVENTS.inc('hit')
+        tenant.touch()
+        return tenant
+
+    def acquire(self, user_id=None):
+        """页面打开时调用：取出用户并登记一个客户端"""
+        tenant = self.get(user_id)
+        tenant.clients += 1
+        if self.scheduler is not None:
+            self.scheduler.cancel(('evict', user_id))
+        return tenant
+
+    def release(self, tenant):
+        """页面关闭时调用"""
+        tenant.clients = max(0, tenant.clients - 1)
+        tenant.touch()
+        if self.scheduler is not None and tenant.clients == 0:
+            self._schedule_evict(tenant)
+
+    def evict(self, user_id):
+        tenant = self.tenants.pop(user_id, None)
+        if tenant is not None:
+            if self.scheduler is not None:
+                self.scheduler.cancel_where(lambda key: key[1] == user_id)
+            tenant.close()
+            TENANT_EVENTS.inc('evict')
+            logger.info("Tenant '%s' evicted.", user_id)
+        return tenant is not None
+
+    def _evict_over_capacity(self, keep):
+        for user_id in list(self.tenants):
+            if len(self.tenants) <= self.capacity:
+                break
+            if user_id != keep and self.tenants[user_id].clients == 0:
+                self.evict(user_id)
+
+    def evict_idle(self, now=None):
+        """由定时器调用，返回淘汰的用户数"""
+        now = time.monotonic() if now is None else now
+        idle = [user_id for user_id, tenant in self.tenants.items()
+                if tenant.clients == 0 and now - tenant.last_access >= self.idle_timeout]
+        for user_id in idle:
+            self.evict(user_id)
+        return len(idle)
+
+    # ---------- 多进程 ----------
+    def _connect_tenant(self, tenant):
+        topic = tenant.user_id or ''
+        if self.notifier is not None and self.notifier.available:
+            tenant.storage.on_commit = lambda: self.notifier.publish(topic)
+        elif self.scheduler is not None:
+            self.scheduler.schedule_in(self.sync_interval, tenant.sync, ('sync', tenant.user_id),
+                                       repeat=lambda: time.time() + self.sync_interval)
+
+    def _on_notify(self, topic):
+        tenant = self.tenants.get(topic or None)
+        if tenant is not None:
+            tenant.sync()
+
+    # ---------- 调度 ----------
+    def _schedule_tenant(self, tenant):
+        """登记一个新加载用户的任务：下一次凌晨重置，以及数据变脏时的落盘和 checkpoint"""
+        scheduler, user_id, task_list = self.scheduler, tenant.user_id, tenant.task_list
+
+        def next_reset():
+            return max(task_list.next_reset_time(), time.time() + 1)  # 时钟回拨时也不会反复立即触发
+        scheduler.schedule(next_reset(), task_list.reset_completion_status, ('reset', user_id), repeat=next_reset)
+
+        def on_dirty():
+            save_window = tenant.state.store.window
+            scheduler.schedule_in(save_window, tenant.flush_dirty_async, ('flush', user_id), keep_earlier=True)
+            on_history_dirty()
+
+        def on_history_dirty():
+            scheduler.schedule_in(self.checkpoint_interval, tenant.checkpoint_async, ('checkpoint', user_id),
+                                  keep_earlier=True)
+
+        tenant.state.store.on_dirty = on_dirty
+        tenant.task_list.store.on_dirty = on_dirty
+        tenant.history.on_dirty = on_history_dirty
+        tenant.analytics.on_dirty = on_history_dirty
+
+        def schedule_history():
+            """下一次有属性相对上次记录的值衰减了 HISTORY_STEP 时再记一个点，不会再变时不排"""
+            delay = tenant.state.time_until_change(tenant.recorded, step=HISTORY_STEP)
+            if delay is None:
+                scheduler.cancel(('history', user_id))
+            else:
+                scheduler.schedule_in(max(delay, 0.1), tenant.record_history, ('history', user_id))
+        tenant.on_history = schedule_history
+        tenant.record_history()
+        if tenant.state.store.is_dirty() or tenant.task_list.store.is_dirty():
+            on_dirty()  # 加载时就有改动（如新用户写入默认任务）
+        if tenant.clients == 0:
+            self._schedule_evict(tenant)
+
+    def _schedule_evict(self, tenant):
+        when = time.time() + max(0.0, tenant.last_access + self.idle_timeout - time.monotonic())
+        self.scheduler.schedule(when, lambda: self._evict_if_idle(tenant.user_id), ('evict', tenant.user_id))
+
+    def _evict_if_idle(self, user_id):
+        tenant = self.tenants.get(user_id)
+        if tenant is None or tenant.clients:
+            return
+        if time.monotonic() - tenant.last_access >= self.idle_timeout:
+            self.evict(user_id)
+        else:
+            self._schedule_evict(tenant)  # 期间被访问过，按最后访问时间重新排
+
+    def add_reminder(self, user_id, when, text):
+        """在时间戳 when 提醒用户（调用该用户页面登记的 reminder_handlers）；用户被淘汰时提醒一并取消"""
+        tenant = self.get(user_id)
+        key = ('reminder', user_id, next(self._reminder_ids))
+        self.scheduler.schedule(when, lambda: tenant.remind(text), key)
+        return key
+
+    def flush_pending(self):
+        for tenant in list(self.tenants.values()):
+            tenant.flush_pending()
+
+    def checkpoint(self):
+        for tenant in list(self.tenants.values()):
+            tenant.checkpoint()
+
+    async def flush_pending_async(self):
+        for tenant in list(self.tenants.values()):
+            await tenant.flush_pending_async()
+
+    async def checkpoint_async(self):
+        for tenant in list(self.tenants.values()):
+            await tenant.checkpoint_async()
+
+    def reset_completion_status(self):
+        for tenant in list(self.tenants.values()):
+            tenant.task_list.reset_completion_status()
+
+    def close(self):
+        for user_id in list(self.tenants):
+            self.evict(user_id)
+
+    def memory_report(self):
+        """重新测量每个常驻用户的内存（字节），比较慢，只在需要时调用"""
+        return {user_id: approx_size(tenant) for user_id, tenant in self.tenants.items()}
+
+    def stats(self):
+        return {
+            'resident': len(self.tenants),
+            'with_clients': sum(1 for tenant in self.tenants.values() if tenant.clients),
+            'bytes': sum(tenant.memory for tenant in self.tenants.values()),
+        }
+
+    def _collect(self):
+        stats = self.stats()
+        TENANTS_RESIDENT.set(value=stats['resident'])
+        TENANT_BYTES.set(value=stats['bytes'])
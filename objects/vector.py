@@ -0,0 +1,42 @@
+import numpy as np
+
+from objects.state import attributes, attribute_index
+
+
+class EffectMatrix:
+    """
+    编译后的任务效果矩阵：每行一个任务，每列按 attributes 的固定顺序对应一个属性
+    应用一批任务 = 次数向量 × 矩阵，一次乘加得到整批的属性变化量
+    """
+
+    def __init__(self, task_entries):
+        self.names = []
+        rows = []
+        for task_entry in task_entries:
+            if task_entry is None:
+                continue
+            task = task_entry['task']
+            self.names.append(task.get_name())
+            row = [0] * len(attributes)
+            for key, value in task.effect:  # 驻留的 ((属性, 值), ...)，不必再转成 dict
+                row[attribute_index[key]] = value
+            rows.append(row)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.matrix = np.array(rows, dtype=np.float64).reshape(len(rows), len(attributes))
+
+    def counts_vector(self, counts):
+        """{任务名: 次数} -> 与矩阵行对齐的次数向量，未知任务名抛 KeyError"""
+        vec = np.zeros(len(self.names), dtype=np.float64)
+        for name, count in counts.items():
+            vec[self.index[name]] += count
+        return vec
+
+    def delta(self, counts):
+        """一批任务完成（次数可为负，表示撤销）对各属性的总变化量"""
+        if isinstance(counts, dict):
+            counts = self.counts_vector(counts)
+        return counts @ self.matrix
+
+    def deltas(self, count_rows):
+        """多组次数（每行一组，如逐日回填）一次算出每组的属性变化量"""
+        return np.asarray(count_rows, dtype=np.float64) @ self.matrix
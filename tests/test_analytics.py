@@ -0,0 +1,74 @@
+from datetime import date
+
+from objects.analytics import Analytics, TaskStats, period_start
+from objects.task import TaskList
+
+SAT, SUN, MON = (date(2026, 3, day).toordinal() for day in (28, 29, 30))
+WED = date(2026, 4, 1).toordinal()
+
+
+def test_period_start():
+    assert period_start('week', SUN) == date(2026, 3, 23).toordinal()
+    assert period_start('week', MON) == MON
+    assert period_start('month', WED) == WED
+    assert period_start('month', SAT) == date(2026, 3, 1).toordinal()
+
+
+def test_streaks_and_rollups_across_boundaries():
+    stats = TaskStats()
+    for day, count in ((SAT, 2), (SUN, 1), (MON, 3)):
+        stats.close_day(day, count)
+    assert (stats.streak, stats.best) == (3, 3)
+    assert stats.rollup_series('week') == [(date(2026, 3, 23).toordinal(), 3, 2), (MON, 3, 1)]
+    assert stats.rollup_series('month') == [(date(2026, 3, 1).toordinal(), 6, 3)]
+
+    stats.close_day(WED, 1)  # 周二断了，跨进四月
+    assert (stats.streak, stats.best) == (1, 3)
+    assert stats.rollup_series('week')[-1] == (MON, 4, 2)
+    assert stats.rollup_series('month') == [(date(2026, 3, 1).toordinal(), 6, 3), (WED, 1, 1)]
+
+    stats.close_day(WED, 5)  # 已结算的日子不再结算
+    stats.close_day(WED + 1, 0)  # 没有完成的日子不记
+    assert stats.series() == [(SAT, 2), (SUN, 1), (MON, 3), (WED, 1)]
+
+    assert stats.current_streak(WED + 1, 0) == 1
+    assert stats.current_streak(WED + 1, 2) == 2
+    assert stats.current_streak(WED + 2, 0) == 0
+    assert stats.total('week', WED + 1, 2) == (6, 3)
+    assert stats.total('week', WED + 7, 2) == (2, 1)  # 下一周，只有今天
+
+
+def start_day(task_list, day):
+    """相当于在 day 那天凌晨重置（reset_completion_status 只能重置到真实的今天）"""
+    task_list._reset_done()
+    task_list.last_reset_time = day
+    task_list._record('reset', date=day.isoformat())
+
+
+def test_analytics_follows_task_list(tmp_path):
+    task_list = TaskList(str(tmp_path / 'tasks.json'))
+    task_list.create_task({'name': '喝一杯水', 'type': 'counter', 'label': 'daily',
+                           'effect': {'hydration': 5}, 'completed': False, 'count': 0})
+    start_day(task_list, date(2026, 3, 28))
+    analytics = Analytics(str(tmp_path / 'analytics.bin'), task_list)
+
+    for day, count in ((28, 2), (29, 1), (30, 0), (31, 4)):
+        for _ in range(count):
+            task_list.complete_task('喝一杯水')
+        assert analytics.summary('喝一杯水')['today'] == count
+        start_day(task_list, date(2026, 3, day + 1) if day < 31 else date(2026, 4, 1))
+
+    summary = analytics.summary('喝一杯水')
+    assert summary['today'] == 0
+    assert summary['streak'] == 1  # 3/30 没有完成
+    assert summary['best_streak'] == 2
+    assert summary['week_total'] == 4  # 3/30 开始的这一周
+    assert summary['month_total'] == 0
+    task_list.complete_task('喝一杯水')
+    assert analytics.summary('喝一杯水')['streak'] == 2
+    assert analytics.total('喝一杯水', 'week') == 5
+
+    analytics.save()
+    loaded = Analytics(str(tmp_path / 'analytics.bin'), task_list)
+    assert loaded.summary('喝一杯水') == analytics.summary('喝一杯水')
+    assert loaded.stats('喝一杯水').series() == analytics.stats('喝一杯水').series()
@@ -0,0 +1,40 @@
+from objects.commands import CommandHistory
+from objects.state import State, attributes
+from objects.storage import SqliteStorage
+from objects.task import TaskList
+
+
+def check_task(name):
+    return {'name': name, 'type': 'check', 'label': 'daily',
+            'effect': {'health': 1}, 'completed': False, 'count': 0}
+
+
+def undo_delete(task_list, tmp_path):
+    for name in 'abcd':
+        task_list.create_task(check_task(name))
+    state = State(str(tmp_path / 'state.json'), init_metrics={key: 50 for key in attributes}, init=True)
+    history = CommandHistory(task_list, state)
+    history.execute('删除 b', ['b'], lambda: task_list.delete_task('b'))
+    history.undo()
+    assert list(task_list.by_label['daily']) == ['a', 'b', 'c', 'd']
+
+
+def test_undo_delete_keeps_position_after_journal_reload(tmp_path):
+    filename = str(tmp_path / 'tasks.json')
+    task_list = TaskList(filename, journal=True)
+    undo_delete(task_list, tmp_path)
+    task_list.journal.close()
+
+    task_list = TaskList(filename, journal=True)
+    assert list(task_list.by_label['daily']) == ['a', 'b', 'c', 'd']
+
+
+def test_undo_delete_keeps_position_after_storage_reload(tmp_path):
+    filename = str(tmp_path / 'tasks.json')
+    path = str(tmp_path / 'katachi.db')
+    task_list = TaskList(filename, storage=SqliteStorage(path))
+    undo_delete(task_list, tmp_path)
+    task_list.storage.close()
+
+    task_list = TaskList(filename, storage=SqliteStorage(path))
+    assert list(task_list.by_label['daily']) == ['a', 'b', 'c', 'd']
@@ -0,0 +1,13 @@
+from objects.task import Task, _interned_effects, share_effects
+
+
+def test_only_shared_effects_are_interned():
+    share_effects([{'energy': 5, 'health': 3}])
+    first = Task('a', {'health': 3, 'energy': 5}, 'check')
+    second = Task('b', {'energy': 5, 'health': 3}, 'check')
+    assert first.effect is second.effect
+
+    size = len(_interned_effects)
+    edited = Task('c', {'mood': 7, 'focus': -3}, 'check')
+    assert edited.effect == (('focus', -3), ('mood', 7))
+    assert len(_interned_effects) == size  # 用户自己的效果不留在驻留表里
@@ -0,0 +1,65 @@
+import pytest
+
+from objects.forecast import Trajectory, evaluate_schedules, forecast, time_to_threshold
+from objects.state import State, attributes
+from objects.task import TaskList
+
+HOUR = 3600
+
+
+@pytest.fixture
+def tenant(tmp_path):
+    state = State(str(tmp_path / 'state.json'), init_metrics={'energy': 50, 'mood': 90, 'focus': 40},
+                  decay_rates={'energy': -10, 'mood': 5}, init=True)
+    task_list = TaskList(str(tmp_path / 'tasks.json'))
+    task_list.create_task({'name': '午睡', 'type': 'counter', 'label': 'daily',
+                           'effect': {'energy': 30, 'mood': 20}, 'completed': False, 'count': 0})
+    return state, task_list, state.last_update
+
+
+def test_decay_clamps_at_the_bounds(tenant):
+    state, task_list, now = tenant
+    trajectories = forecast(state, until=now + 10 * HOUR, now=now)
+    energy = trajectories['energy']
+    assert energy.points == [(now, 50), (now + 5 * HOUR, 0), (now + 10 * HOUR, 0)]  # 5 小时后触底，之后保持 0
+    assert energy.value_at(now + 2.5 * HOUR) == pytest.approx(25)
+    assert energy.value_at(now + 8 * HOUR) == 0
+    assert trajectories['mood'].points[1] == (now + 2 * HOUR, 100)
+    assert trajectories['focus'].points == [(now, 40)]  # 不衰减的属性没有拐点
+    assert trajectories['focus'].value_at(now + 5 * HOUR) == 40
+
+
+def test_task_jump_is_clamped(tenant):
+    state, task_list, now = tenant
+    energy = forecast(state, task_list, plan=[(now + HOUR, '午睡', 3)], until=now + 3 * HOUR, now=now)['energy']
+    assert energy.points == [(now, 50), (now + HOUR, 40), (now + HOUR, 100), (now + 3 * HOUR, 80)]
+    assert energy.value_at(now + HOUR) == 100  # 同一时刻跳变，取跳变之后的值
+    assert energy.first_crossing(90, below=False) == now + HOUR
+
+
+def test_time_to_threshold(tenant):
+    state, task_list, now = tenant
+    assert time_to_threshold(state, 'energy', 20, now=now) == pytest.approx(3 * HOUR)
+    assert time_to_threshold(state, 'energy', 20, task_list, plan=[(now + HOUR, '午睡', 1)],
+                             now=now) == pytest.approx(6 * HOUR)
+    assert time_to_threshold(state, 'energy', 60, now=now) == 0  # 现在就低于
+    assert time_to_threshold(state, 'focus', 20, now=now) is None
+    assert time_to_threshold(state, 'mood', 95, below=False, now=now) == pytest.approx(HOUR)
+
+
+def test_first_crossing_on_a_flat_start():
+    trajectory = Trajectory([(0, 50), (10, 50), (20, 30)])
+    assert trajectory.first_crossing(40) == pytest.approx(15)
+    assert trajectory.first_crossing(60, below=False) is None
+    assert trajectory.value_at(-5) == 50
+
+
+def test_evaluate_schedules_matches_forecast(tenant):
+    state, task_list, now = tenant
+    at = now + 6 * HOUR
+    schedules = [[], [(now + HOUR, '午睡', 1)], [(now + 2 * HOUR, '午睡', 2), (now + 7 * HOUR, '午睡', 1)]]
+    values = evaluate_schedules(state, task_list, schedules, at, now=now)
+    for row, plan in zip(values, schedules):
+        trajectories = forecast(state, task_list, plan, until=at, now=now)
+        for key in state.metrics:
+            assert row[attributes.index(key)] == pytest.approx(trajectories[key].value_at(at))
@@ -0,0 +1,73 @@
+from objects.history import RAW_COLUMNS, History, RingBuffer
+
+
+def filled(capacity, count):
+    buffer = RingBuffer(capacity, RAW_COLUMNS)
+    for t in range(count):
+        buffer.append(float(t), t * 0.5)
+    return buffer
+
+
+def test_ring_buffer_wraps_around():
+    buffer = filled(4, 10)
+    assert len(buffer) == 4
+    assert buffer.head == 2
+    assert buffer.rows() == [(6.0, 3.0), (7.0, 3.5), (8.0, 4.0), (9.0, 4.5)]  # 只留最新的，按时间顺序
+    assert buffer.last() == (9.0, 4.5)
+    assert buffer.rows(since=7, until=9) == [(7.0, 3.5), (8.0, 4.0)]
+    assert buffer.rows(since=100) == []
+    assert buffer.rows(until=0) == []
+
+
+def test_ring_buffer_before_full():
+    buffer = filled(4, 3)
+    assert buffer.rows(since=1) == [(1.0, 0.5), (2.0, 1.0)]
+    assert RingBuffer(4, RAW_COLUMNS).last() is None
+
+
+def test_load_bytes_round_trip():
+    for count in (0, 3, 4, 10):
+        buffer = filled(4, count)
+        raw = b'xx' + buffer.to_bytes()
+        loaded = RingBuffer(4, RAW_COLUMNS)
+        assert loaded.load_bytes(buffer.header(), raw, 2) == len(raw)
+        assert loaded.rows() == buffer.rows()
+        assert loaded.head == buffer.head
+
+
+def test_load_bytes_into_a_different_capacity():
+    buffer = filled(4, 10)
+    smaller = RingBuffer(3, RAW_COLUMNS)
+    smaller.load_bytes(buffer.header(), buffer.to_bytes(), 0)
+    assert smaller.rows() == buffer.rows()[-3:]
+    larger = RingBuffer(8, RAW_COLUMNS)
+    larger.load_bytes(buffer.header(), buffer.to_bytes(), 0)
+    assert larger.rows() == buffer.rows()
+    larger.append(10.0, 5.0)
+    assert larger.last() == (10.0, 5.0)
+
+
+def test_rollups_and_file_round_trip(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = History(filename, keys=['mood'])
+    for t, value in ((0, 10), (30, 20), (60, 30), (3600, 50)):
+        history.record({'mood': value, 'unknown': 1}, t=t)
+    minutes = history.metrics['mood'].series('minute')
+    assert minutes == [(0, 10, 15, 20), (60, 30, 30, 30), (3600, 50, 50, 50)]
+    assert history.metrics['mood'].series('hour') == [(0, 10, 20, 30), (3600, 50, 50, 50)]
+    assert history.save()
+    assert not history.save()  # 没有新记录就不写
+
+    loaded = History(filename, keys=['mood'])
+    for tier in ('raw', 'minute', 'hour', 'day'):
+        assert loaded.metrics['mood'].series(tier) == history.metrics['mood'].series(tier)
+    loaded.record({'mood': 60}, t=3630)
+    assert loaded.metrics['mood'].series('minute', since=3600) == [(3600, 50, 55, 60)]
+
+
+def test_out_of_order_points_are_ignored(tmp_path):
+    history = History(str(tmp_path / 'history.bin'), keys=['mood'])
+    history.record({'mood': 10}, t=100)
+    history.record({'mood': 20}, t=50)
+    assert history.metrics['mood'].series('raw') == [(100, 10, 10, 10)]
+    assert len(history.metrics['mood'].tiers['minute']) == 0
@@ -0,0 +1,78 @@
+import json
+
+from objects.ingest import ingest_lines
+from objects.state import State, attributes
+from objects.task import TaskList
+
+
+def make_tenant(tmp_path):
+    state = State(str(tmp_path / 'state.json'), init_metrics={key: 50 for key in attributes}, init=True)
+    task_list = TaskList(str(tmp_path / 'tasks.json'))
+    task_list.create_task({'name': '散步', 'type': 'check', 'label': 'daily',
+                           'effect': {'health': 5}, 'completed': False, 'count': 0})
+    task_list.create_task({'name': '喝一杯水', 'type': 'counter', 'label': 'daily',
+                           'effect': {'hydration': 5}, 'completed': False, 'count': 0})
+    return state, task_list
+
+
+def test_bad_rows_are_rejected(tmp_path):
+    state, task_list = make_tenant(tmp_path)
+    lines = [
+        '{"mood": "nan"}',
+        '{"mood": "inf"}',
+        '{"mood": "-Infinity"}',
+        '{"focus": 1e999}',
+        '{"task": "喝一杯水", "count": "nan"}',
+        '{"task": "喝一杯水", "count": 1e999}',
+        '{"task": "喝一杯水", "time": "inf"}',
+        '{"task": "喝一杯水", "time": "nan"}',
+        '{"task": "没有这个任务"}',
+        '{"height": 3}',
+        '{}',
+        '{"mood": ',
+        '{"mood": 5}',
+    ]
+    report = ingest_lines(state, task_list, lines)
+    assert report['events'] == len(lines)
+    assert report['rejected'] == len(lines) - 1
+    assert report['applied'] == 1
+    assert state.metrics['mood'] == 55
+    assert state.metrics['focus'] == 50
+    assert task_list.get_task('喝一杯水')['count'] == 0
+    with open(tmp_path / 'state.json', encoding='utf-8') as f:
+        saved = json.load(f, parse_constant=reject_constant)
+    assert saved['metrics']['mood'] == 55
+
+
+def reject_constant(name):
+    raise AssertionError(f'state.json contains {name}')
+
+
+def test_csv_rejects_non_finite(tmp_path):
+    state, task_list = make_tenant(tmp_path)
+    report = ingest_lines(state, task_list, ['task,count,sleep', '喝一杯水,2,', ',,NaN', ',,-inf'], fmt='csv')
+    assert report['rejected'] == 2
+    assert task_list.get_task('喝一杯水')['count'] == 2
+    assert state.metrics['hydration'] == 60
+    assert state.metrics['sleep'] == 50
+
+
+def test_completed_check_task_is_not_applied_twice(tmp_path):
+    state, task_list = make_tenant(tmp_path)
+    report = ingest_lines(state, task_list, ['{"task": "散步"}', '{"task": "散步"}'], batch_size=1)
+    assert task_list.get_task('散步')['completed']
+    assert state.metrics['health'] == 55
+    assert report['ignored'] == 1
+
+    report = ingest_lines(state, task_list, ['{"task": "散步", "count": -1}', '{"task": "散步", "count": -1}'])
+    assert not task_list.get_task('散步')['completed']
+    assert state.metrics['health'] == 50
+    assert report['ignored'] == 1
+
+
+def test_counter_does_not_go_below_zero(tmp_path):
+    state, task_list = make_tenant(tmp_path)
+    ingest_lines(state, task_list, ['{"task": "喝一杯水", "count": 2}', '{"task": "喝一杯水", "count": -3}'],
+                 batch_size=1)
+    assert task_list.get_task('喝一杯水')['count'] == 0
+    assert state.metrics['hydration'] == 50
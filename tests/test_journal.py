@@ -0,0 +1,35 @@
+from objects.journal import TaskJournal
+from objects.task import TaskList
+
+
+def counter_task(name):
+    return {'name': name, 'type': 'counter', 'label': 'daily',
+            'effect': {'hydration': 5}, 'completed': False, 'count': 0}
+
+
+def test_replay_after_torn_line(tmp_path):
+    filename = str(tmp_path / 'tasks.json')
+    task_list = TaskList(filename, journal=True)
+    task_list.create_task(counter_task('喝一杯水'))
+    task_list.complete_task('喝一杯水')
+    task_list.journal.close()
+    with open(filename + '.log', 'a', encoding='utf-8') as f:
+        f.write('{"op":"compl')  # 崩溃时写了一半
+
+    task_list = TaskList(filename, journal=True)
+    assert task_list.get_task('喝一杯水')['count'] == 1
+    task_list.complete_task('喝一杯水')
+    task_list.complete_task('喝一杯水')
+    task_list.journal.close()
+
+    task_list = TaskList(filename, journal=True)
+    assert task_list.get_task('喝一杯水')['count'] == 3
+
+
+def test_read_keeps_last_record_without_newline(tmp_path):
+    journal = TaskJournal(str(tmp_path / 'tasks.json'))
+    with open(journal.log_file, 'w', encoding='utf-8') as f:
+        f.write('{"op":"delete","name":"a"}\n{"op":"delete","name":"b"}')
+    assert [record['name'] for record in journal.read()] == ['a', 'b']
+    journal.append('delete', name='c')
+    assert [record['name'] for record in journal.read()] == ['a', 'b', 'c']
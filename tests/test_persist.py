@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from objects.persist import WriteBehind, atomic_write_bytes, atomic_write_json, read_json
+
+
+def test_stale_snapshot_is_dropped(tmp_path):
+    filename = str(tmp_path / 'tasks.json')
+    data = {'value': 1}
+    store = WriteBehind(filename, lambda: dict(data))
+    old = store._snapshot()
+    data['value'] = 2
+    new = store._snapshot()
+    assert store._write_snapshot(*new) > 0
+    assert store._write_snapshot(*old) == 0  # 线程池里后写完的旧快照不能覆盖新数据
+    assert read_json(filename) == {'value': 2}
+    assert store.stats()['stale'] == 1
+
+
+def test_dirty_tracking_and_window(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'state.json')
+    store = WriteBehind(filename, lambda: {'value': 1}, window=10)
+    dirtied = []
+    store.on_dirty = lambda: dirtied.append(1)
+    assert not store.request_flush()  # 没有改动
+    store.mark_dirty('mood')
+    store.mark_dirty('focus')
+    assert dirtied == [1]  # 只在从干净变脏时回调
+    assert store.request_flush()
+    store.mark_dirty('mood')
+    assert not store.request_flush()  # 还在窗口内
+    assert not store.flush_pending()
+    monkeypatch.setattr(store, 'last_flush', store.last_flush - 10)
+    assert store.flush_pending()
+    assert store.stats()['flushes'] == 2
+    assert store.stats()['skipped'] == 1
+
+
+def test_atomic_replace_keeps_old_file_on_failure(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'state.json')
+    atomic_write_json(filename, {'value': 1})
+    os.chmod(filename, 0o640)
+
+    def fail(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', fail)
+    with pytest.raises(OSError):
+        atomic_write_bytes(filename, b'{"value": 2')
+    monkeypatch.undo()
+    assert read_json(filename) == {'value': 1}
+    assert os.listdir(tmp_path) == ['state.json']  # 临时文件已删除
+
+    atomic_write_json(filename, {'value': 3})
+    assert read_json(filename) == {'value': 3}
+    assert os.stat(filename).st_mode & 0o777 == 0o640  # 保持原文件权限
@@ -0,0 +1,44 @@
+import pytest
+
+from objects.planner import plan_tasks
+from objects.state import State
+from objects.task import TaskList
+
+
+@pytest.fixture
+def tenant(tmp_path):
+    state = State(str(tmp_path / 'state.json'), init_metrics={'energy': 10, 'mood': 80}, init=True)
+    task_list = TaskList(str(tmp_path / 'tasks.json'))
+    for name, task_type, effect in (('运动', 'check', {'energy': 20}), ('喝咖啡', 'counter', {'energy': 10}),
+                                    ('熬夜', 'counter', {'energy': -10, 'mood': -5}), ('发呆', 'counter', {})):
+        task_list.create_task({'name': name, 'type': task_type, 'label': 'daily',
+                               'effect': effect, 'completed': False, 'count': 0})
+    return state, task_list
+
+
+def test_check_task_is_suggested_at_most_once(tenant):
+    state, task_list = tenant
+    plan = plan_tasks(state, task_list, horizon=0, now=state.last_update)
+    assert plan.counts == {'运动': 1, '喝咖啡': 3}
+    assert plan.projected['energy'] == 60
+    assert plan.baseline == {'energy': 10, 'mood': 80}
+    assert plan.score == 0 < plan.baseline_score
+
+
+def test_completed_check_task_is_not_suggested(tenant):
+    state, task_list = tenant
+    task_list.complete_task('运动')
+    plan = plan_tasks(state, task_list, horizon=0, now=state.last_update)
+    assert plan.counts == {'喝咖啡': 3}
+    assert plan.projected['energy'] == 40
+
+
+def test_limits_and_targets(tenant):
+    state, task_list = tenant
+    plan = plan_tasks(state, task_list, horizon=0, max_tasks=2, now=state.last_update)
+    assert sum(plan.counts.values()) == 2
+    assert plan.counts['运动'] == 1
+
+    plan = plan_tasks(state, task_list, targets={'energy': (0, 100)}, horizon=0, now=state.last_update)
+    assert not plan  # 已经在目标区间内，什么都不用做
+    assert plan.score == plan.baseline_score == 0
@@ -0,0 +1,54 @@
+import json
+import os
+from datetime import date, timedelta
+
+from objects.task import RESET_KEY
+from objects.tenants import Tenant
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'default')
+
+
+def move_saved_day(directory, day):
+    """把存档里的“上次重置日期”改成 day，相当于服务在那天关闭"""
+    task_file = os.path.join(directory, 'tasks.json')
+    with open(task_file, encoding='utf-8') as f:
+        tasks_data = json.load(f)
+    tasks_data[RESET_KEY] = day.isoformat()
+    with open(task_file, 'w', encoding='utf-8') as f:
+        json.dump(tasks_data, f, ensure_ascii=False)
+    analytics_file = os.path.join(directory, 'analytics.bin')
+    with open(analytics_file, 'rb') as f:
+        raw = f.read()
+    newline = raw.index(b'\n')
+    header = json.loads(raw[:newline])
+    header['day'] = day.toordinal()
+    with open(analytics_file, 'wb') as f:
+        f.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + raw[newline:])
+
+
+def test_missed_reset_is_counted_once(tmp_path):
+    directory = str(tmp_path / 'alice')
+    tenant = Tenant('alice', directory, default_dir=DEFAULT_DIR)
+    tenant.task_list.complete_task('喝一杯水')
+    tenant.task_list.complete_task('喝一杯水')
+    tenant.close()
+    yesterday = tenant.task_list.last_reset_time - timedelta(days=1)
+    move_saved_day(directory, yesterday)
+
+    for _ in range(2):  # 第二次重启没有新的完成，也不能再结算一次
+        tenant = Tenant('alice', directory, default_dir=DEFAULT_DIR)
+        assert tenant.task_list.last_reset_time > yesterday
+        assert tenant.task_list.get_task('喝一杯水')['count'] == 0
+        stats = tenant.analytics.stats('喝一杯水')
+        assert stats.series() == [(yesterday.toordinal(), 2)]
+        assert tenant.analytics.streak('喝一杯水') == 1
+        assert tenant.analytics.summary('喝一杯水')['today'] == 0
+        tenant.close()
+
+
+def test_snapshot_keeps_reset_date(tmp_path):
+    directory = str(tmp_path / 'bob')
+    tenant = Tenant('bob', directory, default_dir=DEFAULT_DIR)
+    tenant.close()
+    with open(os.path.join(directory, 'tasks.json'), encoding='utf-8') as f:
+        assert date.fromisoformat(json.load(f)[RESET_KEY]) == tenant.task_list.last_reset_time
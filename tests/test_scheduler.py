@@ -0,0 +1,85 @@
+import asyncio
+
+from objects.scheduler import Scheduler
+
+
+def run_due(scheduler, now):
+    return asyncio.run(scheduler.run_due(now))
+
+
+def test_jobs_run_in_deadline_order():
+    scheduler = Scheduler()
+    ran = []
+    for when, name in ((30, 'c'), (10, 'a'), (20, 'b1'), (20, 'b2'), (40, 'd')):
+        scheduler.schedule(when, lambda name=name: ran.append(name))
+    assert scheduler.next_deadline() == 10
+    assert run_due(scheduler, 30) == 4
+    assert ran == ['a', 'b1', 'b2', 'c']  # 同一时刻的按加入顺序
+    assert scheduler.next_deadline() == 40
+
+
+def test_cancel_and_replace_by_key():
+    scheduler = Scheduler()
+    ran = []
+    scheduler.schedule(10, lambda: ran.append('old'), key=('save', 'alice'))
+    scheduler.schedule(20, lambda: ran.append('new'), key=('save', 'alice'))  # 同 key 替换
+    scheduler.schedule(15, lambda: ran.append('bob'), key=('save', 'bob'))
+    scheduler.schedule(15, lambda: ran.append('evict'), key=('evict', 'bob'))
+    assert scheduler.cancel(('save', 'bob'))
+    assert not scheduler.cancel(('save', 'bob'))
+    scheduler.cancel_where(lambda key: key[0] == 'evict')
+    assert scheduler.next_deadline() == 20  # 取消的任务出堆时丢弃
+    run_due(scheduler, 100)
+    assert ran == ['new']
+    assert scheduler.jobs == {}
+
+
+def test_keep_earlier():
+    scheduler = Scheduler()
+    ran = []
+    first = scheduler.schedule(10, lambda: ran.append(10), key='flush', keep_earlier=True)
+    assert scheduler.schedule(20, lambda: ran.append(20), key='flush', keep_earlier=True) is first
+    scheduler.schedule(5, lambda: ran.append(5), key='flush', keep_earlier=True)  # 更早的替换原任务
+    run_due(scheduler, 100)
+    assert ran == [5]
+
+
+def test_repeat_reschedules_until_none():
+    scheduler = Scheduler()
+    ran = []
+    deadlines = iter([20, 30, None])
+    scheduler.schedule(10, lambda: ran.append(len(ran)), key='tick', repeat=lambda: next(deadlines))
+    for now in (10, 20, 30, 40):
+        run_due(scheduler, now)
+    assert ran == [0, 1, 2]
+    assert scheduler.next_deadline() is None
+
+
+def test_failing_job_does_not_stop_others():
+    scheduler = Scheduler()
+    ran = []
+    scheduler.schedule(10, lambda: 1 / 0)
+    scheduler.schedule(10, lambda: ran.append('ok'))
+    assert run_due(scheduler, 10) == 2
+    assert ran == ['ok']
+
+
+def test_stop_cancels_background_loop():
+    async def main():
+        scheduler = Scheduler()
+        ran = []
+
+        async def job():
+            ran.append('run')
+
+        scheduler.start()
+        scheduler.schedule_in(0, job)
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+        scheduler.schedule_in(0, job)
+        await asyncio.sleep(0.05)
+        return ran, asyncio.all_tasks()
+
+    ran, tasks = asyncio.run(main())
+    assert ran == ['run']  # 停止之后不再执行
+    assert len(tasks) == 1  # 只剩 main 自己
@@ -0,0 +1,112 @@
+import pytest
+
+from objects.state import State, attributes
+from objects.storage import ConflictError, SqliteStorage
+from objects.task import TaskList
+
+
+def counter_task(name):
+    return {'name': name, 'type': 'counter', 'label': 'daily',
+            'effect': {'hydration': 5}, 'completed': False, 'count': 0}
+
+
+@pytest.fixture
+def two_processes(tmp_path):
+    """同一个库上的两个 TaskList，各用一个连接，相当于两个 worker"""
+    path = str(tmp_path / 'katachi.db')
+    first = TaskList(str(tmp_path / 'a.json'), storage=SqliteStorage(path))
+    for name in ('a', 'b', 'c'):
+        first.create_task(counter_task(name))
+    first.save_tasks()
+    second = TaskList(str(tmp_path / 'b.json'), storage=SqliteStorage(path))
+    yield first, second
+    first.storage.close()
+    second.storage.close()
+
+
+def test_stale_version_raises_conflict(two_processes):
+    first, second = two_processes
+    stale = dict(second.versions)
+    first.complete_task('a')
+    first.save_tasks()
+    with pytest.raises(ConflictError):
+        second.storage.apply_record({'op': 'complete', 'name': 'a', 'completed': True, 'count': 1},
+                                    second.last_reset_time.isoformat(), stale)
+    second.storage.rollback()
+    assert stale['a'] == second.versions['a']  # 冲突时不改本地版本号
+
+
+def test_conflicting_write_is_retried_after_reload(two_processes, monkeypatch):
+    first, second = two_processes
+    first.complete_task('a')
+    first.save_tasks()
+
+    # second 在 first 提交之前就同步过：第一次 sync 什么也拉不到，写入时才发现版本冲突
+    calls = []
+    real_sync = second.sync
+
+    def sync():
+        calls.append(1)
+        if len(calls) > 1:
+            real_sync()
+
+    monkeypatch.setattr(second, 'sync', sync)
+    assert second.complete_task('a')
+    second.save_tasks()
+    assert len(calls) == 2  # 回滚、重新加载后重做了一次
+    assert second.get_task('a')['count'] == 2
+
+    first.sync()
+    assert first.get_task('a')['count'] == 2
+    reloaded, _ = first.storage.load_tasks()
+    assert reloaded['a']['count'] == 2
+
+
+def test_concurrent_completes_are_merged(two_processes):
+    first, second = two_processes
+    for _ in range(3):
+        first.complete_task('a')
+        first.save_tasks()
+        second.complete_task('a')
+        second.save_tasks()
+    second.complete_task('b')
+    second.save_tasks()
+    first.sync()
+    assert first.get_task('a')['count'] == 6
+    assert second.get_task('a')['count'] == 6
+    assert first.get_task('b')['count'] == 1
+
+
+def test_poll_reports_only_other_connections(two_processes):
+    first, second = two_processes
+    second.sync()
+    assert second.storage.poll() == []  # data_version 没变
+    first.complete_task('c')
+    first.save_tasks()
+    assert first.storage.poll() == []  # 自己的改动不报告
+    assert second.storage.poll() == [('task', 'c')]
+    assert second.get_task('c')['count'] == 1
+    assert second.storage.poll() == []
+
+
+def test_move_reloads_order_in_other_process(two_processes):
+    first, second = two_processes
+    first.move_task('c', 'a')
+    first.save_tasks()
+    second.sync()
+    assert list(second.by_label['daily']) == ['c', 'a', 'b']
+
+
+def test_state_deltas_are_merged(tmp_path):
+    path = str(tmp_path / 'katachi.db')
+    states = [State(str(tmp_path / f'{name}.json'), init_metrics={key: 50 for key in attributes},
+                    storage=SqliteStorage(path)) for name in ('a', 'b')]
+    states[1].storage.poll()
+    states[0].update_metric('mood', 5)
+    states[0].save_state()
+    states[1].update_metric('mood', 3)  # 还没看到对方的写入，保存时版本冲突，增量叠加到对方的值上
+    states[1].save_state()
+    states[0].storage.poll()
+    for state in states:
+        assert state.get_metric('mood') == pytest.approx(58)
+        state.storage.close()
@@ -0,0 +1,104 @@
+import random
+
+from objects.task import TaskList, TaskOrder
+
+LABELS = ('daily', 'work', 'other')
+
+
+def check_order(order, expected):
+    assert list(order) == expected
+    assert len(order) == len(expected)
+    assert order.head == (expected[0] if expected else None)
+    assert order.tail == (expected[-1] if expected else None)
+    for i, name in enumerate(expected):
+        assert order.previous(name) == (expected[i - 1] if i else None)
+        assert order.next(name) == (expected[i + 1] if i + 1 < len(expected) else None)
+
+
+def test_task_order_insert_move_remove():
+    order = TaskOrder(['a', 'b', 'c'])
+    check_order(order, ['a', 'b', 'c'])
+    order.insert('d', 'a')
+    order.insert('e', 'c')
+    order.insert('f', 'missing')  # 不在列表里的 before 等于追加
+    check_order(order, ['d', 'a', 'b', 'e', 'c', 'f'])
+    order.move('f', 'd')
+    order.move('d')
+    order.move('b', 'b')  # 移到自己之前等于不动
+    check_order(order, ['f', 'a', 'b', 'e', 'c', 'd'])
+    for name in ('f', 'd', 'b'):
+        order.remove(name)
+    check_order(order, ['a', 'e', 'c'])
+    for name in ('a', 'e', 'c'):
+        order.remove(name)
+    check_order(order, [])
+    order.insert('g')
+    check_order(order, ['g'])
+
+
+def check_indexes(task_list):
+    """二级索引与 all_tasks 逐条核对"""
+    labels, types, done = {}, {}, set()
+    for name, entry in task_list.all_tasks.items():
+        task = entry['task']
+        labels.setdefault(task.get_label(), set()).add(name)
+        types.setdefault(task.get_type(), set()).add(name)
+        if entry['completed'] or entry['count'] > 0:
+            done.add(name)
+    assert {label: set(order) for label, order in task_list.by_label.items() if len(order)} == labels
+    for order in task_list.by_label.values():
+        check_order(order, list(order))
+    assert {task_type: names for task_type, names in task_list.by_type.items() if names} == types
+    assert task_list.done == done
+    assert sum(len(order) for order in task_list.by_label.values()) == len(task_list.all_tasks)
+
+
+def test_indexes_stay_consistent(tmp_path):
+    rng = random.Random(7)
+    filename = str(tmp_path / 'tasks.json')
+    task_list = TaskList(filename, journal=True)
+    for step in range(400):
+        names = list(task_list.all_tasks)
+        name = rng.choice(names) if names else None
+        op = rng.randrange(8) if names else 0
+        if op == 0:
+            task_list.create_task({'name': f't{step}', 'type': rng.choice(('check', 'counter')),
+                                   'label': rng.choice(LABELS), 'effect': {'mood': 1},
+                                   'completed': False, 'count': 0})
+        elif op == 1:
+            task_list.delete_task(name)
+        elif op == 2:
+            task_list.move_task(name, rng.choice(names + [None]))
+        elif op == 3:
+            task_list.complete_task(name)
+        elif op == 4:
+            task_list.uncomplete_task(name)
+        elif op == 5:
+            task_list.toggle_task_type(name)
+        elif op == 6:
+            task_list.update_task(name, new_name=f'r{step}')
+        else:
+            snapshot = task_list.snapshot_entry(name)
+            snapshot['task']['label'] = rng.choice(LABELS)  # 换标签
+            task_list.restore_entry(name, snapshot)
+        check_indexes(task_list)
+    task_list.journal.close()
+
+    reloaded = TaskList(filename, journal=True)
+    check_indexes(reloaded)
+    assert {label: list(order) for label, order in reloaded.by_label.items() if len(order)} == \
+        {label: list(order) for label, order in task_list.by_label.items() if len(order)}
+
+
+def test_reset_clears_done(tmp_path):
+    task_list = TaskList(str(tmp_path / 'tasks.json'))
+    for name, task_type in (('a', 'check'), ('b', 'counter'), ('c', 'counter')):
+        task_list.create_task({'name': name, 'type': task_type, 'label': 'daily',
+                               'effect': {}, 'completed': False, 'count': 0})
+    task_list.complete_task('a')
+    task_list.complete_task('b')
+    assert [entry['task'].get_name() for entry in task_list.list_done()] in (['a', 'b'], ['b', 'a'])
+    task_list.reset_completion_status(manual_reset=True)
+    assert task_list.done == set()
+    assert task_list.get_task('b')['count'] == 0
+    check_indexes(task_list)
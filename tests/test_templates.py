@@ -0,0 +1,77 @@
+import random
+
+from objects.state import attributes
+from objects.templates import TemplateLibrary, normalize
+
+CHARS = '水茶跑步读书冥想散步早睡'
+WORDS = ('walk', 'water', 'read', 'sleep', 'tea', 'run')
+LABELS = ('daily', 'work', 'other')
+
+
+def make_library(count, seed=3):
+    rng = random.Random(seed)
+    templates = {}
+    while len(templates) < count:
+        name = ''.join(rng.choice(CHARS) for _ in range(rng.randint(1, 6))) + str(len(templates))
+        keywords = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 2)))] if rng.random() < 0.7 else []
+        templates[name] = {'name': name, 'type': 'counter', 'label': rng.choice(LABELS), 'keywords': keywords,
+                           'effect': {key: rng.randint(-2, 3) for key in rng.sample(attributes, 2)}}
+    return TemplateLibrary(templates)
+
+
+def brute_force(library, query, label, effect):
+    """逐条检查的匹配结果：(词首匹配的下标, 其余匹配的下标)，都按库里的顺序"""
+    query = normalize(query)
+    prefixed, others = [], []
+    for i, template in enumerate(library.templates):
+        fields = [normalize(template['name'])] + [normalize(keyword) for keyword in template.get('keywords', ())]
+        if label and template['label'] != label:
+            continue
+        if effect and template['effect'].get(effect, 0) <= 0:
+            continue
+        if query and not any(query in field for field in fields):
+            continue
+        if query and any(word.startswith(query) for field in fields for word in (field, *field.split())):
+            prefixed.append(i)
+        else:
+            others.append(i)
+    return prefixed, others
+
+
+def check_search(library, query, label=None, effect=None, limit=20):
+    result = [library.index[template['name']] for template in library.search(query, label, effect, limit)]
+    prefixed, others = brute_force(library, query, label, effect)
+    assert len(result) == min(limit, len(prefixed) + len(others))
+    assert len(set(result)) == len(result)
+    head = result[:min(limit, len(prefixed))]
+    assert set(head) <= set(prefixed)  # 词首匹配的排在前面
+    assert result[len(head):] == others[:limit - len(head)]  # 其余的按库里的顺序
+
+
+def test_search_matches_brute_force():
+    library = make_library(3000)
+    rng = random.Random(5)
+    queries = ['', 'w', 'wa', 'WATER', 'ter', 'walk tea', 'sleep run', 'zz', '水', '早睡', '读书冥想', '跑步跑步跑']
+    queries += [''.join(rng.choice(CHARS) for _ in range(rng.randint(1, 4))) for _ in range(20)]
+    for query in queries:
+        for label, effect in ((None, None), ('work', None), (None, 'mood'), ('daily', 'sleep')):
+            for limit in (5, 20, 5000):
+                check_search(library, query, label, effect, limit)
+
+
+def test_small_result_sets_are_fully_ranked():
+    library = make_library(200)
+    for query in ('水', 'read', '步1'):
+        result = [library.index[template['name']] for template in library.search(query, limit=1000)]
+        prefixed, others = brute_force(library, query, None, None)
+        assert result == prefixed + others
+
+
+def test_instantiate_returns_a_copy():
+    library = make_library(10)
+    name = library.templates[0]['name']
+    info = library.instantiate(name)
+    info['effect']['mood'] = 99
+    assert library.get(name)['effect'].get('mood') != 99
+    assert set(info) == {'name', 'type', 'effect', 'label'}
+    assert library.instantiate('missing') is None
@@ -1,9 +1,80 @@
+import asyncio
+import copy
 import json
+import os
 
+from objects.state import attributes
 
-def load_profile(filename):
-    with open (filename, 'r', encoding='utf-8') as f:
-        profile = json.load(f)
-        return profile
-    
-    
\ No newline at end of file
+
+# 已解析并校验过的配置文件：绝对路径 -> ((mtime_ns, size), 数据)；文件改动后自动重新读取
+_profiles = {}
+
+
+def check_profile(data):
+    """用户配置 / 默认配置：metrics、decay_rates 只能包含已知属性，值为数字"""
+    if not isinstance(data, dict):
+        raise ValueError('profile must be an object')
+    for section in ('metrics', 'decay_rates'):
+        values = data.get(section, {})
+        if not isinstance(values, dict):
+            raise ValueError(f"'{section}' must be an object")
+        for key, value in values.items():
+            if key not in attributes:
+                raise ValueError(f"unknown attribute '{key}' in '{section}'")
+            if not isinstance(value, (int, float)):
+                raise ValueError(f"'{section}.{key}' must be a number")
+
+
+def check_tasks(data):
+    """任务文件：{任务名: {name, type, effect, label, completed, count}}"""
+    if not isinstance(data, dict):
+        raise ValueError('tasks must be an object')
+    for name, task in data.items():
+        if not isinstance(task, dict) or task.get('name') != name:
+            raise ValueError(f"task '{name}' must be an object with a matching name")
+        if task.get('type') not in ('check', 'counter'):
+            raise ValueError(f"task '{name}' has an unknown type")
+        if any(key not in attributes for key in task.get('effect', {})):
+            raise ValueError(f"task '{name}' has an unknown effect attribute")
+
+
+def check_templates(data):
+    """任务模板库：格式同任务文件，另可带 keywords（字符串列表）"""
+    check_tasks(data)
+    for name, template in data.items():
+        keywords = template.get('keywords', [])
+        if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
+            raise ValueError(f"template '{name}' keywords must be a list of strings")
+
+
+def _cached(filename, check):
+    """缓存里的数据仍然有效时返回它，否则返回 None（只 stat，不读文件）"""
+    stat = os.stat(filename)
+    entry = _profiles.get((os.path.abspath(filename), check))
+    if entry is not None and entry[0] == (stat.st_mtime_ns, stat.st_size):
+        return entry[1]
+    return None
+
+
+def load_profile(filename, check=None):
+    """
+    读取 JSON 配置，check 为校验函数（如 check_profile），不合法时抛 ValueError
+    解析和校验的结果按文件的 mtime 缓存，返回深拷贝，调用方可以随意修改
+    """
+    data = _cached(filename, check)
+    if data is None:
+        stat = os.stat(filename)
+        with open(filename, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if check is not None:
+            check(data)
+        _profiles[(os.path.abspath(filename), check)] = ((stat.st_mtime_ns, stat.st_size), data)
+    return copy.deepcopy(data)
+
+
+async def load_profile_async(filename, check=None):
+    """缓存命中时直接返回，否则在线程里读取，不阻塞事件循环"""
+    data = _cached(filename, check)
+    if data is not None:
+        return copy.deepcopy(data)
+    return await asyncio.to_thread(load_profile, filename, check)